@@ -5,12 +5,12 @@ from flask import (
     redirect,
     url_for,
     request,
+    jsonify,
     flash,
     get_flashed_messages,
 )
 
 from flask_session import Session
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from flask_jwt_extended import JWTManager, unset_jwt_cookies
 from pathlib import Path
@@ -20,7 +20,10 @@ import json
 from flaskr.db_tables import (
     Base,
     UserCredentials,
+    SessionBlobs,
     SessionFiles,
+    SessionSummaries,
+    ProcessingJobs,
     UserClientInfo,
 )
 from flaskr.env_config import (
@@ -29,10 +32,43 @@ from flaskr.env_config import (
     DATABASE_URI,
     CLIENT_BUILD_NUMBER_MINIMAL,
     CLIENT_BUILD_NUMBER_DEPRECATED,
+    SESSION_FILES_COMPRESSION,
+    SESSION_FILES_ACCEL_REDIRECT,
+    SESSION_STORAGE,
+    SESSION_STORAGE_S3_BUCKET,
+    SESSION_STORAGE_S3_PREFIX,
+    SESSION_STORAGE_S3_ENDPOINT_URL,
+    SESSION_STORAGE_S3_REGION,
+    SESSION_STORAGE_URL_EXPIRES_S,
+    SESSION_STORAGE_CACHE_MAX_MB,
+    JOB_WORKERS,
+    JOB_MAX_ATTEMPTS,
+    USER_CACHE_TTL,
+    USER_CACHE_SIZE,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    DB_STATEMENT_TIMEOUT_MS,
+    DB_EXECUTEMANY_MODE,
+    DB_POOL_METRICS,
+    HASH_WORKERS,
+    HASH_QUEUE_LIMIT,
+    PASSHASH_SCHEME,
+    PASSHASH_PEPPER,
 )
+from flaskr.common_files.compression import check_encoding
+from flaskr.common_files.storage import check_storage
+from flaskr.db_migrations import upgrade_schema
+from flaskr.db_engine import create_db_engine
+from flaskr.common_user import load_jwt_user, PASSHASH_SCHEMES
 from flaskr import api
 from flaskr import web
+from flaskr import cli
+from flaskr.jobs import start_job_workers
 
+import click
 from datetime import timedelta
 
 
@@ -52,6 +88,39 @@ def create_app(test_config=None):
         # least session version number accepted
         CLIENT_BUILD_NUMBER_MINIMAL=int(CLIENT_BUILD_NUMBER_MINIMAL),
         CLIENT_BUILD_NUMBER_DEPRECATED=int(CLIENT_BUILD_NUMBER_DEPRECATED),
+        # content encoding of the stored session files, None to store them as is
+        SESSION_FILES_COMPRESSION=SESSION_FILES_COMPRESSION,
+        # prefix of the nginx locations sending the session files, "" if none
+        SESSION_FILES_ACCEL_REDIRECT=SESSION_FILES_ACCEL_REDIRECT.strip(),
+        # backend of the session files, "local" or "s3", see common_files/storage
+        SESSION_STORAGE=SESSION_STORAGE,
+        SESSION_STORAGE_S3_BUCKET=SESSION_STORAGE_S3_BUCKET,
+        SESSION_STORAGE_S3_PREFIX=SESSION_STORAGE_S3_PREFIX,
+        SESSION_STORAGE_S3_ENDPOINT_URL=SESSION_STORAGE_S3_ENDPOINT_URL,
+        SESSION_STORAGE_S3_REGION=SESSION_STORAGE_S3_REGION,
+        SESSION_STORAGE_URL_EXPIRES_S=SESSION_STORAGE_URL_EXPIRES_S,
+        SESSION_STORAGE_CACHE_MAX_MB=SESSION_STORAGE_CACHE_MAX_MB,
+        # background jobs: worker threads per process, attempts per job
+        JOB_WORKERS=JOB_WORKERS,
+        JOB_MAX_ATTEMPTS=JOB_MAX_ATTEMPTS,
+        # cache of the users of the authenticated requests, see common_user
+        USER_CACHE_TTL=USER_CACHE_TTL,
+        USER_CACHE_SIZE=USER_CACHE_SIZE,
+        # database connection pool of each process, see db_engine.py
+        DB_POOL_SIZE=DB_POOL_SIZE,
+        DB_MAX_OVERFLOW=DB_MAX_OVERFLOW,
+        DB_POOL_TIMEOUT=DB_POOL_TIMEOUT,
+        DB_POOL_RECYCLE=DB_POOL_RECYCLE,
+        DB_POOL_PRE_PING=DB_POOL_PRE_PING,
+        DB_STATEMENT_TIMEOUT_MS=DB_STATEMENT_TIMEOUT_MS,
+        DB_EXECUTEMANY_MODE=DB_EXECUTEMANY_MODE,
+        DB_POOL_METRICS=DB_POOL_METRICS,
+        # password hashing of each process: worker processes, waiting hashes
+        HASH_WORKERS=HASH_WORKERS,
+        HASH_QUEUE_LIMIT=HASH_QUEUE_LIMIT,
+        # scheme of the stored password hashes, and key of the HMAC one
+        PASSHASH_SCHEME=PASSHASH_SCHEME,
+        PASSHASH_PEPPER=PASSHASH_PEPPER,
     )
 
     if test_config:
@@ -64,6 +133,19 @@ def create_app(test_config=None):
 
     # configuration
     app.config["SESSION_TYPE"] = "filesystem"
+    check_encoding(app.config["SESSION_FILES_COMPRESSION"])
+    check_storage(app.config)
+    if (scheme := app.config["PASSHASH_SCHEME"]) not in PASSHASH_SCHEMES:
+        raise ValueError(f"Unknown password hash scheme: {scheme}")
+    if not app.config["PASSHASH_PEPPER"]:
+        if app.testing or app.debug or app.config["SECRET_KEY"] == "dev":
+            app.config["PASSHASH_PEPPER"] = "dev"
+        elif scheme == "hmac-sha256":
+            # never derived from another secret: rotating it would invalidate
+            # all the stored password hashes
+            raise ValueError(
+                "PASSHASH_PEPPER is required by the hmac-sha256 password hashes"
+            )
     app.config["JWT_COOKIE_SECURE"] = app.config["SECRET_KEY"] != "dev"
 
     # resources & config created on startup
@@ -103,10 +185,15 @@ def create_app(test_config=None):
         # knows about them before calling create_all.
         assert Base
         assert UserCredentials
+        assert SessionBlobs
         assert SessionFiles
+        assert SessionSummaries
+        assert ProcessingJobs
         assert UserClientInfo
-        engine = create_engine(app.config["SQLALCHEMY_DATABASE_URI"])
+        engine = create_db_engine(app.config)
         Base.metadata.create_all(engine)
+        # indexes and columns added to the models after their tables were created
+        upgrade_schema(engine)
         app.Session = sessionmaker(bind=engine)
 
     # JWT manager
@@ -118,15 +205,40 @@ def create_app(test_config=None):
     # # Blueprints with their routes
     # App client API
     app.register_blueprint(api.v1_bp, url_prefix="/api/v1")
+    app.register_blueprint(api.uploads_bp, url_prefix="/api/v1/session/uploads")
     # Web interface
     app.register_blueprint(web.web_bp, url_prefix="/")
 
+    # # Command line interface
+    app.cli.add_command(cli.compress_sessions_command)
+    app.cli.add_command(cli.run_jobs_command)
+    app.cli.add_command(cli.backfill_session_metadata_command)
+    app.cli.add_command(cli.migrate_sessions_command)
+
+    # # Background job workers of this server process, which also run the jobs
+    # queued before it started. None in command line processes: run-jobs runs
+    # its own, and the other commands are short-lived
+    if click.get_current_context(silent=True) is None:
+        start_job_workers(app)
+
     @app.jwt.expired_token_loader
     def expired_jwt_token_callback(jwt_header, jwt_payload):
         response = redirect("/login")
         unset_jwt_cookies(response)
         return response
 
+    # the user of the JWT, loaded once per request, see get_current_user()
+    app.jwt.user_lookup_loader(load_jwt_user)
+
+    @app.jwt.user_lookup_error_loader
+    def user_lookup_error_callback(jwt_header, jwt_payload):
+        # valid token of a user that no longer exists
+        if request.blueprint and request.blueprint.startswith("api"):
+            return jsonify({"message": "User not found"}), 401
+        response = redirect("/login")
+        unset_jwt_cookies(response)
+        return response
+
     # # Routes
     # @app.route("/admin", methods=["GET", "POST"])  # Pagina de administrador
     # def admin():
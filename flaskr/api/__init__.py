@@ -1,2 +1,3 @@
 # Import the API routes
 from flaskr.api.v1 import v1_bp  # noqa: F401
+from flaskr.api.uploads import uploads_bp  # noqa: F401
@@ -0,0 +1,246 @@
+from flaskr.api.v1 import session_file_uploaded, store_uploaded_session
+from flaskr.common_files import (
+    get_file_for_user_by_name,
+    get_file_for_user_by_sha256,
+    staging_filepath,
+    ResumableUpload,
+    ChunkOffsetError,
+    TooManyUploadsError,
+)
+
+from flask.blueprints import Blueprint
+from flask import request, jsonify, current_app
+from flask_jwt_extended import jwt_required, get_current_user
+from werkzeug.utils import secure_filename
+import re
+
+
+# Create a Blueprint for the resumable uploads API, next to the v1 API
+uploads_bp = Blueprint("api_uploads", __name__)
+
+sha256_validator = re.compile(r"^[0-9a-fA-F]{64}$")
+
+
+@uploads_bp.route("", methods=["POST"])
+@jwt_required()
+def open_upload():
+    """
+    Open a resumable upload of a session file.
+    The file is then sent in numbered chunks and committed when complete.
+
+    Request data
+    ------------
+    {
+        "filename": "string",
+        "size": int,  # total size of the file, in bytes, up to 100 MiB
+        "sha256": "string"  # optional, hex digest of the whole file
+    }
+
+    Response data
+    -------------
+    {
+        "upload_id": "string",
+        "filename": "string",
+        "size": int,
+        "offset": int,  # bytes acknowledged so far
+        "next_index": int,  # number of the next chunk to send
+        "max_chunk_size": int
+    }
+
+    Returns
+    -------
+    200: Session file already uploaded, the user has a file with that sha256;
+        with its "file_id" and the "status_url" to poll its processing
+    201: Upload opened
+    400: Invalid fields
+    401: User not found
+    409: File already exists
+    413: File is too big
+    429: Too many uploads open; finish or abort one of them first
+    """
+    user = get_current_user()
+    if not user:
+        return jsonify({"message": "User not found"}), 401
+
+    data = request.get_json()
+    filename = secure_filename(data.get("filename") or "")
+    size = data.get("size")
+    sha256 = data.get("sha256")
+
+    # bool is a subclass of int
+    if not filename or type(size) is not int or size <= 0:
+        return jsonify({"message": "Invalid fields"}), 400
+    if sha256 is not None and not sha256_validator.match(sha256):
+        return jsonify({"message": "Invalid fields"}), 400
+
+    # the same contents already uploaded, e.g. under another name
+    if sha256 is not None and (
+        existing_file := get_file_for_user_by_sha256(user, sha256)
+    ):
+        return session_file_uploaded(existing_file, created=False)
+    if get_file_for_user_by_name(user, filename):
+        return jsonify({"message": "File already exists"}), 409
+
+    try:
+        upload = ResumableUpload.create(user, filename, size, sha256)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 413
+    except TooManyUploadsError as e:
+        return jsonify({"message": str(e)}), 429
+    return jsonify(upload.to_json()), 201
+
+
+@uploads_bp.route("/<upload_id>", methods=["GET"])
+@jwt_required()
+def upload_status(upload_id: str):
+    """
+    Get the state of a resumable upload, to resume it.
+
+    Response data
+    -------------
+    Same as when opening the upload.
+
+    Returns
+    -------
+    200: Upload found
+    401: User not found
+    404: Upload not found
+    """
+    user = get_current_user()
+    if not user:
+        return jsonify({"message": "User not found"}), 401
+
+    upload = ResumableUpload.load(user, upload_id)
+    if not upload:
+        return jsonify({"message": "Upload not found"}), 404
+
+    return jsonify(upload.to_json()), 200
+
+
+@uploads_bp.route("/<upload_id>/chunks/<int:index>", methods=["PUT"])
+@jwt_required()
+def put_chunk(upload_id: str, index: int):
+    """
+    Send a chunk of a resumable upload.
+    The body of the request is the raw bytes of the chunk.
+
+    Request headers
+    ---------------
+    Upload-Offset: int, position of the chunk in the file
+    Chunk-SHA256: string, hex digest of the chunk
+
+    Response data
+    -------------
+    Same as when opening the upload.
+
+    Returns
+    -------
+    200: Chunk acknowledged (or already acknowledged)
+    400: Missing headers, checksum mismatch or chunk too big
+    401: User not found
+    404: Upload not found
+    409: Chunk does not continue the upload; resume from the returned state
+    """
+    user = get_current_user()
+    if not user:
+        return jsonify({"message": "User not found"}), 401
+
+    upload = ResumableUpload.load(user, upload_id)
+    if not upload:
+        return jsonify({"message": "Upload not found"}), 404
+
+    offset = request.headers.get("Upload-Offset", type=int)
+    sha256 = request.headers.get("Chunk-SHA256", "")
+    if offset is None or not sha256_validator.match(sha256):
+        return jsonify({"message": "Upload-Offset and Chunk-SHA256 are required"}), 400
+
+    try:
+        upload.write_chunk(index, offset, request.stream, sha256)
+    except ChunkOffsetError as e:
+        return jsonify({"message": str(e), **upload.to_json()}), 409
+    except ValueError as e:
+        return jsonify({"message": str(e), **upload.to_json()}), 400
+    except FileNotFoundError:
+        return jsonify({"message": "Upload not found"}), 404
+
+    return jsonify(upload.to_json()), 200
+
+
+@uploads_bp.route("/<upload_id>/commit", methods=["POST"])
+@jwt_required()
+def commit_upload(upload_id: str):
+    """
+    Commit a complete resumable upload as a session file of the user.
+    Retrying a commit is harmless: once stored, it gets the stored file.
+
+    Returns
+    -------
+    200: Session file already uploaded, with the same contents under this or
+        another name, e.g. by a previous commit; with its "file_id" and
+        "status_url"
+    201: Session file uploaded successfully, with its "file_id" and the
+        "status_url" to poll its processing
+    400: Upload is incomplete, checksum mismatch or file is not UTF-8 text
+    401: User not found
+    404: Upload not found
+    409: File already exists
+    """
+    user = get_current_user()
+    if not user:
+        return jsonify({"message": "User not found"}), 401
+
+    upload = ResumableUpload.load(user, upload_id)
+    if not upload:
+        return jsonify({"message": "Upload not found"}), 404
+
+    encoding = current_app.config["SESSION_FILES_COMPRESSION"]
+    try:
+        with upload.locked(), staging_filepath(encoding) as staged_path:
+            if upload.committed_sha256:
+                # a retry, e.g. the response to the commit was lost
+                if existing_file := get_file_for_user_by_sha256(
+                    user, upload.committed_sha256
+                ):
+                    return session_file_uploaded(existing_file, created=False)
+                return jsonify({"message": "Upload not found"}), 404
+            try:
+                sha256 = upload.commit_to(staged_path, encoding=encoding)
+            except ValueError as e:
+                return jsonify({"message": str(e), **upload.to_json()}), 400
+
+            response, status = store_uploaded_session(
+                user, upload.filename, staged_path, sha256, upload.size
+            )
+            # kept for another commit otherwise, or until it expires
+            if status in (200, 201):
+                upload.mark_committed(sha256)
+            return response, status
+    except FileNotFoundError:
+        return jsonify({"message": "Upload not found"}), 404
+
+
+@uploads_bp.route("/<upload_id>", methods=["DELETE"])
+@jwt_required()
+def abort_upload(upload_id: str):
+    """
+    Abort a resumable upload, discarding the received chunks.
+
+    Returns
+    -------
+    204: Upload aborted
+    401: User not found
+    404: Upload not found
+    """
+    user = get_current_user()
+    if not user:
+        return jsonify({"message": "User not found"}), 401
+
+    upload = ResumableUpload.load(user, upload_id)
+    if not upload:
+        return jsonify({"message": "Upload not found"}), 404
+
+    try:
+        upload.discard()
+    except FileNotFoundError:
+        return jsonify({"message": "Upload not found"}), 404
+    return "", 204
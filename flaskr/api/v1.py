@@ -1,26 +1,113 @@
-from flaskr.db_tables import SessionFiles
 from flaskr.common_user import (
     CredentialsValidator,
     valid_login,
     register_user,
     get_user_by_email,
+    decoy_salt,
+    HashingBusyError,
+    RETRY_AFTER_S,
 )
 from flaskr.common_files import (
-    get_sessions_dir_for_user,
+    staging_filepath,
+    save_stream_atomically,
+    save_encoded_stream_atomically,
+    add_session_file,
+    delete_session_file,
+    get_file_for_user_by_id,
+    get_file_for_user_by_sha256,
+    read_session_metadata,
+)
+from flaskr.common_files.compression import (
+    ENCODING_SUFFIXES,
+    get_file_encoding,
+)
+from flaskr.db_tables import SessionFiles
+
+from flaskr.db_engine import pool_metrics
+from flaskr.jobs import (
+    JOB_HANDLERS,
+    get_jobs_for_file,
+    notify_jobs_enqueued,
+    overall_status,
 )
 
 from flask.blueprints import Blueprint
-from flask import request, jsonify, current_app
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask import request, jsonify, current_app, url_for
+from flask_jwt_extended import create_access_token, jwt_required, get_current_user
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
-import time
+from pathlib import Path
+import hashlib
 
 
 # Create a Blueprint for the API
 v1_bp = Blueprint("api", __name__)
 
 
+def session_file_uploaded(session_file: SessionFiles, created: bool = True):
+    """
+    Response to the upload of a session file: 201 if stored now, or 200 if the
+    user already had it. Either way, with its "file_id" and the "status_url" to
+    poll its processing.
+    """
+    if created:
+        message, status = "Session file uploaded successfully", 201
+    else:
+        message, status = "Session file already uploaded", 200
+    return jsonify(
+        {
+            "message": message,
+            "file_id": session_file.id,
+            "status_url": url_for("api.session_status", file_id=session_file.id),
+        }
+    ), status
+
+
+def store_uploaded_session(
+    user, filename: str, staged_path: Path, sha256: str, size_bytes: int
+):
+    """
+    Store a staged upload as a session file of the user, and enqueue its
+    processing. Response to the upload, see ``session_file_uploaded``, or 409
+    if the user has another file with that name.
+
+    The name is claimed in the transaction that stores the file, so of
+    concurrent uploads of a name only one is stored.
+    """
+    # the same contents sent again, e.g. a retry: nothing new is stored
+    if existing_file := get_file_for_user_by_sha256(user, sha256):
+        return session_file_uploaded(existing_file, created=False)
+
+    # save the file to the blob store, unless already there, and the
+    # filename to the database, with the metadata of its header
+    try:
+        session_file = add_session_file(
+            user,
+            filename,
+            staged_path,
+            sha256=sha256,
+            size_bytes=size_bytes,
+            job_kinds=JOB_HANDLERS,
+            **read_session_metadata(staged_path),
+        )
+    except ValueError:
+        # taken meanwhile, possibly by a concurrent retry of this upload
+        if existing_file := get_file_for_user_by_sha256(user, sha256):
+            return session_file_uploaded(existing_file, created=False)
+        return jsonify({"message": "File already exists"}), 409
+
+    # derived artifacts are built in the background, see flaskr.jobs
+    notify_jobs_enqueued()
+    return session_file_uploaded(session_file)
+
+
+def server_busy():
+    """
+    Response to requests rejected because the password hashing is saturated.
+    """
+    return jsonify({"message": "Server busy"}), 503, {"Retry-After": RETRY_AFTER_S}
+
+
 @v1_bp.route("/up", methods=["GET"])
 def up():
     """
@@ -74,9 +161,9 @@ def salt():
 
     Returns
     -------
-    200: Salt found
+    200: Salt of the user. Emails not registered get a decoy salt, the same
+        on every request, so this endpoint does not tell which are registered.
     400: email field is required
-    404: User not found
     """
     data = request.headers
     email = data.get("email")
@@ -85,12 +172,9 @@ def salt():
         return jsonify({"message": "email is required"}), 400
 
     user = get_user_by_email(email)
+    pass_salt = user.salt if user else decoy_salt(email)
 
-    if not user:
-        time.sleep(1.5)
-        return jsonify({"message": "User not found"}), 404
-
-    return jsonify({"passSalt": user.salt}), 200
+    return jsonify({"passSalt": pass_salt}), 200
 
 
 @v1_bp.route("/register", methods=["POST"])
@@ -112,6 +196,7 @@ def register():
     201: User registered successfully
     400: All fields are required
     409: Email already registered
+    503: Server busy, retry after the seconds of the Retry-After header
     """
     data = request.get_json()
     username = data.get("username")
@@ -139,6 +224,8 @@ def register():
         )
     except ValueError:
         return jsonify({"message": "Email already registered"}), 409
+    except HashingBusyError:
+        return server_busy()
 
     return jsonify({"message": "User registered successfully"}), 201
 
@@ -192,6 +279,12 @@ def login():
         {
             "message": "Client version too old. Minimum required version is <number>."
         }
+
+    503: Server busy, retry after the seconds of the Retry-After header
+
+        {
+            "message": "Server busy"
+        }
     """
     data = request.get_json()
     email = data.get("email")
@@ -219,6 +312,8 @@ def login():
         return jsonify({"message": "User not found"}), 404
     except ValueError:
         return jsonify({"message": "Incorrect password"}), 401
+    except HashingBusyError:
+        return server_busy()
 
     # create a random unique token for the user
     access_token = create_access_token(identity=user.email, fresh=True)
@@ -245,58 +340,197 @@ def upload_session_file():
     The file should be sent as a form-data field named "file".
     The file should be a text file with the session data.
     The filename should be unique and should not contain any special characters.
-    The file will be saved in the instance/sessions/<user-id> folder.
+    The file will be saved in the blob store of instance/sessions, once per
+    distinct contents, see flaskr.common_files.blob_store.
     The filename will be saved in the database.
     The user must be authenticated with a valid JWT token.
 
+    Pre-compressed files (gzip or zstd) are stored as sent, either:
+
+    - as a form-data file named "<filename>.gz" or "<filename>.zst", or with a
+      Content-Encoding header in its part, or
+    - as the raw request body with a Content-Encoding header, and the filename
+      in the "filename" query parameter.
+
     Returns
     -------
-    201: Session file uploaded successfully
-    400: File is required or only one file is allowed
+    200: Session file already uploaded, with the same contents under this or
+        another name; with its "file_id" and "status_url"
+    201: Session file uploaded successfully, with its "file_id" and the
+        "status_url" to poll its processing
+    400: File is required, only one file is allowed or file is not a valid
+        session file (UTF-8 text, with a JSON header line if compressed)
     401: User not found (if the JWT token is invalid or user does not exist)
     409: File already exists
+    415: Unsupported Content-Encoding
     """
-    email_identity = get_jwt_identity()
+    user = get_current_user()
+
+    if not user:
+        return jsonify({"message": "User not found"}), 401
+
+    if request.mimetype != "multipart/form-data" and (
+        upload_encoding := request.headers.get("Content-Encoding")
+    ):
+        # raw compressed body
+        filename = request.args.get("filename", "")
+        stream = request.stream
+    else:
+        files_in_form = request.files
+        if (len_files := len(files_in_form)) != 1:
+            if len_files == 0:
+                return jsonify({"message": "File is required"}), 400
+            else:  # len_files > 1
+                return jsonify(
+                    {"message": "Only one file is allowed at the moment"}
+                ), 400
+
+        content: FileStorage = next(iter(files_in_form.values()))
+        filename = content.filename or ""
+        stream = content.stream
+        upload_encoding = content.headers.get(
+            "Content-Encoding"
+        ) or get_file_encoding(Path(filename))
+
+    if upload_encoding is not None:
+        upload_encoding = upload_encoding.strip().lower()
+        if upload_encoding not in ENCODING_SUFFIXES:
+            return jsonify({"message": "Unsupported Content-Encoding"}), 415
+        filename = filename.removesuffix(ENCODING_SUFFIXES[upload_encoding])
+
+    # ensure secure filename
+    filename = secure_filename(filename)
+    if not filename:
+        return jsonify({"message": "File is required"}), 400
+
+    # stream the file to a staging file, so memory usage does not grow with its
+    # size, hashing it on the way; compressed uploads are stored as they are,
+    # others compressed if configured
+    hasher = hashlib.sha256()
+    encoding = upload_encoding or current_app.config["SESSION_FILES_COMPRESSION"]
+    with staging_filepath(encoding) as staged_path:
+        if upload_encoding:
+            try:
+                size_bytes = save_encoded_stream_atomically(
+                    stream, staged_path, upload_encoding, hasher=hasher
+                )
+            except ValueError as e:
+                return jsonify({"message": f"Invalid session file: {e}"}), 400
+        else:
+            try:
+                size_bytes = save_stream_atomically(
+                    stream, staged_path, encoding=encoding, hasher=hasher
+                )
+            except UnicodeDecodeError:
+                return jsonify({"message": "File must be UTF-8 text"}), 400
+
+        return store_uploaded_session(
+            user, filename, staged_path, hasher.hexdigest(), size_bytes
+        )
 
-    user = get_user_by_email(email_identity)
 
+@v1_bp.route("/session/<int:file_id>", methods=["DELETE"])
+@jwt_required()
+def delete_session(file_id: int):
+    """
+    Delete an uploaded session file, with its summaries.
+
+    Returns
+    -------
+    200: Session file deleted
+    401: User not found
+    404: File not found
+    """
+    user = get_current_user()
     if not user:
         return jsonify({"message": "User not found"}), 401
 
-    files_in_form = request.files
-    if (len_files := len(files_in_form)) != 1:
-        if len_files == 0:
-            return jsonify({"message": "File is required"}), 400
-        else:  # len_files > 1
-            return jsonify({"message": "Only one file is allowed at the moment"}), 400
-
-    filename: str
-    content: FileStorage
-    for _, content in files_in_form.items():
-        filename = content.filename
-        content = content.read().decode("utf-8")
-        # ensure secure filename
-        filename = secure_filename(filename)
-
-        # save the file to the server in the instance/sessions/<user-id> folder
-        # and save the filename to the database
-        user_sessions_dir = get_sessions_dir_for_user(user)
-        user_sessions_dir.mkdir(parents=True, exist_ok=True)
-        filepath = user_sessions_dir / filename
-
-        if filepath.exists():
-            return jsonify({"message": "File already exists"}), 409
-
-        with open(filepath, "w") as f:
-            f.write(content)
-
-        # save the filename to the database
-        new_file = SessionFiles(user.id, filename)
-        with current_app.Session() as sql_db:
-            sql_db.add(new_file)
-            sql_db.commit()
-
-        return jsonify({"message": "Session file uploaded successfully"}), 201
+    session_file = get_file_for_user_by_id(user, file_id)
+    if not session_file:
+        return jsonify({"message": "File not found"}), 404
+
+    delete_session_file(session_file)
+    return jsonify({"message": "Session file deleted"}), 200
+
+
+@v1_bp.route("/session/<int:file_id>/status", methods=["GET"])
+@jwt_required()
+def session_status(file_id: int):
+    """
+    Get the status of the background processing of an uploaded session file.
+
+    Response data
+    -------------
+    {
+        "file_id": int,
+        "filename": "string",
+        "status": "queued" | "running" | "done" | "failed",
+        "jobs": [
+            {"kind": "string", "status": "string", "attempts": int,
+             "error": "string" | null}
+        ]
+    }
+
+    Returns
+    -------
+    200: Status of the file
+    401: User not found
+    404: File not found
+    """
+    user = get_current_user()
+    if not user:
+        return jsonify({"message": "User not found"}), 401
+
+    session_file = get_file_for_user_by_id(user, file_id)
+    if not session_file:
+        return jsonify({"message": "File not found"}), 404
+
+    jobs = get_jobs_for_file(session_file)
+    return jsonify(
+        {
+            "file_id": session_file.id,
+            "filename": session_file.filename,
+            "status": overall_status(jobs),
+            "jobs": [
+                {
+                    "kind": job.kind,
+                    "status": job.status,
+                    "attempts": job.attempts,
+                    "error": job.last_error,
+                }
+                for job in jobs
+            ],
+        }
+    ), 200
+
+
+@v1_bp.route("/metrics/db_pool", methods=["GET"])
+def db_pool_metrics():
+    """
+    Get the metrics of the database connection pool of the server process
+    answering the request. Only served with DB_POOL_METRICS enabled.
+
+    Response data
+    -------------
+    {
+        "pid": int,
+        "pool_size": int,
+        "checked_out": int,
+        "overflow": int,
+        "checkouts": int,
+        "checkout_wait_s_mean": float,
+        "checkout_wait_s_max": float,
+        ...
+    }
+
+    Returns
+    -------
+    200: Metrics of the pool
+    404: Metrics disabled
+    """
+    if not current_app.config["DB_POOL_METRICS"]:
+        return jsonify({"message": "Not found"}), 404
+    return jsonify(pool_metrics(current_app.Session.kw["bind"])), 200
 
 
 @v1_bp.route("/privacy-policy", methods=["GET"])
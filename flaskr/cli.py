@@ -0,0 +1,214 @@
+"""
+Maintenance commands, run with ``flask --app flaskr <command>``.
+"""
+
+from flaskr.common_files import (
+    file_digest,
+    get_sessions_dir,
+    get_stored_filepath,
+    migrate_legacy_file,
+    read_session_metadata,
+    save_stream_atomically,
+)
+from flaskr.common_files.compression import (
+    ENCODING_SUFFIXES,
+    check_encoding,
+    get_file_encoding,
+    stored_name,
+)
+
+from flaskr.db_tables import SessionFiles
+from flaskr.jobs import job_worker_loop, run_pending_jobs
+
+from flask import current_app
+from flask.cli import with_appcontext
+import click
+
+import multiprocessing
+
+
+@click.command("compress-sessions")
+@click.option(
+    "--encoding",
+    type=click.Choice(list(ENCODING_SUFFIXES)),
+    default=None,
+    help="Compression to use. Defaults to SESSION_FILES_COMPRESSION.",
+)
+@with_appcontext
+def compress_sessions_command(encoding: str | None):
+    """
+    Compress the uncompressed session files in place, reporting the space saved.
+
+    Files can be compressed while the server is running: each one is written
+    next to the original and the original is removed after. Only the files in
+    the directories of the users are compressed; those in the blob store are
+    kept as uploaded.
+    """
+    encoding = encoding or current_app.config["SESSION_FILES_COMPRESSION"]
+    if encoding is None:
+        raise click.UsageError(
+            "No compression selected. Use --encoding or SESSION_FILES_COMPRESSION."
+        )
+    check_encoding(encoding)
+
+    n_files = size_before = size_after = 0
+    sessions_dir = get_sessions_dir()
+    if not sessions_dir.exists():
+        click.echo("No sessions directory, nothing to compress.")
+        return
+
+    for user_dir in sorted(sessions_dir.iterdir()):
+        if not user_dir.is_dir() or user_dir.name.startswith("."):
+            continue
+        for filepath in sorted(user_dir.iterdir()):
+            if (
+                filepath.is_dir()
+                or filepath.name.startswith(".")
+                or get_file_encoding(filepath)
+            ):
+                continue  # sidecar, temporary or already compressed
+            compressed_path = user_dir / stored_name(filepath.name, encoding)
+            try:
+                with filepath.open("rb") as f:
+                    save_stream_atomically(f, compressed_path, encoding=encoding)
+            except UnicodeDecodeError:
+                click.echo(f"Skipped {filepath}: not UTF-8 text", err=True)
+                continue
+            n_files += 1
+            size_before += filepath.stat().st_size
+            size_after += compressed_path.stat().st_size
+            filepath.unlink()
+
+    saved = size_before - size_after
+    click.echo(
+        f"Compressed {n_files} files with {encoding}: "
+        f"{size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB, "
+        f"saved {saved / 1e6:.1f} MB"
+        + (f" ({saved / size_before:.0%})" if size_before else "")
+    )
+
+
+@click.command("backfill-session-metadata")
+@with_appcontext
+def backfill_session_metadata_command():
+    """
+    Fill in the metadata of the session files stored before it was kept.
+
+    The size, SHA-256 and header fields of each file without a SHA-256 are
+    read from the stored file. The upload time is left empty: it is unknown.
+    """
+    n_files = n_missing = 0
+    with current_app.Session() as sql_db:
+        files = (
+            sql_db.query(SessionFiles)
+            .filter(SessionFiles.sha256.is_(None))
+            .order_by(SessionFiles.id)
+            .all()
+        )
+        for file in files:
+            filepath = get_stored_filepath(file)
+            if filepath is None:
+                click.echo(f"Skipped {file.filename} ({file.id}): missing", err=True)
+                n_missing += 1
+                continue
+            file.size_bytes, file.sha256 = file_digest(filepath)
+            for column, value in read_session_metadata(filepath).items():
+                setattr(file, column, value)
+            sql_db.commit()
+            n_files += 1
+
+    click.echo(f"Filled in the metadata of {n_files} files, {n_missing} missing.")
+
+
+@click.command("migrate-sessions")
+@with_appcontext
+def migrate_sessions_command():
+    """
+    Move the session files stored in the directories of the users to the blob
+    store, and remove the emptied directories.
+
+    Files can be moved while the server is running: each one is served from
+    its old place until its database entry points at its blob.
+    """
+    n_files = n_duplicates = n_missing = 0
+    with current_app.Session() as sql_db:
+        files = (
+            sql_db.query(SessionFiles)
+            .filter(SessionFiles.blob_id.is_(None))
+            .order_by(SessionFiles.id)
+            .all()
+        )
+    for file in files:
+        try:
+            n_duplicates += migrate_legacy_file(file)
+        except FileNotFoundError:
+            click.echo(f"Skipped {file.filename} ({file.id}): missing", err=True)
+            n_missing += 1
+            continue
+        except ValueError:
+            continue  # moved meanwhile by another run
+        n_files += 1
+
+    sessions_dir = get_sessions_dir()
+    if sessions_dir.exists():
+        for user_dir in sessions_dir.iterdir():
+            if user_dir.is_dir() and not user_dir.name.startswith("."):
+                try:
+                    user_dir.rmdir()
+                except OSError:
+                    pass  # not empty, e.g. files not in the database
+
+    click.echo(
+        f"Moved {n_files} files to the blob store, {n_duplicates} of them "
+        f"already stored; {n_missing} missing."
+    )
+
+
+def _job_worker_process():
+    """
+    Entry point of a worker process of the run-jobs command.
+    """
+    from flaskr import create_app
+
+    job_worker_loop(create_app())
+
+
+@click.command("run-jobs")
+@click.option(
+    "--processes",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of worker processes.",
+)
+@click.option("--once", is_flag=True, help="Run the pending jobs and exit.")
+@with_appcontext
+def run_jobs_command(processes: int, once: bool):
+    """
+    Run the background jobs of the uploaded session files.
+
+    Workers keep polling the job queue until interrupted. They can run next to
+    the server, or replace its worker threads with JOB_WORKERS=0.
+    """
+    if once:
+        n_jobs = run_pending_jobs()
+        click.echo(f"Ran {n_jobs} jobs.")
+        return
+
+    if processes == 1:
+        job_worker_loop(current_app._get_current_object())
+        return
+
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=_job_worker_process, name=f"job-worker-{i}")
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
@@ -2,5 +2,71 @@ from .files import (  # noqa: F401
     get_sessions_dir,
     get_sessions_dir_for_user,
     get_file_for_user_by_name,
+    get_file_for_user_by_id,
     get_files_for_user,
+    get_files_for_user_in_period,
+    session_accel_path,
+    save_stream_atomically,
+    save_encoded_stream_atomically,
+)
+from .blob_store import (  # noqa: F401
+    add_session_file,
+    delete_session_file,
+    get_artifacts_filepath,
+    get_blob_key,
+    get_blobs_dir,
+    get_columns_key,
+    get_file_for_user_by_sha256,
+    get_session_filepath_for_user,
+    get_storage,
+    get_stored_filepath,
+    get_stored_location,
+    migrate_legacy_file,
+    staging_filepath,
+)
+from .storage import (  # noqa: F401
+    LocalStorage,
+    ObjectInfo,
+    S3Storage,
+    SessionStorage,
+    check_storage,
+    ensure_dir,
+)
+from .resumable_uploads import (  # noqa: F401
+    ResumableUpload,
+    ChunkOffsetError,
+    TooManyUploadsError,
+    get_uploads_dir,
+    sweep_uploads,
+)
+from .session_parser import (  # noqa: F401
+    ParsedSession,
+    iter_session_chunks,
+    parse_session,
+)
+from .session_columns import (  # noqa: F401
+    build_session_columns,
+    load_session_columns,
+)
+from .session_summary import (  # noqa: F401
+    compute_session_summaries,
+    get_files_with_summary_for_user,
+    get_session_summaries,
+    store_session_summaries,
+)
+from .session_metadata import (  # noqa: F401
+    file_digest,
+    header_metadata,
+    read_session_header,
+    read_session_metadata,
+)
+from .session_archive import (  # noqa: F401
+    iter_sessions_zip,
+)
+from .processing import (  # noqa: F401
+    build_session_artifacts,
+)
+from .trace_pyramid import (  # noqa: F401
+    build_trace_pyramid,
+    query_viewport,
 )
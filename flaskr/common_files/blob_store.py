@@ -0,0 +1,545 @@
+"""
+Content-addressed store of the session files.
+
+Each distinct content is stored once, as a blob named after the SHA-256 of its
+decompressed bytes, with its derived artifacts next to it::
+
+    sessions/.blobs/3f/9a/3f9a...c2.gz
+    sessions/.blobs/3f/9a/3f9a...c2.columns/
+
+``SessionFiles`` rows point at their blob, and ``SessionBlobs.refcount``
+counts them: a session uploaded again, under another name or by another user,
+adds a row but costs no disk. Uploads are saved to a staging file while they
+are hashed, then moved to their blob, or dropped if the blob already exists.
+
+The names are fixed-length and never change, and the two levels of 256
+directories keep each one small: with millions of files, a directory of the
+store holds tens of entries. The directories are created once per process.
+
+The blobs are kept by the backend of ``SESSION_STORAGE``, see ``storage``:
+in this directory, or in an object store with local copies laid out the same.
+The artifacts are built locally by the processing jobs, then stored as well,
+see ``get_artifacts_filepath``. Staging files are always local.
+
+Files stored before the blob store (``blob_id`` null) are kept in the
+directory of their user, ``sessions/<email>/``, until moved to the store with
+``migrate_legacy_file`` (the migrate-sessions command).
+"""
+
+from flaskr.db_tables import (
+    ProcessingJobs,
+    SessionBlobs,
+    SessionFiles,
+    SessionSummaries,
+    UserCredentials,
+)
+from .compression import find_session_file, get_file_encoding, stored_name
+from .files import (
+    get_file_for_user_by_name,
+    get_sessions_dir,
+    get_sessions_dir_for_user,
+)
+from .session_columns import COLUMNS_SUFFIX, get_columns_dir
+from .session_metadata import file_digest
+from .storage import (
+    LocalStorage,
+    S3Storage,
+    SessionStorage,
+    create_s3_client,
+    ensure_dir,
+)
+
+from flask import current_app
+import sqlalchemy
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path, PurePosixPath
+from typing import Iterable, Iterator
+import os
+import shutil
+import uuid
+
+
+def get_blobs_dir() -> Path:
+    """
+    Get the directory of the blob store, inside the sessions directory.
+    """
+    return get_sessions_dir() / ".blobs"
+
+
+def get_storage() -> SessionStorage:
+    """
+    Get the backend storing the blobs, as configured in ``SESSION_STORAGE``.
+
+    The client of an object store is created once per app, and shared by its
+    threads.
+    """
+    config = current_app.config
+    if config["SESSION_STORAGE"] != "s3":
+        return LocalStorage(get_blobs_dir())
+    client = current_app.extensions.get("session_storage_s3")
+    if client is None:
+        client = create_s3_client(config)
+        current_app.extensions["session_storage_s3"] = client
+    return S3Storage(
+        get_blobs_dir(),
+        client,
+        config["SESSION_STORAGE_S3_BUCKET"],
+        config["SESSION_STORAGE_S3_PREFIX"],
+        config["SESSION_STORAGE_URL_EXPIRES_S"],
+    )
+
+
+def get_blob_key(sha256: str, encoding: str | None) -> str:
+    """
+    Get the key of a blob in the store, fanned out by the first digits of its
+    hash.
+
+    Parameters
+    ----------
+    sha256 : str
+        Hex SHA-256 of the decompressed contents.
+    encoding : str | None
+        Content encoding of the stored blob, ``None`` if uncompressed.
+
+    Returns
+    -------
+    str
+        Key of the blob, e.g. ``3f/9a/3f9a...c2.gz``.
+    """
+    return f"{sha256[:2]}/{sha256[2:4]}/{stored_name(sha256, encoding)}"
+
+
+@contextmanager
+def staging_filepath(encoding: str | None) -> Iterator[Path]:
+    """
+    Get a unique path to save an upload to before its hash is known.
+    Whatever is left there is removed on exit.
+
+    Parameters
+    ----------
+    encoding : str | None
+        Content encoding the upload is stored with, for the suffix of the file.
+    """
+    staging_dir = ensure_dir(get_blobs_dir() / ".staging")
+    filepath = staging_dir / stored_name(uuid.uuid4().hex, encoding)
+    try:
+        yield filepath
+    finally:
+        filepath.unlink(missing_ok=True)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _acquire_blob(
+    sql_db, sha256: str, size_bytes: int, encoding: str | None
+) -> tuple[int, str | None]:
+    """
+    Add a reference to the blob of some contents, creating it if it is new.
+
+    Returns the id of the blob, and the key to store the contents at before
+    the commit, ``None`` if they are stored already. Raises ``IntegrityError``
+    if the blob was created meanwhile by another transaction.
+    """
+    updated = sql_db.execute(
+        sqlalchemy.update(SessionBlobs)
+        .where(SessionBlobs.sha256 == sha256)
+        .values(refcount=SessionBlobs.refcount + 1)
+    ).rowcount
+    if updated:
+        blob = sql_db.query(SessionBlobs).filter_by(sha256=sha256).one()
+        if get_storage().exists(get_blob_key(sha256, blob.encoding)):
+            return blob.id, None
+        # lost from the store, e.g. with a database restored from a backup
+        blob.encoding = encoding
+    else:
+        blob = SessionBlobs(sha256, size_bytes, encoding)
+        sql_db.add(blob)
+        sql_db.flush()  # raises IntegrityError if created meanwhile
+    return blob.id, get_blob_key(sha256, encoding)
+
+
+def add_session_file(
+    user: UserCredentials,
+    filename: str,
+    staged_path: Path,
+    sha256: str,
+    size_bytes: int,
+    job_kinds: Iterable[str] = (),
+    **metadata,
+) -> SessionFiles:
+    """
+    Register a session file of a user in the database, uploaded now, storing
+    its contents unless they are already stored.
+
+    Its processing jobs are enqueued in the same transaction, so a stored file
+    always has them.
+
+    Parameters
+    ----------
+    user : UserCredentials
+        Owner of the file.
+    filename : str
+        Name of the file.
+    staged_path : Path
+        Staged file with the contents, see ``staging_filepath``. It is moved to
+        the blob store if the contents are new, and left otherwise.
+    sha256 : str
+        Hex SHA-256 of the decompressed contents.
+    size_bytes : int
+        Size of the decompressed contents, in bytes.
+    job_kinds : Iterable[str], optional
+        Kinds of the ``ProcessingJobs`` to enqueue for the file, see
+        ``flaskr.jobs.JOB_HANDLERS``.
+    **metadata
+        Other columns of ``SessionFiles``, e.g. those of
+        ``read_session_metadata``.
+
+    Returns
+    -------
+    SessionFiles
+        The new file entry.
+
+    Raises
+    ------
+    ValueError
+        If the user already has a file with that name. Nothing is stored.
+    """
+    encoding = get_file_encoding(staged_path)
+    metadata.setdefault("uploaded_at", _utcnow())
+    for attempt in range(2):
+        with current_app.Session(expire_on_commit=False) as sql_db:
+            try:
+                blob_id, blob_key = _acquire_blob(
+                    sql_db, sha256, size_bytes, encoding
+                )
+            except sqlalchemy.exc.IntegrityError:
+                # the blob was created meanwhile by a concurrent upload
+                if attempt:
+                    raise
+                continue
+            new_file = SessionFiles(
+                user.id,
+                filename,
+                blob_id=blob_id,
+                sha256=sha256,
+                size_bytes=size_bytes,
+                **metadata,
+            )
+            sql_db.add(new_file)
+            try:
+                # the unique (user_id, filename) index decides between
+                # concurrent uploads of a name; the others are rolled back
+                sql_db.flush()
+            except sqlalchemy.exc.IntegrityError:
+                raise ValueError("File already exists") from None
+            sql_db.add_all(
+                ProcessingJobs(new_file.id, kind, metadata["uploaded_at"])
+                for kind in job_kinds
+            )
+            # stored once the name is taken, so the losers leave nothing
+            # behind, and before the commit, so a file in the database always
+            # has its contents; a blob left by a failed commit is replaced by
+            # the next upload of the same contents
+            if blob_key is not None:
+                get_storage().store_file(blob_key, staged_path)
+            sql_db.commit()
+        return new_file
+
+
+def get_file_for_user_by_sha256(
+    user: UserCredentials, sha256: str
+) -> SessionFiles | None:
+    """
+    Get a file of a user by its contents.
+
+    Parameters
+    ----------
+    user : UserCredentials
+        User that owns the file.
+    sha256 : str
+        Hex SHA-256 of the decompressed contents.
+
+    Returns
+    -------
+    SessionFiles | None
+        The first file with those contents, ``None`` if the user has none.
+    """
+    try:
+        with current_app.Session() as sql_db:
+            file = (
+                sql_db.query(SessionFiles)
+                .filter_by(user_id=user.id, sha256=sha256.lower())
+                .order_by(SessionFiles.id)
+                .first()
+            )
+    except sqlalchemy.exc.SQLAlchemyError:
+        return None
+
+    return file
+
+
+def get_stored_location(
+    session_file: SessionFiles,
+) -> tuple[SessionStorage, str] | None:
+    """
+    Get where a session file is stored: its blob, or the file in the
+    directory of its user if stored before the blob store.
+
+    Parameters
+    ----------
+    session_file : SessionFiles
+        Database entry of the file.
+
+    Returns
+    -------
+    tuple[SessionStorage, str] | None
+        Storage and key of the stored file, compressed or not. ``None`` if
+        missing.
+    """
+    with current_app.Session() as sql_db:
+        if session_file.blob_id is not None:
+            blob = sql_db.get(SessionBlobs, session_file.blob_id)
+            if blob is None:
+                return None
+            storage = get_storage()
+            key = get_blob_key(blob.sha256, blob.encoding)
+            return (storage, key) if storage.exists(key) else None
+        user = sql_db.get(UserCredentials, session_file.user_id)
+    if user is None:
+        return None
+    filepath = find_session_file(get_sessions_dir_for_user(user), session_file.filename)
+    if filepath is None:
+        return None
+    sessions_dir = get_sessions_dir()
+    return LocalStorage(sessions_dir), filepath.relative_to(sessions_dir).as_posix()
+
+
+def get_stored_filepath(session_file: SessionFiles) -> Path | None:
+    """
+    Get a local path of a stored session file, to parse it or build its
+    artifacts. Blobs of an object store are copied locally, once.
+
+    Parameters
+    ----------
+    session_file : SessionFiles
+        Database entry of the file.
+
+    Returns
+    -------
+    Path | None
+        Path of the stored file, compressed or not. ``None`` if missing.
+    """
+    location = get_stored_location(session_file)
+    if location is None:
+        return None
+    storage, key = location
+    return storage.local_path(key)
+
+
+def get_columns_key(key: str) -> str:
+    """
+    Get the key of the columns directory of a stored file, which also holds
+    its trace pyramid, see ``session_columns``.
+    """
+    return get_columns_dir(PurePosixPath(key)).as_posix()
+
+
+def get_artifacts_filepath(session_file: SessionFiles) -> Path | None:
+    """
+    Get a local path of a stored session file whose artifacts are next to
+    it, to query them. The artifacts built on another node are copied from
+    the store, but not the file itself.
+
+    Parameters
+    ----------
+    session_file : SessionFiles
+        Database entry of the file.
+
+    Returns
+    -------
+    Path | None
+        Path of the stored file, whose artifacts are missing if not built
+        yet. It may not exist locally. ``None`` if the file is missing.
+    """
+    location = get_stored_location(session_file)
+    if location is None:
+        return None
+    storage, key = location
+    storage.fetch_dir(get_columns_key(key))
+    return storage.cache_path(key)
+
+
+def get_session_filepath_for_user(
+    user: UserCredentials, filename: str
+) -> Path | None:
+    """
+    Get the stored path of a session file of a user, whatever its compression.
+
+    Parameters
+    ----------
+    user : UserCredentials
+        User that owns the file.
+    filename : str
+        Name of the file, as registered in the database.
+
+    Returns
+    -------
+    Path | None
+        Path of the stored file. ``None`` if the user has no such file.
+    """
+    file = get_file_for_user_by_name(user, filename)
+    if not file:
+        return None
+    return get_stored_filepath(file)
+
+
+def delete_session_file(session_file: SessionFiles) -> None:
+    """
+    Remove a session file, with its summaries and jobs.
+
+    Its blob, and the artifacts derived from it, are removed with the last
+    file pointing at it. They are moved aside before the commit, so a
+    concurrent upload of the same contents stores them again. A job of the
+    file running meanwhile may leave its artifacts behind.
+
+    Parameters
+    ----------
+    session_file : SessionFiles
+        Database entry of the file.
+    """
+    location = get_stored_location(session_file)
+    trashed_columns = None
+    with current_app.Session() as sql_db:
+        for model in (SessionSummaries, ProcessingJobs):
+            sql_db.query(model).filter_by(file_id=session_file.id).delete()
+        sql_db.query(SessionFiles).filter_by(id=session_file.id).delete()
+        if session_file.blob_id is not None:
+            sql_db.execute(
+                sqlalchemy.update(SessionBlobs)
+                .where(SessionBlobs.id == session_file.blob_id)
+                .values(refcount=SessionBlobs.refcount - 1)
+            )
+            removed = sql_db.execute(
+                sqlalchemy.delete(SessionBlobs).where(
+                    SessionBlobs.id == session_file.blob_id,
+                    SessionBlobs.refcount <= 0,
+                )
+            ).rowcount
+            if not removed:
+                location = None  # still referenced
+
+        if location is not None:
+            storage, key = location
+            trash_name = f"{uuid.uuid4().hex}-{PurePosixPath(key).name}"
+            trash_key = f".trash/{trash_name}"
+            storage.move(key, trash_key)
+            # the artifacts are local, also for object stores
+            columns_dir = get_columns_dir(storage.cache_path(key))
+            if columns_dir.exists():
+                trashed_columns = ensure_dir(get_blobs_dir() / ".trash") / (
+                    f"{trash_name}{COLUMNS_SUFFIX}"
+                )
+                os.replace(columns_dir, trashed_columns)
+        try:
+            sql_db.commit()
+        except BaseException:
+            if location is not None:
+                storage.move(trash_key, key)
+            if trashed_columns is not None:
+                os.replace(trashed_columns, columns_dir)
+            raise
+
+    if location is not None:
+        storage.delete(trash_key)
+        storage.delete_dir(get_columns_key(key))
+    if trashed_columns is not None:
+        shutil.rmtree(trashed_columns, ignore_errors=True)
+
+
+def migrate_legacy_file(session_file: SessionFiles) -> bool:
+    """
+    Move a file stored in the directory of its user to the blob store, with
+    its artifacts.
+
+    The file can be moved while the server is running: it is linked into the
+    store first, and removed from its old place once its database entry
+    points at its blob.
+
+    Parameters
+    ----------
+    session_file : SessionFiles
+        Database entry of the file, without blob.
+
+    Returns
+    -------
+    bool
+        Whether its contents were already in the store, so the file was only
+        removed.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the file is missing on disk.
+    ValueError
+        If the file is already in the store.
+    """
+    if session_file.blob_id is not None:
+        raise ValueError("Session file already in the blob store")
+    legacy_path = get_stored_filepath(session_file)
+    if legacy_path is None:
+        raise FileNotFoundError(session_file.filename)
+    size_bytes, sha256 = file_digest(legacy_path)
+    encoding = get_file_encoding(legacy_path)
+
+    with staging_filepath(encoding) as staged_path:
+        try:
+            os.link(legacy_path, staged_path)
+        except OSError:  # e.g. no hard links on this filesystem
+            shutil.copy2(legacy_path, staged_path)
+        for attempt in range(2):
+            with current_app.Session() as sql_db:
+                try:
+                    blob_id, blob_key = _acquire_blob(
+                        sql_db, sha256, size_bytes, encoding
+                    )
+                except sqlalchemy.exc.IntegrityError:
+                    # the blob was created meanwhile by a concurrent upload
+                    if attempt:
+                        raise
+                    continue
+                updated = sql_db.execute(
+                    sqlalchemy.update(SessionFiles)
+                    .where(
+                        SessionFiles.id == session_file.id,
+                        SessionFiles.blob_id.is_(None),
+                    )
+                    .values(blob_id=blob_id, sha256=sha256, size_bytes=size_bytes)
+                ).rowcount
+                if not updated:
+                    raise ValueError("Session file already in the blob store")
+                if blob_key is not None:
+                    get_storage().store_file(blob_key, staged_path)
+                sql_db.commit()
+            break
+        # the staged file is left where the blob was already stored
+        deduplicated = staged_path.exists()
+
+    session_file.blob_id = blob_id
+    legacy_columns_dir = get_columns_dir(legacy_path)
+    location = get_stored_location(session_file)
+    if legacy_columns_dir.exists():
+        try:
+            if location is None:
+                raise FileNotFoundError(session_file.filename)
+            storage, key = location
+            columns_dir = get_columns_dir(storage.cache_path(key))
+            ensure_dir(columns_dir.parent)
+            os.replace(legacy_columns_dir, columns_dir)
+        except OSError:  # the blob has its own already
+            shutil.rmtree(legacy_columns_dir, ignore_errors=True)
+    legacy_path.unlink(missing_ok=True)
+    return deduplicated
@@ -0,0 +1,138 @@
+from pathlib import Path
+from typing import BinaryIO, Iterator
+import gzip
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, only needed for zstd
+    zstandard = None
+
+if zstandard is not None:
+    DecompressionError = zstandard.ZstdError
+else:
+    class DecompressionError(Exception):
+        """Placeholder for the errors of the zstd library, when not installed."""
+
+
+# content encodings supported for stored session files, with their suffixes
+ENCODING_SUFFIXES = {
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def check_encoding(encoding: str | None) -> None:
+    """
+    Check an encoding can be used to store session files.
+
+    Parameters
+    ----------
+    encoding : str | None
+        Content encoding, ``None`` for uncompressed files.
+
+    Raises
+    ------
+    ValueError
+        If the encoding is unknown, or its library is not installed.
+    """
+    if encoding is not None and encoding not in ENCODING_SUFFIXES:
+        raise ValueError(f"Unknown session files compression: {encoding}")
+    if encoding == "zstd" and zstandard is None:
+        raise ValueError("zstd compression requires the 'zstandard' package")
+
+
+def stored_name(filename: str, encoding: str | None) -> str:
+    """
+    Get the name on disk of a session file stored with an encoding.
+    """
+    return filename + ENCODING_SUFFIXES.get(encoding, "")
+
+
+def get_file_encoding(filepath: Path) -> str | None:
+    """
+    Get the content encoding of a stored session file, from its suffix.
+
+    Returns
+    -------
+    str | None
+        Content encoding, ``None`` if the file is not compressed.
+    """
+    for encoding, suffix in ENCODING_SUFFIXES.items():
+        if filepath.name.endswith(suffix):
+            return encoding
+    return None
+
+
+def find_session_file(directory: Path, filename: str) -> Path | None:
+    """
+    Find a session file in a directory, whatever its encoding.
+
+    Parameters
+    ----------
+    directory : Path
+        Sessions directory of a user.
+    filename : str
+        Name of the session file, as registered in the database.
+
+    Returns
+    -------
+    Path | None
+        Path of the stored file. ``None`` if not found.
+    """
+    for encoding in (None, *ENCODING_SUFFIXES):
+        filepath = directory / stored_name(filename, encoding)
+        if filepath.exists():
+            return filepath
+    return None
+
+
+def compressing_writer(fileobj: BinaryIO, encoding: str | None) -> BinaryIO:
+    """
+    Wrap a binary file so what is written to the wrapper is compressed.
+    Closing the wrapper finishes the compressed stream, but not ``fileobj``.
+    """
+    if encoding == "gzip":
+        return gzip.GzipFile(
+            fileobj=fileobj, mode="wb", compresslevel=GZIP_LEVEL, mtime=0
+        )
+    elif encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(
+            fileobj, closefd=False
+        )
+    raise ValueError(f"Unknown encoding: {encoding}")
+
+
+def decompressing_reader(fileobj: BinaryIO, encoding: str | None) -> BinaryIO:
+    """
+    Wrap a binary file so what is read from the wrapper is decompressed.
+    For ``None``, the file is returned as is.
+
+    Corrupted data raises ``OSError``, ``EOFError`` or ``zlib.error`` for gzip,
+    and ``DecompressionError`` for zstd.
+    """
+    if encoding is None:
+        return fileobj
+    elif encoding == "gzip":
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    elif encoding == "zstd":
+        return zstandard.ZstdDecompressor().stream_reader(
+            fileobj, closefd=False, read_across_frames=True
+        )
+    raise ValueError(f"Unknown encoding: {encoding}")
+
+
+def iter_decompressed(
+    filepath: Path, chunk_size: int = 64 * 1024
+) -> Iterator[bytes]:
+    """
+    Iterate over the decompressed contents of a stored session file.
+    Memory usage is bounded by ``chunk_size``.
+    """
+    encoding = get_file_encoding(filepath)
+    with filepath.open("rb") as f:
+        reader = decompressing_reader(f, encoding)
+        while chunk := reader.read(chunk_size):
+            yield chunk
@@ -1,9 +1,29 @@
 from flaskr.db_tables import SessionFiles, UserCredentials
+from .compression import (
+    compressing_writer,
+    decompressing_reader,
+    DecompressionError,
+)
 
 from flask import current_app
 import sqlalchemy
 
+from contextlib import contextmanager
+from datetime import datetime
 from pathlib import Path
+from typing import BinaryIO, Iterator
+import codecs
+import json
+import os
+import tempfile
+import urllib.parse
+import zlib
+
+
+# size of the blocks read from the request stream and written to disk
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+# longest JSON header line accepted at the start of a session file
+MAX_HEADER_SIZE = 64 * 1024  # 64 KiB
 
 
 def get_sessions_dir() -> Path:
@@ -20,7 +40,8 @@ def get_sessions_dir() -> Path:
 
 def get_sessions_dir_for_user(user: UserCredentials) -> Path:
     """
-    Get the sessions directory for a user.
+    Get the sessions directory for a user, where the session files were stored
+    before the blob store, see ``blob_store``.
 
     Parameters
     ----------
@@ -35,6 +56,180 @@ def get_sessions_dir_for_user(user: UserCredentials) -> Path:
     return get_sessions_dir() / user.email
 
 
+def fsync_path(path: str | Path) -> None:
+    """
+    Flush a file, or the entries of a directory (e.g. a file renamed into it),
+    to the disk.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def _atomic_write(filepath: Path) -> Iterator[BinaryIO]:
+    """
+    Open a temporary file next to ``filepath``, renamed to it on success and
+    removed on any error. It is flushed to the disk before the rename, so after
+    a crash ``filepath`` is either complete or missing.
+    """
+    fd, tmp_name = tempfile.mkstemp(
+        dir=filepath.parent, prefix=f".{filepath.name}.", suffix=".part"
+    )
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            yield tmp_file
+        fsync_path(tmp_name)
+        os.replace(tmp_name, filepath)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def save_stream_atomically(
+    stream: BinaryIO,
+    filepath: Path,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    encoding: str | None = None,
+    hasher=None,
+) -> int:
+    """
+    Save a binary stream to a file, in fixed-size chunks.
+
+    The stream is first written to a temporary file in the same directory, which
+    is then renamed to ``filepath``. So the file is either complete or missing,
+    and memory usage does not depend on the size of the stream.
+    The contents are validated as UTF-8 text on the fly.
+
+    Parameters
+    ----------
+    stream : BinaryIO
+        Readable binary stream, e.g. ``FileStorage.stream``.
+    filepath : Path
+        Final path of the file. Its parent directory must exist.
+    chunk_size : int, optional
+        Number of bytes to read and write at a time.
+    encoding : str, optional
+        Content encoding to compress the file with, see ``ENCODING_SUFFIXES``.
+        ``None`` (default) stores the file as is.
+    hasher : hashlib hash object, optional
+        Updated with the contents of the stream, e.g. ``hashlib.sha256()``.
+
+    Returns
+    -------
+    int
+        Number of bytes read from the stream.
+
+    Raises
+    ------
+    UnicodeDecodeError
+        If the stream is not valid UTF-8 text. Nothing is written.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    n_bytes = 0
+    with _atomic_write(filepath) as tmp_file:
+        writer = compressing_writer(tmp_file, encoding) if encoding else tmp_file
+        with writer:
+            while chunk := stream.read(chunk_size):
+                decoder.decode(chunk)  # raises on invalid text
+                if hasher is not None:
+                    hasher.update(chunk)
+                writer.write(chunk)
+                n_bytes += len(chunk)
+            decoder.decode(b"", final=True)
+
+    return n_bytes
+
+
+class _TeeReader:
+    """
+    Binary stream that copies everything read from ``stream`` into ``sink``.
+    """
+
+    def __init__(self, stream: BinaryIO, sink: BinaryIO):
+        self.stream = stream
+        self.sink = sink
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.sink.write(data)
+        return data
+
+    def readable(self) -> bool:
+        return True
+
+
+def save_encoded_stream_atomically(
+    stream: BinaryIO,
+    filepath: Path,
+    encoding: str,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    hasher=None,
+) -> int:
+    """
+    Save a compressed binary stream to a file as is, in fixed-size chunks.
+
+    Like ``save_stream_atomically``, but the stream is already compressed with
+    ``encoding``. It is decompressed on the fly only to validate it, without
+    keeping the decompressed data: it must be complete, UTF-8 text, and begin
+    with the JSON header line of a session file.
+
+    Parameters
+    ----------
+    stream : BinaryIO
+        Readable binary stream with the compressed file.
+    filepath : Path
+        Final path of the file. Its parent directory must exist.
+    encoding : str
+        Content encoding of the stream, see ``ENCODING_SUFFIXES``.
+    chunk_size : int, optional
+        Number of decompressed bytes to validate at a time.
+    hasher : hashlib hash object, optional
+        Updated with the decompressed contents, e.g. ``hashlib.sha256()``.
+
+    Returns
+    -------
+    int
+        Size of the decompressed file, in bytes.
+
+    Raises
+    ------
+    ValueError
+        If the stream cannot be decompressed or is not a session file.
+        Nothing is written.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    header = b""
+    n_bytes = 0
+    with _atomic_write(filepath) as tmp_file:
+        tee = _TeeReader(stream, tmp_file)
+        try:
+            reader = decompressing_reader(tee, encoding)
+            while chunk := reader.read(chunk_size):
+                decoder.decode(chunk)  # raises on invalid text
+                if hasher is not None:
+                    hasher.update(chunk)
+                if n_bytes < MAX_HEADER_SIZE:
+                    header += chunk[:MAX_HEADER_SIZE - n_bytes]
+                n_bytes += len(chunk)
+            decoder.decode(b"", final=True)
+        except (OSError, EOFError, zlib.error, DecompressionError) as e:
+            raise ValueError(f"Invalid {encoding} stream") from e
+        if tee.read(1):
+            raise ValueError(f"Trailing data after the {encoding} stream")
+
+        first_line, newline, _ = header.partition(b"\n")
+        try:
+            if not (newline and isinstance(json.loads(first_line), dict)):
+                raise ValueError("Missing session header")
+        except json.JSONDecodeError as e:
+            raise ValueError("Invalid session header") from e
+
+    return n_bytes
+
+
 def get_file_for_user_by_name(
     user: UserCredentials, filename: str
 ) -> SessionFiles | None:
@@ -67,6 +262,69 @@ def get_file_for_user_by_name(
     return file
 
 
+def get_file_for_user_by_id(
+    user: UserCredentials, file_id: int
+) -> SessionFiles | None:
+    """
+    Get a file of a user by its id.
+
+    Parameters
+    ----------
+    user : UserCredentials
+        User that owns the file.
+    file_id : int
+        Id of the file.
+
+    Returns
+    -------
+    SessionFiles | None
+        The file, ``None`` if the user has no file with that id.
+    """
+    try:
+        with current_app.Session() as sql_db:
+            file = (
+                sql_db.query(SessionFiles)
+                .filter_by(id=file_id, user_id=user.id)
+                .first()
+            )
+    except sqlalchemy.exc.SQLAlchemyError:
+        return None
+
+    return file
+
+
+def session_accel_path(prefix: str, filepath: Path, encoding: str | None) -> str:
+    """
+    Get the ``X-Accel-Redirect`` URI of a stored session file, for nginx to
+    send it.
+
+    nginx serves the sessions directory under ``<prefix>/<encoding>/``, with
+    the ``Content-Encoding`` of each location (``identity`` for none).
+
+    Parameters
+    ----------
+    prefix : str
+        Path of the internal nginx locations, ``SESSION_FILES_ACCEL_REDIRECT``.
+    filepath : Path
+        Path of the stored file, inside the sessions directory.
+    encoding : str | None
+        Content encoding of the stored file, ``None`` if uncompressed.
+
+    Returns
+    -------
+    str
+        URI to send in the ``X-Accel-Redirect`` header.
+    """
+    relative = filepath.resolve().relative_to(get_sessions_dir().resolve())
+    return "/".join(
+        (
+            prefix.rstrip("/"),
+            encoding or "identity",
+            urllib.parse.quote(relative.as_posix()),
+        )
+    )
+
+
 def get_files_for_user(user: UserCredentials) -> list[SessionFiles]:
     """
     Get the files for a user.
@@ -89,3 +347,41 @@ def get_files_for_user(user: UserCredentials) -> list[SessionFiles]:
         return []
 
     return files
+
+
+def get_files_for_user_in_period(
+    user: UserCredentials,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> list[SessionFiles]:
+    """
+    Get the files of a user whose session overlaps a period, by the instants
+    in their headers.
+
+    Parameters
+    ----------
+    user : UserCredentials
+        User to get the files.
+    since : datetime | None
+        UTC instant the sessions must finish after, ``None`` for no limit.
+    until : datetime | None
+        UTC instant the sessions must start before, ``None`` for no limit.
+
+    Returns
+    -------
+    list[SessionFiles]
+        Files of the user, by start instant. With a limit, files whose header
+        lacks the needed instant are left out.
+    """
+    try:
+        with current_app.Session() as sql_db:
+            query = sql_db.query(SessionFiles).filter(SessionFiles.user_id == user.id)
+            if since is not None:
+                query = query.filter(SessionFiles.finish_instant >= since)
+            if until is not None:
+                query = query.filter(SessionFiles.start_instant < until)
+            files = query.order_by(SessionFiles.start_instant, SessionFiles.id).all()
+    except sqlalchemy.exc.SQLAlchemyError:
+        return []
+
+    return files
@@ -0,0 +1,43 @@
+from flaskr.db_tables import SessionFiles
+from .session_columns import load_session_columns
+from .session_parser import ParsedSession
+from .session_summary import store_session_summaries
+from .trace_pyramid import load_trace_pyramid
+
+from pathlib import Path
+
+
+def build_session_artifacts(
+    filepath: Path, session_file: SessionFiles | None = None
+) -> ParsedSession:
+    """
+    Build the derived artifacts of a stored session file: its columnar sidecar,
+    its trace pyramid and, with its database entry, its summary statistics.
+
+    The sidecar and the pyramid are only built if missing or outdated: stored
+    files are content-addressed, so the ones of a re-upload of the same
+    contents are already current. The summaries are stored for each entry.
+
+    Parameters
+    ----------
+    filepath : Path
+        Path of the stored session file, compressed or not.
+    session_file : SessionFiles, optional
+        Database entry of the file, to store its summary statistics.
+
+    Returns
+    -------
+    ParsedSession
+        The parsed session.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a valid session file.
+    """
+    parsed = load_session_columns(filepath)
+    load_trace_pyramid(filepath, parsed)
+    if session_file is not None:
+        store_session_summaries(session_file, parsed)
+    return parsed
+
@@ -0,0 +1,436 @@
+from flaskr.db_tables import UserCredentials
+from .files import get_sessions_dir, save_stream_atomically, UPLOAD_CHUNK_SIZE
+
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import BinaryIO, Iterator
+import codecs
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+
+# largest chunk accepted in a single request
+MAX_CHUNK_SIZE = 16 * 1024 * 1024  # 16 MiB
+# largest session file accepted, as the single request uploads (nginx
+# client_max_body_size, see server_configuration/surCO_app)
+MAX_UPLOAD_SIZE = 100 * 1024 * 1024  # 100 MiB
+# uploads a user may have open at once
+MAX_OPEN_UPLOADS = 8
+# uploads not modified for this long are abandoned, see sweep_uploads
+UPLOAD_EXPIRY = timedelta(days=1)
+
+
+class ChunkOffsetError(Exception):
+    """
+    Raised when a chunk does not start where the upload currently ends.
+    The client should query the upload state and resume from its offset.
+    """
+
+
+class TooManyUploadsError(Exception):
+    """
+    Raised when opening an upload while the user has ``MAX_OPEN_UPLOADS``
+    open. The client should finish or abort one of them first.
+    """
+
+
+def get_uploads_dir() -> Path:
+    """
+    Get the directory of the resumable uploads in progress.
+
+    It lives inside the sessions directory so committing an upload is a rename
+    within the same filesystem (the sessions directory is a mounted volume).
+
+    Returns
+    -------
+    Path
+        Path to the uploads directory.
+    """
+    return get_sessions_dir() / ".uploads"
+
+
+def _lock_file(path: Path, blocking: bool = True):
+    lock_file = path.open("a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except BaseException:
+        lock_file.close()
+        raise
+    return lock_file
+
+
+class ResumableUpload:
+    """
+    A session file uploaded in numbered chunks, persisted on disk between
+    requests so the client can resume from the last acknowledged offset.
+
+    Each upload has its own directory, in the one of its owner, with:
+
+    - ``state.json``: owner, filename, expected size and acknowledged chunks.
+    - ``data.part``: the bytes received so far.
+    - ``lock``: file locked while the upload is modified, shared by all workers.
+
+    Once committed, only the state is kept, with the checksum of the stored
+    file, so that retries of the commit get the same response. Uploads left
+    are removed by ``sweep_uploads`` when they expire.
+
+    Attributes
+    ----------
+    upload_id : str
+        Identifier of the upload, given to the client.
+    state : dict
+        Persisted state of the upload.
+    """
+
+    def __init__(self, upload_id: str, state: dict):
+        self.upload_id = upload_id
+        self.state = state
+
+    @property
+    def directory(self) -> Path:
+        return get_uploads_dir() / str(self.state["user_id"]) / self.upload_id
+
+    @property
+    def data_path(self) -> Path:
+        return self.directory / "data.part"
+
+    @property
+    def filename(self) -> str:
+        return self.state["filename"]
+
+    @property
+    def size(self) -> int:
+        return self.state["size"]
+
+    @property
+    def offset(self) -> int:
+        return self.state["offset"]
+
+    @property
+    def next_index(self) -> int:
+        return len(self.state["chunks"])
+
+    @property
+    def is_complete(self) -> bool:
+        return self.offset == self.size
+
+    @property
+    def committed_sha256(self) -> str | None:
+        """
+        Hex SHA-256 of the session file stored from the upload, ``None`` if
+        not committed yet.
+        """
+        return self.state.get("committed_sha256")
+
+    def to_json(self) -> dict:
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "size": self.size,
+            "offset": self.offset,
+            "next_index": self.next_index,
+            "max_chunk_size": MAX_CHUNK_SIZE,
+        }
+
+    @classmethod
+    def create(
+        cls, user: UserCredentials, filename: str, size: int, sha256: str = None
+    ) -> "ResumableUpload":
+        """
+        Open a new upload.
+
+        Parameters
+        ----------
+        user : UserCredentials
+            Owner of the upload.
+        filename : str
+            Secure filename of the session file.
+        size : int
+            Total size of the file, in bytes.
+        sha256 : str, optional
+            Hex digest of the whole file, checked on commit.
+
+        Returns
+        -------
+        ResumableUpload
+            The new, empty upload.
+
+        Raises
+        ------
+        ValueError
+            If ``size`` is over ``MAX_UPLOAD_SIZE``.
+        TooManyUploadsError
+            If the user has ``MAX_OPEN_UPLOADS`` open.
+        """
+        if size > MAX_UPLOAD_SIZE:
+            raise ValueError("File is too big")
+        upload = cls(
+            uuid.uuid4().hex,
+            {
+                "user_id": user.id,
+                "filename": filename,
+                "size": size,
+                "sha256": sha256.lower() if sha256 else None,
+                "offset": 0,
+                "chunks": [],
+            },
+        )
+        user_dir = upload.directory.parent
+        user_dir.mkdir(parents=True, exist_ok=True)
+        # counted and created under a lock of the user, across all workers
+        with _lock_file(user_dir / ".lock"):
+            n_open = 0
+            for directory in user_dir.iterdir():
+                if (directory / "data.part").exists():  # not committed
+                    n_open += 1
+            if n_open >= MAX_OPEN_UPLOADS:
+                raise TooManyUploadsError("Too many uploads open")
+            upload.directory.mkdir()
+            upload.data_path.touch()
+            upload._save_state()
+        return upload
+
+    @classmethod
+    def load(cls, user: UserCredentials, upload_id: str) -> "ResumableUpload | None":
+        """
+        Load an upload of a user.
+
+        Parameters
+        ----------
+        user : UserCredentials
+            Owner of the upload.
+        upload_id : str
+            Identifier of the upload.
+
+        Returns
+        -------
+        ResumableUpload | None
+            The upload. ``None`` if not found or owned by another user.
+        """
+        try:
+            upload_id = uuid.UUID(hex=upload_id).hex
+        except ValueError:
+            return None
+        try:
+            state_path = get_uploads_dir() / str(user.id) / upload_id / "state.json"
+            with state_path.open("r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        if state["user_id"] != user.id:
+            return None
+        return cls(upload_id, state)
+
+    def _save_state(self):
+        tmp_path = self.directory / "state.json.tmp"
+        with tmp_path.open("w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.directory / "state.json")
+
+    def _reload_state(self):
+        with (self.directory / "state.json").open("r") as f:
+            self.state = json.load(f)
+
+    @contextmanager
+    def locked(self, blocking: bool = True) -> Iterator["ResumableUpload"]:
+        """
+        Lock the upload, shared by all workers, and reload its state.
+
+        Parameters
+        ----------
+        blocking : bool, optional
+            Wait for the lock (default). Otherwise, raise ``BlockingIOError``
+            if it is taken.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the upload was discarded, e.g. aborted by another request.
+        """
+        with _lock_file(self.directory / "lock", blocking):
+            # discarded while waiting for the lock
+            self._reload_state()
+            yield self
+
+    def write_chunk(
+        self, index: int, offset: int, stream: BinaryIO, sha256: str
+    ) -> None:
+        """
+        Append a chunk to the upload.
+
+        Re-sending an already acknowledged chunk with the same checksum is
+        accepted and does nothing, so clients can retry when an acknowledgement
+        is lost.
+
+        Parameters
+        ----------
+        index : int
+            Number of the chunk, starting from 0.
+        offset : int
+            Position of the chunk in the file, in bytes.
+        stream : BinaryIO
+            Body of the chunk.
+        sha256 : str
+            Hex digest of the chunk.
+
+        Raises
+        ------
+        ChunkOffsetError
+            If the chunk does not continue the upload.
+        ValueError
+            If the chunk does not match its checksum, or is too big.
+        FileNotFoundError
+            If the upload was discarded.
+        """
+        sha256 = sha256.lower()
+        with self.locked():
+            chunks = self.state["chunks"]
+            if index < len(chunks):
+                acked = chunks[index]
+                if acked["offset"] == offset and acked["sha256"] == sha256:
+                    return  # retry of an acknowledged chunk
+                raise ChunkOffsetError("Chunk was already received")
+            if index != len(chunks) or offset != self.offset:
+                raise ChunkOffsetError("Chunk does not continue the upload")
+
+            hasher = hashlib.sha256()
+            length = 0
+            with self.data_path.open("r+b") as f:
+                f.seek(offset)
+                while block := stream.read(UPLOAD_CHUNK_SIZE):
+                    length += len(block)
+                    if length > MAX_CHUNK_SIZE or offset + length > self.size:
+                        f.truncate(offset)
+                        raise ValueError("Chunk is too big")
+                    hasher.update(block)
+                    f.write(block)
+                if hasher.hexdigest() != sha256:
+                    f.truncate(offset)
+                    raise ValueError("Chunk checksum mismatch")
+                f.truncate(offset + length)
+                f.flush()
+                os.fsync(f.fileno())
+
+            chunks.append({"offset": offset, "length": length, "sha256": sha256})
+            self.state["offset"] = offset + length
+            self._save_state()
+
+    def commit_to(self, filepath: Path, encoding: str | None = None) -> str:
+        """
+        Check the complete upload and write its data to ``filepath``.
+
+        The file must match the expected checksum and, as any session file,
+        be UTF-8 text. The data of the upload is kept, until ``mark_committed``
+        once the file is stored. The caller holds the lock, see ``locked``.
+
+        Parameters
+        ----------
+        filepath : Path
+            Final path of the session file. Its parent directory must exist.
+        encoding : str, optional
+            Content encoding to compress the file with. ``None`` (default)
+            moves the data as is.
+
+        Returns
+        -------
+        str
+            Hex SHA-256 of the file.
+
+        Raises
+        ------
+        ValueError
+            If the upload is incomplete, committed, or does not pass the checks.
+        FileExistsError
+            If ``filepath`` already exists.
+        """
+        if self.committed_sha256:
+            raise ValueError("Upload is already committed")
+        if not self.is_complete:
+            raise ValueError("Upload is incomplete")
+        hasher = hashlib.sha256()
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        try:
+            with self.data_path.open("rb") as f:
+                while block := f.read(UPLOAD_CHUNK_SIZE):
+                    hasher.update(block)
+                    decoder.decode(block)
+                decoder.decode(b"", final=True)
+        except UnicodeDecodeError as e:
+            raise ValueError("File must be UTF-8 text") from e
+        if self.state["sha256"] and hasher.hexdigest() != self.state["sha256"]:
+            raise ValueError("File checksum mismatch")
+
+        if encoding:
+            if filepath.exists():
+                raise FileExistsError(filepath)
+            with self.data_path.open("rb") as f:
+                save_stream_atomically(f, filepath, encoding=encoding)
+        else:
+            # same filesystem: a second name, nothing copied
+            os.link(self.data_path, filepath)
+        return hasher.hexdigest()
+
+    def mark_committed(self, sha256: str) -> None:
+        """
+        Record the upload as stored, with the checksum of the file, and
+        remove its data. The caller holds the lock, see ``locked``.
+        """
+        self.state["committed_sha256"] = sha256
+        self._save_state()
+        self.data_path.unlink(missing_ok=True)
+
+    def discard(self) -> None:
+        """
+        Remove the upload and its data, once no request is modifying it.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the upload was discarded already.
+        """
+        with self.locked():
+            shutil.rmtree(self.directory)
+
+
+def sweep_uploads(max_age: timedelta = UPLOAD_EXPIRY) -> int:
+    """
+    Remove the uploads not modified for ``max_age``: abandoned, or committed
+    long enough ago that the client is not retrying the commit anymore.
+
+    Uploads being modified meanwhile are skipped.
+
+    Parameters
+    ----------
+    max_age : timedelta, optional
+        Age of the uploads to remove, since their last chunk or commit.
+
+    Returns
+    -------
+    int
+        Number of uploads removed.
+    """
+    uploads_dir = get_uploads_dir()
+    if not uploads_dir.exists():
+        return 0
+    oldest = time.time() - max_age.total_seconds()
+    n_removed = 0
+    for user_dir in uploads_dir.iterdir():
+        if not user_dir.is_dir():
+            continue
+        for directory in user_dir.iterdir():
+            try:
+                # rewritten with each chunk and on commit
+                if (directory / "state.json").stat().st_mtime > oldest:
+                    continue
+                with _lock_file(directory / "lock", blocking=False):
+                    shutil.rmtree(directory)
+            except (FileNotFoundError, NotADirectoryError, BlockingIOError):
+                continue  # removed meanwhile, the lock of the user, or in use
+            n_removed += 1
+    return n_removed
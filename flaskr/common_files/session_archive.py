@@ -0,0 +1,85 @@
+"""
+Zip archives of the session files of a user, streamed as they are built.
+
+The archive is written to a buffer that is emptied after each block, so memory
+usage is bounded by the block size whatever the number and size of the files,
+and no temporary file is written; files of an object store are streamed from
+it. Files stored compressed are archived as they
+are (``ZIP_STORED``, e.g. ``session.txt.gz``), without recompressing them;
+uncompressed files are deflated.
+"""
+
+from .compression import get_file_encoding
+from .files import UPLOAD_CHUNK_SIZE
+from .storage import SessionStorage
+
+from pathlib import Path
+from typing import Iterable, Iterator
+import time
+import zipfile
+
+
+class _ArchiveBuffer:
+    """
+    Write-only, unseekable file collecting the bytes written by ``ZipFile``.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_sessions_zip(
+    entries: Iterable[tuple[str, SessionStorage, str]],
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """
+    Iterate over the bytes of a zip archive of some stored session files.
+
+    Parameters
+    ----------
+    entries : Iterable[tuple[str, SessionStorage, str]]
+        Name in the archive, storage and key of each stored session file, see
+        ``get_stored_location``. Files missing from their storage are skipped.
+    chunk_size : int
+        Size of the blocks read from the files.
+
+    Yields
+    ------
+    bytes
+        Consecutive parts of the archive, some possibly empty.
+    """
+    buffer = _ArchiveBuffer()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, storage, key in entries:
+            if (info := storage.info(key)) is None:
+                continue
+            zip_info = zipfile.ZipInfo(
+                name, date_time=time.gmtime(info.modified)[:6]
+            )
+            if get_file_encoding(Path(key)) is None:
+                zip_info.compress_type = zipfile.ZIP_DEFLATED
+            else:
+                zip_info.compress_type = zipfile.ZIP_STORED
+            force_zip64 = info.size >= zipfile.ZIP64_LIMIT
+            with (
+                storage.open(key) as f,
+                archive.open(zip_info, "w", force_zip64=force_zip64) as entry,
+            ):
+                while chunk := f.read(chunk_size):
+                    entry.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+    # the central directory, written on close
+    yield buffer.drain()
@@ -0,0 +1,189 @@
+"""
+Columnar sidecar of the session files.
+
+Next to each stored session file ``<filename>[.gz|.zst]``, a directory
+``<filename>.columns`` keeps its parsed columns as ``.npy`` arrays, plus a
+``meta.json`` with the header and beacon ids. Consumers memory-map the arrays
+instead of parsing the CSV again.
+"""
+
+from .compression import ENCODING_SUFFIXES, get_file_encoding
+from .session_parser import (
+    ParsedSession,
+    empty_session,
+    iter_session_chunks,
+    read_session_header,
+)
+
+from pathlib import Path
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+COLUMNS_SUFFIX = ".columns"
+# bump when the layout of the sidecar changes, so old ones are rebuilt
+COLUMNS_FORMAT_VERSION = 1
+
+
+def get_columns_dir(filepath: Path) -> Path:
+    """
+    Get the sidecar directory of a stored session file.
+
+    Parameters
+    ----------
+    filepath : Path
+        Path of the stored session file, compressed or not.
+
+    Returns
+    -------
+    Path
+        Path of its columns directory, named after the uncompressed file.
+    """
+    suffix = ENCODING_SUFFIXES.get(get_file_encoding(filepath), "")
+    return filepath.with_name(filepath.name.removesuffix(suffix) + COLUMNS_SUFFIX)
+
+
+def _write_npy(filepath: Path, raw_path: Path, dtype, n_rows: int) -> None:
+    """
+    Write the ``.npy`` file of a column from its raw values.
+    """
+    with filepath.open("wb") as f, raw_path.open("rb") as raw:
+        np.lib.format.write_array_header_1_0(
+            f,
+            {
+                "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                "fortran_order": False,
+                "shape": (n_rows,),
+            },
+        )
+        shutil.copyfileobj(raw, f, 1024 * 1024)
+    raw_path.unlink()
+
+
+def _load_columns_dir(columns_dir: Path, meta: dict) -> ParsedSession:
+    if not meta["n_rows"]:
+        # empty files cannot be memory-mapped
+        return empty_session(meta["header"])
+    columns = {
+        name: np.load(columns_dir / f"{name}.npy", mmap_mode="r")
+        for name in ParsedSession.COLUMN_DTYPES
+    }
+    return ParsedSession(meta["header"], meta["beacon_ids"], columns)
+
+
+def build_session_columns(filepath: Path) -> ParsedSession:
+    """
+    Parse a stored session file and write its columnar sidecar.
+
+    Each chunk of rows is appended to the columns as it is parsed, so only one
+    chunk is held in memory. The sidecar is written to a temporary directory
+    that is then renamed, so readers never see a partial one.
+
+    Parameters
+    ----------
+    filepath : Path
+        Path of the stored session file, compressed or not.
+
+    Returns
+    -------
+    ParsedSession
+        The parsed session, memory-mapped from the sidecar.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a valid session file.
+    """
+    columns_dir = get_columns_dir(filepath)
+
+    tmp_dir = Path(
+        tempfile.mkdtemp(dir=columns_dir.parent, prefix=f".{columns_dir.name}.")
+    )
+    try:
+        raw_files = {
+            name: (tmp_dir / f"{name}.raw").open("wb")
+            for name in ParsedSession.COLUMN_DTYPES
+        }
+        header, beacon_ids, n_rows = None, [], 0
+        try:
+            for chunk in iter_session_chunks(filepath):
+                for name, raw in raw_files.items():
+                    chunk.columns[name].tofile(raw)
+                header, beacon_ids = chunk.header, chunk.beacon_ids
+                n_rows += len(chunk)
+        finally:
+            for raw in raw_files.values():
+                raw.close()
+        if header is None:  # no rows
+            header = read_session_header(filepath)
+        for name, dtype in ParsedSession.COLUMN_DTYPES.items():
+            raw_path = tmp_dir / f"{name}.raw"
+            _write_npy(tmp_dir / f"{name}.npy", raw_path, dtype, n_rows)
+        meta = {
+            "version": COLUMNS_FORMAT_VERSION,
+            "header": header,
+            "beacon_ids": beacon_ids,
+            "n_rows": n_rows,
+        }
+        with (tmp_dir / "meta.json").open("w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        if columns_dir.exists():  # outdated sidecar, replace it
+            old_dir = tempfile.mkdtemp(
+                dir=columns_dir.parent, prefix=f".{columns_dir.name}.old."
+            )
+            os.replace(columns_dir, old_dir)
+            shutil.rmtree(old_dir, ignore_errors=True)
+        os.replace(tmp_dir, columns_dir)
+    except OSError:
+        # another worker won the race to create it, or it cannot be written
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not columns_dir.exists():
+            raise
+        return load_session_columns(filepath)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    return _load_columns_dir(columns_dir, meta)
+
+
+def load_session_columns(filepath: Path, build: bool = True) -> ParsedSession:
+    """
+    Load the columns of a stored session file, memory-mapped from its sidecar.
+    The sidecar is built first if missing or outdated.
+
+    Parameters
+    ----------
+    filepath : Path
+        Path of the stored session file, compressed or not.
+    build : bool, optional
+        Whether to build the sidecar if missing or outdated. If not, the file
+        itself is not needed.
+
+    Returns
+    -------
+    ParsedSession
+        Session whose columns are read-only memory-mapped arrays.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the sidecar is missing or outdated, and not to be built.
+    ValueError
+        If the sidecar has to be built and the file is not a valid session file.
+    """
+    columns_dir = get_columns_dir(filepath)
+    try:
+        with (columns_dir / "meta.json").open("r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["version"] != COLUMNS_FORMAT_VERSION:
+            raise FileNotFoundError(columns_dir / "meta.json")
+        return _load_columns_dir(columns_dir, meta)
+    except FileNotFoundError:
+        if not build:
+            raise
+        return build_session_columns(filepath)
@@ -0,0 +1,144 @@
+"""
+Metadata of the stored session files, kept as columns of ``SessionFiles``.
+
+The metadata comes from the JSON header line of each file, the only part read,
+so listing, sorting and filtering the sessions of a user are database queries
+that do not open the files. Headers are written by the app and may lack some
+fields, or have them with unexpected types: those are left as ``NULL``.
+"""
+
+from .compression import (
+    decompressing_reader,
+    DecompressionError,
+    get_file_encoding,
+    iter_decompressed,
+)
+from .files import MAX_HEADER_SIZE, UPLOAD_CHUNK_SIZE
+
+from datetime import datetime, timezone
+from pathlib import Path
+import hashlib
+import json
+import zlib
+
+
+# size of the blocks decompressed while looking for the end of the header line
+HEADER_BLOCK_SIZE = 4 * 1024
+
+
+def read_session_header(filepath: Path) -> dict | None:
+    """
+    Read the JSON header line of a stored session file, decompressing only
+    the start of the file.
+
+    Parameters
+    ----------
+    filepath : Path
+        Path of the stored session file.
+
+    Returns
+    -------
+    dict | None
+        The header, ``None`` if the file does not start with a JSON object
+        line of at most ``MAX_HEADER_SIZE`` bytes.
+    """
+    start = b""
+    try:
+        with filepath.open("rb") as f:
+            reader = decompressing_reader(f, get_file_encoding(filepath))
+            # zstd readers have no readline
+            while b"\n" not in start and len(start) <= MAX_HEADER_SIZE:
+                if not (block := reader.read(HEADER_BLOCK_SIZE)):
+                    break
+                start += block
+    except (OSError, EOFError, zlib.error, DecompressionError):
+        return None
+    first_line, newline, _ = start.partition(b"\n")
+    if not newline or len(first_line) > MAX_HEADER_SIZE:
+        return None  # truncated file, or header too long
+    try:
+        header = json.loads(first_line)
+    except ValueError:
+        return None
+    return header if isinstance(header, dict) else None
+
+
+def _utc_instant(value) -> datetime | None:
+    """
+    Naive UTC datetime of an ISO 8601 instant, as stored in the database.
+    """
+    try:
+        instant = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if instant.tzinfo is not None:
+        instant = instant.astimezone(timezone.utc).replace(tzinfo=None)
+    return instant
+
+
+def _string(value, max_length: int) -> str | None:
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    return str(value)[:max_length]
+
+
+def header_metadata(header: dict | None) -> dict:
+    """
+    Get the ``SessionFiles`` columns filled from the header of a session.
+
+    Parameters
+    ----------
+    header : dict | None
+        JSON header of the session, see ``read_session_header``.
+
+    Returns
+    -------
+    dict
+        Values of the columns ``version_scheme``, ``app_version``,
+        ``timezone``, ``start_instant``, ``finish_instant``, ``device_model``
+        and ``n_beacons``, ``None`` for those missing or invalid.
+    """
+    header = header or {}
+    version_scheme = header.get("version_scheme")
+    device_info = header.get("device_info")
+    beacons = header.get("beacons")
+    return {
+        "version_scheme": (
+            version_scheme
+            if isinstance(version_scheme, int) and not isinstance(version_scheme, bool)
+            else None
+        ),
+        "app_version": _string(header.get("app_version"), 32),
+        "timezone": _string(header.get("timezone"), 64),
+        "start_instant": _utc_instant(header.get("start_localized_instant")),
+        "finish_instant": _utc_instant(header.get("finish_localized_instant")),
+        "device_model": _string(
+            device_info.get("model") if isinstance(device_info, dict) else None, 100
+        ),
+        "n_beacons": len(beacons) if isinstance(beacons, list) else None,
+    }
+
+
+def read_session_metadata(filepath: Path) -> dict:
+    """
+    Get the ``SessionFiles`` columns filled from the header of a stored file.
+    """
+    return header_metadata(read_session_header(filepath))
+
+
+def file_digest(filepath: Path) -> tuple[int, str]:
+    """
+    Get the size and the SHA-256 of the decompressed contents of a stored
+    session file, reading it in blocks.
+
+    Returns
+    -------
+    tuple[int, str]
+        Size in bytes and hex SHA-256, as stored on upload.
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    for chunk in iter_decompressed(filepath, UPLOAD_CHUNK_SIZE):
+        hasher.update(chunk)
+        size += len(chunk)
+    return size, hasher.hexdigest()
@@ -0,0 +1,404 @@
+"""
+Parser of the session files uploaded by the surCO client.
+
+A session file has a JSON header line, a blank line, and then a CSV table::
+
+    {"version_scheme":4,"timezone":"Europe/Madrid",...}
+
+    beacon_id,localized_timestamp,data,latitude,longitude,azimuth
+    0xe3237b8fd355,08:42:37.765,1122,NaN,NaN,-13.248203
+"""
+
+from .compression import decompressing_reader, get_file_encoding
+
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import BinaryIO, Iterator, TextIO
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import io
+import json
+
+import numpy as np
+
+
+CSV_COLUMNS = (
+    "beacon_id",
+    "localized_timestamp",
+    "data",
+    "latitude",
+    "longitude",
+    "azimuth",
+)
+
+# rows whose time of day is earlier than the start of the session, by more than
+# this margin, are considered to be in the next day
+MIDNIGHT_MARGIN_MS = 3_600_000
+# bytes of CSV rows decoded at a time, about 300k rows
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024  # 16 MiB
+
+# record layout of a CSV row, as read by ``np.loadtxt``
+_ROW_DTYPE = np.dtype(
+    [
+        ("beacon_id", "S32"),
+        ("time_of_day", "S16"),
+        ("data", np.float32),
+        ("latitude", np.float64),
+        ("longitude", np.float64),
+        ("azimuth", np.float32),
+    ]
+)
+# byte offsets of a ``HH:MM:SS.fff`` time of day
+_TIME_DIGITS = np.array([0, 1, 3, 4, 6, 7, 9, 10, 11])
+_TIME_WEIGHTS = np.array(
+    [36_000_000, 3_600_000, 600_000, 60_000, 10_000, 1_000, 100, 10, 1],
+    dtype=np.int64,
+)
+
+
+class ParsedSession:
+    """
+    Session file decoded into typed columns.
+
+    Attributes
+    ----------
+    header : dict
+        JSON header of the session.
+    beacon_ids : list[str]
+        Dictionary of the beacon ids, indexed by the ``beacon`` column.
+    columns : dict[str, np.ndarray]
+        Typed columns, all of the same length:
+
+        - ``beacon``: ``uint16`` index into ``beacon_ids``.
+        - ``timestamp``: ``datetime64[ms]`` UTC instant of the sample.
+        - ``data``: ``float32`` intensity read by the beacon.
+        - ``latitude``, ``longitude``: ``float64`` degrees, ``NaN`` without fix.
+        - ``azimuth``: ``float32`` degrees.
+    """
+
+    COLUMN_DTYPES = {
+        "beacon": np.uint16,
+        "timestamp": "datetime64[ms]",
+        "data": np.float32,
+        "latitude": np.float64,
+        "longitude": np.float64,
+        "azimuth": np.float32,
+    }
+
+    def __init__(self, header: dict, beacon_ids: list[str], columns: dict):
+        self.header = header
+        self.beacon_ids = beacon_ids
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.columns["beacon"])
+
+    def __repr__(self):
+        return f"<ParsedSession {len(self)} rows : {len(self.beacon_ids)} beacons>"
+
+
+def open_session_text(filepath: Path) -> TextIO:
+    """
+    Open a stored session file as text, decompressing it on the fly if needed.
+    """
+    raw = filepath.open("rb")
+    return io.TextIOWrapper(
+        decompressing_reader(raw, get_file_encoding(filepath)),
+        encoding="utf-8",
+        newline="",
+    )
+
+
+def open_session_binary(filepath: Path) -> BinaryIO:
+    """
+    Open a stored session file as buffered bytes, decompressing it on the fly
+    if needed.
+    """
+    raw = filepath.open("rb")
+    return io.BufferedReader(decompressing_reader(raw, get_file_encoding(filepath)))
+
+
+def read_header(text: TextIO | BinaryIO) -> dict:
+    """
+    Read the JSON header line of a session file, leaving ``text`` positioned
+    at the CSV column names. ``text`` is read as text or bytes.
+
+    Raises
+    ------
+    ValueError
+        If the first line is not a JSON object.
+    """
+    header = json.loads(text.readline())
+    if not isinstance(header, dict):
+        raise ValueError("Session header is not a JSON object")
+    # skip the blank line between the header and the CSV table
+    line = text.readline()
+    if line.strip():
+        raise ValueError("Missing blank line after the session header")
+    return header
+
+
+def session_start_local(header: dict) -> tuple[datetime, timezone | ZoneInfo]:
+    """
+    Get the local start instant of a session and its time zone.
+    Sessions without a known start are placed on the Unix epoch, in UTC.
+    """
+    try:
+        tz = ZoneInfo(header["timezone"])
+    except (KeyError, TypeError, ValueError, ZoneInfoNotFoundError):
+        tz = timezone.utc
+    try:
+        start = datetime.fromisoformat(header["start_localized_instant"])
+    except (KeyError, TypeError, ValueError):
+        start = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return start.astimezone(tz), tz
+
+
+def times_of_day_to_utc(header: dict, ms_of_day: np.ndarray) -> np.ndarray:
+    """
+    Convert the local times of day of a session to UTC instants.
+
+    The date comes from the start of the session; times earlier than the start
+    belong to the next day.
+
+    Parameters
+    ----------
+    header : dict
+        JSON header of the session.
+    ms_of_day : np.ndarray
+        Local times of day, in milliseconds since midnight.
+
+    Returns
+    -------
+    np.ndarray
+        ``datetime64[ms]`` UTC instants.
+    """
+    start, tz = session_start_local(header)
+    midnight = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    start_ms = (start - midnight) // timedelta(milliseconds=1)
+    day_ms = np.where(ms_of_day < start_ms - MIDNIGHT_MARGIN_MS, 86_400_000, 0)
+    local = (
+        np.datetime64(midnight.replace(tzinfo=None), "ms")
+        + (ms_of_day.astype(np.int64) + day_ms).astype("timedelta64[ms]")
+    )
+    if not len(local):
+        return local
+
+    def utc_offset(instant: np.datetime64) -> timedelta:
+        return instant.astype(datetime).replace(tzinfo=tz).utcoffset()
+
+    first_offset = utc_offset(local.min())
+    if utc_offset(local.max()) == first_offset:
+        # no daylight saving change between the first and last rows (the
+        # common case)
+        return local - np.timedelta64(first_offset // timedelta(milliseconds=1), "ms")
+    # a daylight saving change in between: the offset of each distinct local
+    # minute, as the changes fall on whole minutes, instead of each row
+    minutes, minute_of_row = np.unique(
+        local.astype("datetime64[m]"), return_inverse=True
+    )
+    offsets = np.asarray(
+        [utc_offset(minute) // timedelta(milliseconds=1) for minute in minutes],
+        dtype="timedelta64[ms]",
+    )
+    return local - offsets[minute_of_row]
+
+
+def parse_time_of_day(value: str) -> int:
+    """
+    Parse a ``HH:MM:SS.fff`` time of day into milliseconds since midnight.
+    """
+    hours, minutes, seconds = value.split(":")
+    return round(
+        (int(hours) * 3600 + int(minutes) * 60 + float(seconds)) * 1000
+    )
+
+
+def times_of_day_to_ms(values: np.ndarray) -> np.ndarray:
+    """
+    Parse an array of ``HH:MM:SS.fff`` byte strings into milliseconds since
+    midnight.
+
+    Values in that fixed format, as written by the client, are decoded with
+    array arithmetic on their bytes; any other one goes through
+    ``parse_time_of_day``.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Byte string (``S``) array of times of day.
+
+    Returns
+    -------
+    np.ndarray
+        ``int64`` milliseconds since midnight.
+
+    Raises
+    ------
+    ValueError
+        If a value is not a time of day.
+    """
+    chars = values.astype("S16").view(np.uint8).reshape(len(values), 16)
+    digits = chars[:, _TIME_DIGITS].astype(np.int64) - ord("0")
+    regular = (
+        np.all((digits >= 0) & (digits <= 9), axis=1)
+        & (chars[:, 2] == ord(":"))
+        & (chars[:, 5] == ord(":"))
+        & (chars[:, 8] == ord("."))
+        & (chars[:, 12] == 0)
+    )
+    ms_of_day = digits @ _TIME_WEIGHTS
+    for i in np.flatnonzero(~regular):
+        ms_of_day[i] = parse_time_of_day(values[i].decode())
+    return ms_of_day
+
+
+def _load_rows(lines: str) -> np.ndarray:
+    """
+    Decode CSV lines, a block of text, into a record array of ``_ROW_DTYPE``.
+    Empty numeric fields are read as ``NaN``.
+    """
+    try:
+        return np.loadtxt(
+            io.StringIO(lines), delimiter=",", dtype=_ROW_DTYPE, ndmin=1
+        )
+    except ValueError:
+        pass
+    # slow path, only for the rare chunks with empty numeric fields
+    to_float = lambda value: float(value or "nan")  # noqa: E731
+    try:
+        return np.loadtxt(
+            io.StringIO(lines),
+            delimiter=",",
+            dtype=_ROW_DTYPE,
+            ndmin=1,
+            converters={i: to_float for i in range(2, 6)},
+        )
+    except ValueError as e:
+        raise ValueError(f"Invalid CSV row in session file: {e}") from e
+
+
+def _encode_beacons(
+    beacon_ids: np.ndarray, beacon_index: dict[str, int]
+) -> np.ndarray:
+    """
+    Dictionary encode the beacon ids of a chunk, in order of first appearance.
+    New ids are added to ``beacon_index``, shared by all chunks of a session.
+    """
+    unique, first, inverse = np.unique(
+        beacon_ids, return_index=True, return_inverse=True
+    )
+    codes = np.empty(len(unique), dtype=np.int64)
+    for i in np.argsort(first):
+        codes[i] = beacon_index.setdefault(unique[i].decode(), len(beacon_index))
+    if len(beacon_index) > np.iinfo(np.uint16).max + 1:
+        raise ValueError("Too many beacons in session file")
+    return codes[inverse.ravel()].astype(np.uint16)
+
+
+def iter_session_chunks(
+    filepath: Path, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator[ParsedSession]:
+    """
+    Parse a stored session file into typed columns, a chunk of rows at a time.
+
+    Only one chunk is held in memory, so files of any size can be processed.
+    Chunks are read as blocks of bytes, completed up to the end of their last
+    row, and decoded at once, without a Python object per row.
+    The beacon codes are consistent across the chunks of the file: the
+    ``beacon_ids`` of each chunk extend those of the previous one.
+
+    Parameters
+    ----------
+    filepath : Path
+        Path of the stored session file, compressed or not.
+    chunk_size : int, optional
+        Number of bytes of rows per chunk, exceeded by up to a row.
+
+    Yields
+    ------
+    ParsedSession
+        Header and columns of the next rows of the session.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a valid session file.
+    """
+    with open_session_binary(filepath) as f:
+        header = read_header(f)
+        if tuple(f.readline().decode().strip().split(",")) != CSV_COLUMNS:
+            raise ValueError("Unexpected CSV columns in session file")
+
+        beacon_index = {}
+        while block := f.read(chunk_size):
+            if not block.endswith(b"\n"):
+                block += f.readline()  # the rest of the last row
+            rows = _load_rows(block.decode("utf-8"))
+            if not len(rows):
+                continue  # only blank lines
+            columns = {
+                "beacon": _encode_beacons(rows["beacon_id"], beacon_index),
+                "timestamp": times_of_day_to_utc(
+                    header, times_of_day_to_ms(rows["time_of_day"])
+                ),
+            }
+            for name in ("data", "latitude", "longitude", "azimuth"):
+                columns[name] = np.ascontiguousarray(rows[name])
+            yield ParsedSession(header, list(beacon_index), columns)
+
+
+def read_session_header(filepath: Path) -> dict:
+    """
+    Read the JSON header of a stored session file, see ``read_header``.
+    """
+    with open_session_binary(filepath) as f:
+        return read_header(f)
+
+
+def empty_session(header: dict) -> ParsedSession:
+    """
+    Get a session without rows: empty columns of the right types.
+    """
+    return ParsedSession(
+        header,
+        [],
+        {
+            name: np.empty(0, dtype=dtype)
+            for name, dtype in ParsedSession.COLUMN_DTYPES.items()
+        },
+    )
+
+
+def parse_session(
+    filepath: Path, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> ParsedSession:
+    """
+    Parse a stored session file into typed columns.
+
+    Parameters
+    ----------
+    filepath : Path
+        Path of the stored session file, compressed or not.
+    chunk_size : int, optional
+        Number of bytes decoded at a time, see ``iter_session_chunks``.
+
+    Returns
+    -------
+    ParsedSession
+        Header and columns of the session.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a valid session file.
+    """
+    chunks = list(iter_session_chunks(filepath, chunk_size))
+    if len(chunks) == 1:
+        return chunks[0]
+    if not chunks:
+        return empty_session(read_session_header(filepath))
+    columns = {
+        name: np.concatenate([chunk.columns[name] for chunk in chunks])
+        for name in ParsedSession.COLUMN_DTYPES
+    }
+    return ParsedSession(chunks[-1].header, chunks[-1].beacon_ids, columns)
@@ -0,0 +1,236 @@
+"""
+Summary statistics of the session files.
+
+They are computed once, when a session file is stored, and kept in the
+``SessionSummaries`` table: one row for the whole session and one per beacon.
+Listing pages read them with a single query instead of opening the files.
+"""
+
+from flaskr.db_tables import SessionFiles, SessionSummaries, UserCredentials
+from .session_parser import ParsedSession
+
+from flask import current_app
+import sqlalchemy
+
+from datetime import datetime
+
+import numpy as np
+
+
+EARTH_RADIUS_M = 6_371_008.8
+DATA_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def route_distance(latitude: np.ndarray, longitude: np.ndarray) -> float:
+    """
+    Get the distance travelled along a route, with the haversine formula.
+    Points without GPS fix (``NaN``) are skipped.
+
+    Parameters
+    ----------
+    latitude, longitude : np.ndarray
+        Coordinates of the route, in degrees, in order.
+
+    Returns
+    -------
+    float
+        Length of the route, in meters.
+    """
+    fix = ~(np.isnan(latitude) | np.isnan(longitude))
+    lat = np.radians(latitude[fix])
+    lon = np.radians(longitude[fix])
+    if len(lat) < 2:
+        return 0.0
+    a = (
+        np.sin(np.diff(lat) / 2) ** 2
+        + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+    )
+    return float(2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a)).sum())
+
+
+def _optional_float(value) -> float | None:
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def _to_datetime(value: np.datetime64) -> datetime:
+    return value.astype("datetime64[ms]").astype(datetime)
+
+
+def summarize_columns(columns: dict[str, np.ndarray]) -> dict:
+    """
+    Compute the summary statistics of some rows of a session.
+
+    Parameters
+    ----------
+    columns : dict[str, np.ndarray]
+        Columns of the rows, see ``ParsedSession``.
+
+    Returns
+    -------
+    dict
+        Values of the statistics columns of ``SessionSummaries``.
+    """
+    timestamp = columns["timestamp"]
+    latitude = columns["latitude"]
+    longitude = columns["longitude"]
+    data = columns["data"].astype(np.float64)
+    n_samples = len(timestamp)
+
+    summary = {
+        "n_samples": n_samples,
+        "start": None,
+        "finish": None,
+        "duration_s": 0.0,
+        "sampling_rate_hz": None,
+        "distance_m": route_distance(latitude, longitude),
+    }
+    if n_samples:
+        start, finish = timestamp.min(), timestamp.max()
+        summary["start"] = _to_datetime(start)
+        summary["finish"] = _to_datetime(finish)
+        summary["duration_s"] = (finish - start) / np.timedelta64(1, "s")
+        if summary["duration_s"] > 0:
+            summary["sampling_rate_hz"] = n_samples / summary["duration_s"]
+
+    fix = ~(np.isnan(latitude) | np.isnan(longitude))
+    for name, values in (("latitude", latitude), ("longitude", longitude)):
+        summary[f"min_{name}"] = float(values[fix].min()) if fix.any() else None
+        summary[f"max_{name}"] = float(values[fix].max()) if fix.any() else None
+
+    data = data[~np.isnan(data)]
+    if len(data):
+        summary["data_min"] = float(data.min())
+        summary["data_mean"] = _optional_float(data.mean())
+        summary["data_max"] = float(data.max())
+        percentiles = np.percentile(data, DATA_PERCENTILES)
+    else:
+        summary["data_min"] = summary["data_mean"] = summary["data_max"] = None
+        percentiles = [None] * len(DATA_PERCENTILES)
+    for q, value in zip(DATA_PERCENTILES, percentiles):
+        summary[f"data_p{q:02d}"] = None if value is None else float(value)
+
+    return summary
+
+
+def compute_session_summaries(parsed: ParsedSession) -> dict[str | None, dict]:
+    """
+    Compute the summary statistics of a session and of each of its beacons.
+
+    The beacons sample at the same time, so the sampling rate of the whole
+    session is the median of those of its beacons, not of all their samples.
+
+    Parameters
+    ----------
+    parsed : ParsedSession
+        The parsed session.
+
+    Returns
+    -------
+    dict[str | None, dict]
+        Statistics by beacon id, and for the whole session under ``None``.
+    """
+    summaries = {None: summarize_columns(parsed.columns)}
+    beacon = parsed.columns["beacon"]
+    for code, beacon_id in enumerate(parsed.beacon_ids):
+        rows = np.flatnonzero(beacon == code)
+        summaries[beacon_id] = summarize_columns(
+            {name: values[rows] for name, values in parsed.columns.items()}
+        )
+    rates = [
+        summary["sampling_rate_hz"]
+        for beacon_id, summary in summaries.items()
+        if beacon_id is not None and summary["sampling_rate_hz"] is not None
+    ]
+    summaries[None]["sampling_rate_hz"] = float(np.median(rates)) if rates else None
+    return summaries
+
+
+def store_session_summaries(
+    session_file: SessionFiles, parsed: ParsedSession
+) -> list[SessionSummaries]:
+    """
+    Compute the summaries of a session file and store them in the database,
+    replacing any previous ones.
+
+    Parameters
+    ----------
+    session_file : SessionFiles
+        Database entry of the session file.
+    parsed : ParsedSession
+        The parsed session file.
+
+    Returns
+    -------
+    list[SessionSummaries]
+        The new summaries, the whole session one first.
+    """
+    summaries = [
+        SessionSummaries(session_file.id, beacon_id, **statistics)
+        for beacon_id, statistics in compute_session_summaries(parsed).items()
+    ]
+    with current_app.Session(expire_on_commit=False) as sql_db:
+        sql_db.query(SessionSummaries).filter_by(file_id=session_file.id).delete()
+        sql_db.add_all(summaries)
+        sql_db.commit()
+
+    return summaries
+
+
+def get_files_with_summary_for_user(
+    user: UserCredentials,
+) -> list[tuple[SessionFiles, SessionSummaries | None]]:
+    """
+    Get the files of a user, with the summary of each whole session.
+
+    Parameters
+    ----------
+    user : UserCredentials
+        User to get the files.
+
+    Returns
+    -------
+    list[tuple[SessionFiles, SessionSummaries | None]]
+        Files of the user and their summary, ``None`` if not computed.
+    """
+    try:
+        with current_app.Session() as sql_db:
+            rows = (
+                sql_db.query(SessionFiles, SessionSummaries)
+                .outerjoin(
+                    SessionSummaries,
+                    (SessionSummaries.file_id == SessionFiles.id)
+                    & SessionSummaries.beacon_id.is_(None),
+                )
+                .filter(SessionFiles.user_id == user.id)
+                .order_by(SessionFiles.id)
+                .all()
+            )
+    except sqlalchemy.exc.SQLAlchemyError:
+        return []
+
+    return [tuple(row) for row in rows]
+
+
+def get_session_summaries(session_file: SessionFiles) -> list[SessionSummaries]:
+    """
+    Get the summaries of a session file.
+
+    Parameters
+    ----------
+    session_file : SessionFiles
+        Database entry of the session file.
+
+    Returns
+    -------
+    list[SessionSummaries]
+        The whole session summary first, then one per beacon. Empty if they
+        were not computed.
+    """
+    with current_app.Session() as sql_db:
+        return (
+            sql_db.query(SessionSummaries)
+            .filter_by(file_id=session_file.id)
+            .order_by(SessionSummaries.beacon_id.is_not(None), SessionSummaries.id)
+            .all()
+        )
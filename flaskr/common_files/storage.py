@@ -0,0 +1,536 @@
+"""
+Backends storing the session blobs: the local filesystem, or an S3-compatible
+object store shared by several server nodes.
+
+Stored objects are addressed by keys, relative POSIX paths such as
+``3f/9a/3f9a...c2.gz``. Files are written to the store whole, from a local
+file, and read as streams or byte ranges. The parsers and the derived
+artifacts need local files: object stores keep a local copy of the objects
+read that way, in the same layout as the local store. The artifacts built
+next to it are stored as well, as a directory (see ``store_dir``), so the
+other nodes copy them instead of building them again.
+
+The local copies of an object store are a cache, bounded in size by
+``prune_cache``: the least recently used ones are removed.
+
+Downloads of an object store go straight from the store to the client, with
+a presigned link; local files are sent by the server, or by nginx.
+"""
+
+from .files import fsync_path
+
+from werkzeug.datastructures import Headers
+
+from pathlib import Path
+from typing import BinaryIO, NamedTuple
+import functools
+import os
+import shutil
+import tarfile
+import tempfile
+
+try:
+    import boto3
+    import botocore.exceptions
+except ImportError:  # optional dependency, only needed for the s3 backend
+    boto3 = None
+
+
+# backends of SESSION_STORAGE
+STORAGE_BACKENDS = ("local", "s3")
+
+# shard directories of the blob store (65536) and its staging directory
+_MAX_CACHED_DIRS = 256 * 256 + 1
+# suffix of the objects holding a directory, see SessionStorage.store_dir
+DIR_OBJECT_SUFFIX = ".tar"
+
+
+class ObjectInfo(NamedTuple):
+    """
+    Size in bytes and POSIX modification time of a stored object.
+    """
+
+    size: int
+    modified: float
+
+
+@functools.lru_cache(maxsize=_MAX_CACHED_DIRS)
+def ensure_dir(directory: Path) -> Path:
+    """
+    Create a directory of the store and its parents, if missing.
+
+    The directories of the store are never removed, so each one is created
+    once per process: later calls do not touch the disk.
+
+    Parameters
+    ----------
+    directory : Path
+        Directory to create.
+
+    Returns
+    -------
+    Path
+        The directory.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def check_storage(config) -> None:
+    """
+    Check the storage of the session blobs is configured and can be used.
+
+    Parameters
+    ----------
+    config : flask.Config
+        Configuration of the app, with ``SESSION_STORAGE`` and, for the s3
+        backend, the ``SESSION_STORAGE_S3_*`` values.
+
+    Raises
+    ------
+    ValueError
+        If the backend is unknown, lacks its settings, or its library is not
+        installed.
+    """
+    backend = config["SESSION_STORAGE"]
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown session storage: {backend}")
+    if backend == "s3":
+        if boto3 is None:
+            raise ValueError("s3 session storage requires the 'boto3' package")
+        if not config["SESSION_STORAGE_S3_BUCKET"]:
+            raise ValueError("s3 session storage requires SESSION_STORAGE_S3_BUCKET")
+
+
+class SessionStorage:
+    """
+    Store of the session blobs, addressed by key.
+
+    Parameters
+    ----------
+    root : Path
+        Local directory of the store: where the local backend keeps the
+        objects, and object stores keep their local copies.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def cache_path(self, key: str) -> Path:
+        """
+        Get the local path of an object, whether it exists or not.
+        """
+        return self.root / key
+
+    def info(self, key: str) -> ObjectInfo | None:
+        """
+        Get the size and modification time of an object, ``None`` if missing.
+        """
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        return self.info(key) is not None
+
+    def open(self, key: str) -> BinaryIO:
+        """
+        Open an object to read it as a stream, to be closed by the caller.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the object is missing.
+        """
+        raise NotImplementedError
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        """
+        Read ``length`` bytes of an object from offset ``start``, fewer if it
+        ends before.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the object is missing.
+        """
+        raise NotImplementedError
+
+    def store_file(self, key: str, filepath: Path) -> None:
+        """
+        Store a local file as an object, replacing any other one. The file is
+        moved: it is not left at ``filepath``.
+        """
+        raise NotImplementedError
+
+    def move(self, key: str, new_key: str) -> None:
+        """
+        Move an object to another key.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the object is missing.
+        """
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        """
+        Delete an object and its local copy, if any. Missing ones are ignored.
+        """
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Path | None:
+        """
+        Get a local file with the contents of an object, to parse it or build
+        its artifacts next to it.
+
+        Returns
+        -------
+        Path | None
+            Path of the local file, see ``cache_path``. ``None`` if the object
+            is missing.
+        """
+        raise NotImplementedError
+
+    def store_dir(self, key: str) -> None:
+        """
+        Store the local directory ``cache_path(key)``, e.g. the artifacts
+        derived from an object, so that the other nodes copy it with
+        ``fetch_dir``. Any stored one is replaced.
+        """
+        raise NotImplementedError
+
+    def fetch_dir(self, key: str) -> Path | None:
+        """
+        Get the local directory ``cache_path(key)``, copied from the store if
+        missing locally.
+
+        Returns
+        -------
+        Path | None
+            Path of the directory, ``None`` if missing in the store too.
+        """
+        raise NotImplementedError
+
+    def delete_dir(self, key: str) -> None:
+        """
+        Delete a directory stored with ``store_dir``, but not its local copy.
+        Missing ones are ignored.
+        """
+        raise NotImplementedError
+
+    def prune_cache(self, max_bytes: int) -> int:
+        """
+        Remove the least recently used local copies of the objects and
+        directories, until they take at most ``max_bytes``. Local storages
+        keep the objects themselves, and remove nothing.
+
+        Returns
+        -------
+        int
+            Number of objects and directories removed.
+        """
+        return 0
+
+    def download_url(
+        self, key: str, download_name: str, encoding: str | None
+    ) -> str | None:
+        """
+        Get a link to download an object straight from the store.
+
+        Parameters
+        ----------
+        key : str
+            Key of the object.
+        download_name : str
+            Name of the file for the client.
+        encoding : str | None
+            Content encoding of the object, sent as ``Content-Encoding``.
+
+        Returns
+        -------
+        str | None
+            The link, ``None`` if the objects are sent by the server.
+        """
+        return None
+
+
+class LocalStorage(SessionStorage):
+    """
+    Store of the session blobs in a local directory, ``root``.
+    """
+
+    def info(self, key: str) -> ObjectInfo | None:
+        try:
+            stat = self.cache_path(key).stat()
+        except FileNotFoundError:
+            return None
+        return ObjectInfo(stat.st_size, stat.st_mtime)
+
+    def open(self, key: str) -> BinaryIO:
+        return self.cache_path(key).open("rb")
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        with self.open(key) as f:
+            f.seek(start)
+            return f.read(length)
+
+    def store_file(self, key: str, filepath: Path) -> None:
+        destination = self.cache_path(key)
+        ensure_dir(destination.parent)
+        os.replace(filepath, destination)
+        # the rename survives a crash, as the database entry committed next
+        fsync_path(destination.parent)
+
+    def move(self, key: str, new_key: str) -> None:
+        destination = self.cache_path(new_key)
+        ensure_dir(destination.parent)
+        os.replace(self.cache_path(key), destination)
+
+    def delete(self, key: str) -> None:
+        self.cache_path(key).unlink(missing_ok=True)
+
+    def local_path(self, key: str) -> Path | None:
+        filepath = self.cache_path(key)
+        return filepath if filepath.exists() else None
+
+    def store_dir(self, key: str) -> None:
+        pass  # already in place
+
+    def fetch_dir(self, key: str) -> Path | None:
+        directory = self.cache_path(key)
+        return directory if directory.is_dir() else None
+
+    def delete_dir(self, key: str) -> None:
+        pass  # the local copy is the stored one
+
+
+class S3Storage(SessionStorage):
+    """
+    Store of the session blobs in a bucket of an S3-compatible object store,
+    e.g. AWS S3 or MinIO, with local copies of the objects read as files.
+
+    Parameters
+    ----------
+    root : Path
+        Local directory of the copies.
+    client : botocore.client.S3
+        Client of the object store, see ``create_s3_client``.
+    bucket : str
+        Name of the bucket.
+    prefix : str
+        Prefix of the keys of the objects in the bucket, e.g. ``"sessions/"``.
+    url_expires_s : int
+        Seconds the download links are valid.
+    """
+
+    def __init__(
+        self, root: Path, client, bucket: str, prefix: str = "", url_expires_s=300
+    ):
+        super().__init__(root)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.url_expires_s = url_expires_s
+
+    def _object_key(self, key: str) -> str:
+        return self.prefix + key
+
+    def _get_object(self, key: str, **kwargs) -> dict:
+        try:
+            return self.client.get_object(
+                Bucket=self.bucket, Key=self._object_key(key), **kwargs
+            )
+        except botocore.exceptions.ClientError as error:
+            if error.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                raise FileNotFoundError(key) from error
+            raise
+
+    def info(self, key: str) -> ObjectInfo | None:
+        try:
+            head = self.client.head_object(
+                Bucket=self.bucket, Key=self._object_key(key)
+            )
+        except botocore.exceptions.ClientError as error:
+            if error.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        return ObjectInfo(head["ContentLength"], head["LastModified"].timestamp())
+
+    def open(self, key: str) -> BinaryIO:
+        return self._get_object(key)["Body"]
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        if length <= 0:
+            return b""
+        try:
+            response = self._get_object(
+                key, Range=f"bytes={start}-{start + length - 1}"
+            )
+        except botocore.exceptions.ClientError as error:
+            if error.response["Error"]["Code"] == "InvalidRange":
+                return b""  # starts after the end
+            raise
+        with response["Body"] as body:
+            return body.read()
+
+    def store_file(self, key: str, filepath: Path) -> None:
+        # multipart for large files, read from the disk in parts
+        self.client.upload_file(
+            str(filepath),
+            self.bucket,
+            self._object_key(key),
+            ExtraArgs={"ContentType": "text/plain"},
+        )
+        # kept as the local copy, for the processing jobs of the upload
+        cache_path = self.cache_path(key)
+        ensure_dir(cache_path.parent)
+        os.replace(filepath, cache_path)
+
+    def move(self, key: str, new_key: str) -> None:
+        if not self.exists(key):
+            raise FileNotFoundError(key)
+        self.client.copy(
+            {"Bucket": self.bucket, "Key": self._object_key(key)},
+            self.bucket,
+            self._object_key(new_key),
+        )
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        self.cache_path(key).unlink(missing_ok=True)
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        self.cache_path(key).unlink(missing_ok=True)
+
+    def local_path(self, key: str) -> Path | None:
+        cache_path = self.cache_path(key)
+        try:
+            # recently used, see prune_cache
+            os.utime(cache_path)
+            return cache_path
+        except FileNotFoundError:
+            pass
+        ensure_dir(cache_path.parent)
+        # downloaded next to it and renamed, so readers never see a partial copy
+        fd, tmp_name = tempfile.mkstemp(dir=cache_path.parent, prefix=".download-")
+        try:
+            with os.fdopen(fd, "wb") as f, self.open(key) as body:
+                shutil.copyfileobj(body, f, 1024 * 1024)
+            os.replace(tmp_name, cache_path)
+        except FileNotFoundError:
+            return None
+        finally:
+            Path(tmp_name).unlink(missing_ok=True)
+        return cache_path
+
+    def store_dir(self, key: str) -> None:
+        directory = self.cache_path(key)
+        # a single object, so readers never see part of the directory
+        fd, tmp_name = tempfile.mkstemp(dir=directory.parent, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as f, tarfile.open(fileobj=f, mode="w") as tar:
+                for path in sorted(directory.iterdir()):
+                    if not path.name.startswith("."):  # partial files
+                        tar.add(path, arcname=path.name)
+            self.client.upload_file(
+                tmp_name, self.bucket, self._object_key(key + DIR_OBJECT_SUFFIX)
+            )
+        finally:
+            Path(tmp_name).unlink(missing_ok=True)
+
+    def fetch_dir(self, key: str) -> Path | None:
+        directory = self.cache_path(key)
+        try:
+            os.utime(directory)
+            return directory
+        except FileNotFoundError:
+            pass
+        ensure_dir(directory.parent)
+        # extracted next to it and renamed, so readers never see part of it
+        tmp_dir = Path(tempfile.mkdtemp(dir=directory.parent, prefix=".download-"))
+        try:
+            with self.open(key + DIR_OBJECT_SUFFIX) as body:
+                with tarfile.open(fileobj=body, mode="r|") as tar:
+                    tar.extractall(tmp_dir, filter="data")
+            os.replace(tmp_dir, directory)
+        except FileNotFoundError:
+            return None
+        except OSError:
+            if not directory.is_dir():
+                raise
+            # copied meanwhile by another thread or process
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return directory
+
+    def delete_dir(self, key: str) -> None:
+        self.client.delete_object(
+            Bucket=self.bucket, Key=self._object_key(key + DIR_OBJECT_SUFFIX)
+        )
+
+    def prune_cache(self, max_bytes: int) -> int:
+        # the copies are in the shard directories, e.g. 3f/9a/; their
+        # modification times are refreshed on each use
+        entries = []
+        for shard_dir in self.root.glob("[0-9a-f][0-9a-f]/[0-9a-f][0-9a-f]"):
+            for path in shard_dir.iterdir():
+                if path.name.startswith("."):
+                    continue  # being downloaded or uploaded
+                try:
+                    stat = path.stat()
+                    size = stat.st_size
+                    if path.is_dir():
+                        size = sum(f.stat().st_size for f in path.iterdir())
+                except FileNotFoundError:
+                    continue  # removed meanwhile
+                entries.append((stat.st_mtime, size, path))
+
+        total = sum(size for _, size, _ in entries)
+        n_removed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+            total -= size
+            n_removed += 1
+        return n_removed
+
+    def download_url(
+        self, key: str, download_name: str, encoding: str | None
+    ) -> str | None:
+        headers = Headers()
+        headers.set("Content-Disposition", "attachment", filename=download_name)
+        params = {
+            "Bucket": self.bucket,
+            "Key": self._object_key(key),
+            "ResponseContentDisposition": headers["Content-Disposition"],
+            "ResponseContentType": "text/plain",
+            # the sessions of a user are not for shared caches
+            "ResponseCacheControl": "private, no-cache",
+        }
+        if encoding is not None:
+            params["ResponseContentEncoding"] = encoding
+        return self.client.generate_presigned_url(
+            "get_object", Params=params, ExpiresIn=self.url_expires_s
+        )
+
+
+def create_s3_client(config):
+    """
+    Create the client of the object store of the session blobs.
+
+    The credentials are found by boto3 as usual, e.g. in the
+    ``AWS_ACCESS_KEY_ID`` and ``AWS_SECRET_ACCESS_KEY`` environment variables.
+
+    Parameters
+    ----------
+    config : flask.Config
+        Configuration of the app, with the ``SESSION_STORAGE_S3_*`` values.
+    """
+    return boto3.client(
+        "s3",
+        endpoint_url=config["SESSION_STORAGE_S3_ENDPOINT_URL"] or None,
+        region_name=config["SESSION_STORAGE_S3_REGION"] or None,
+    )
@@ -0,0 +1,366 @@
+"""
+Multi-resolution (level-of-detail) traces of a session, for viewport queries.
+
+Each beacon trace is simplified once with Douglas-Peucker, recording for every
+point the tolerance down to which it is kept (its significance). The levels
+are nested, so the whole pyramid is a single array aligned with the trace:
+the level for a tolerance is the points whose significance reaches it.
+
+The pyramid is stored in the columnar sidecar of the session:
+
+- ``lod_rows.npy``: rows with GPS fix, grouped by beacon, in file order.
+- ``lod_offsets.npy``: start of each beacon in ``lod_rows`` (plus the end).
+- ``lod_significance.npy``: significance of each of ``lod_rows``, in degrees.
+"""
+
+from .session_columns import get_columns_dir, load_session_columns
+from .session_parser import ParsedSession
+
+from pathlib import Path
+import os
+import tempfile
+
+import numpy as np
+
+
+MIN_ZOOM = 0
+MAX_ZOOM = 20
+# simplification tolerance, in screen pixels
+PIXEL_TOLERANCE = 1.0
+LOD_ARRAYS = ("lod_rows", "lod_offsets", "lod_significance")
+# maximum number of points per beacon returned by viewport queries, so the map
+# downloads kilobytes instead of the whole session file
+MAX_TRACE_POINTS = 20000
+# per-point properties of each line returned by viewport queries
+LINE_PROPERTIES = ("data", "data_min", "data_max", "azimuth", "time")
+
+
+def zoom_tolerance(zoom: int) -> float:
+    """
+    Get the simplification tolerance, in degrees, for a web map zoom level.
+    At zoom ``z`` the world is ``256 * 2**z`` pixels wide.
+    """
+    zoom = min(max(zoom, MIN_ZOOM), MAX_ZOOM)
+    return PIXEL_TOLERANCE * 360.0 / (256 * 2**zoom)
+
+
+def decimate_indices(n: int, max_points: int) -> np.ndarray:
+    """
+    Get evenly spaced indices of at most ``max_points`` out of ``n``,
+    always keeping the first and last ones.
+    """
+    if n <= max_points:
+        return np.arange(n)
+    return np.unique(np.linspace(0, n - 1, max_points).round().astype(np.int64))
+
+
+def to_json_list(values: np.ndarray, decimals: int | None = None) -> list:
+    """
+    Convert an array to a list for JSON, with ``NaN`` as ``null``.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if decimals is not None:
+        values = values.round(decimals)
+    return np.where(np.isnan(values), None, values).tolist()
+
+
+def douglas_peucker_significance(
+    x: np.ndarray, y: np.ndarray, min_tolerance: float
+) -> np.ndarray:
+    """
+    Compute the Douglas-Peucker significance of each point of a polyline.
+
+    A point is kept by Douglas-Peucker simplification at tolerance ``t`` if its
+    significance is ``>= t``. Significances are capped by the one of the split
+    that created them, so the simplifications are nested. The ends are always
+    kept. Points below ``min_tolerance`` get ``0``.
+
+    Parameters
+    ----------
+    x, y : np.ndarray
+        Coordinates of the polyline.
+    min_tolerance : float
+        Smallest tolerance to resolve; splitting stops below it.
+
+    Returns
+    -------
+    np.ndarray
+        ``float32`` significance of each point.
+    """
+    n = len(x)
+    significance = np.zeros(n, dtype=np.float32)
+    if n == 0:
+        return significance
+    significance[[0, -1]] = np.inf
+
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        first, last, parent = stack.pop()
+        if last - first < 2:
+            continue
+        xs = x[first + 1:last] - x[first]
+        ys = y[first + 1:last] - y[first]
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        norm = np.hypot(dx, dy)
+        if norm > 0:
+            distances = np.abs(dy * xs - dx * ys) / norm
+        else:  # closed loop, distance to the end point
+            distances = np.hypot(xs, ys)
+        k = int(np.argmax(distances))
+        if distances[k] < min_tolerance:
+            continue
+        split = first + 1 + k
+        significance[split] = min(distances[k], parent)
+        stack.append((first, split, significance[split]))
+        stack.append((split, last, significance[split]))
+
+    return significance
+
+
+def build_trace_pyramid(
+    filepath: Path, parsed: ParsedSession | None = None
+) -> dict:
+    """
+    Build the level-of-detail pyramid of each beacon trace of a stored session,
+    and save it in its columnar sidecar.
+
+    Parameters
+    ----------
+    filepath : Path
+        Path of the stored session file, compressed or not.
+    parsed : ParsedSession, optional
+        Already parsed session, loaded from the sidecar if not given.
+
+    Returns
+    -------
+    dict
+        The pyramid arrays, by name.
+    """
+    parsed = parsed or load_session_columns(filepath)
+    columns = parsed.columns
+    latitude = np.asarray(columns["latitude"])
+    longitude = np.asarray(columns["longitude"])
+    has_fix = ~(np.isnan(latitude) | np.isnan(longitude))
+
+    rows, offsets, significance = [], [0], []
+    for beacon_code in range(len(parsed.beacon_ids)):
+        beacon_rows = np.flatnonzero(has_fix & (columns["beacon"] == beacon_code))
+        lat = latitude[beacon_rows]
+        # project longitudes so distances are isotropic around the trace
+        x = longitude[beacon_rows] * np.cos(np.radians(np.mean(lat) if len(lat) else 0))
+        rows.append(beacon_rows)
+        offsets.append(offsets[-1] + len(beacon_rows))
+        significance.append(
+            douglas_peucker_significance(x, lat, zoom_tolerance(MAX_ZOOM))
+        )
+
+    pyramid = {
+        "lod_rows": np.concatenate(rows or [np.empty(0, np.int64)]),
+        "lod_offsets": np.asarray(offsets, dtype=np.int64),
+        "lod_significance": np.concatenate(significance or [np.empty(0, np.float32)]),
+    }
+    columns_dir = get_columns_dir(filepath)
+    for name, values in pyramid.items():
+        # unique, as jobs of files with the same contents share the sidecar
+        fd, tmp_name = tempfile.mkstemp(dir=columns_dir, prefix=f".{name}.npy.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, values, allow_pickle=False)
+            os.replace(tmp_name, columns_dir / f"{name}.npy")
+        finally:
+            Path(tmp_name).unlink(missing_ok=True)
+    return pyramid
+
+
+def load_trace_pyramid(
+    filepath: Path, parsed: ParsedSession | None = None, build: bool = True
+) -> dict:
+    """
+    Load the level-of-detail pyramid of a stored session, memory-mapped,
+    building it first if missing, from ``parsed`` if given.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the pyramid is missing, and ``build`` is false.
+    """
+    columns_dir = get_columns_dir(filepath)
+    try:
+        return {
+            name: np.load(columns_dir / f"{name}.npy", mmap_mode="r")
+            for name in LOD_ARRAYS
+        }
+    except FileNotFoundError:
+        if not build:
+            raise
+        return build_trace_pyramid(filepath, parsed)
+
+
+def _select_runs(
+    lon: np.ndarray,
+    lat: np.ndarray,
+    bbox: tuple[float, float, float, float] | None,
+    max_points: int,
+) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Select the points of a trace to return for a viewport.
+
+    The segments whose bounding box meets the viewport are visible, with both
+    their ends, so lines crossing it are kept even with no point inside. The
+    visible points are split in runs of consecutive points, not to join
+    distant parts of the trace; runs of a single point are dropped, as they
+    are no line. Beyond ``max_points`` in total, each run is decimated evenly
+    to its share, keeping its ends, and only the longest runs are kept if
+    they are too many to keep both ends of each.
+
+    Returns
+    -------
+    list[tuple[np.ndarray, np.ndarray]]
+        Each run, as indices of the trace points, with the indices in the run
+        of its points selected.
+    """
+    if bbox is None:
+        visible = np.arange(len(lon))
+    else:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        segments = (
+            (np.fmin(lon[:-1], lon[1:]) <= max_lon)
+            & (np.fmax(lon[:-1], lon[1:]) >= min_lon)
+            & (np.fmin(lat[:-1], lat[1:]) <= max_lat)
+            & (np.fmax(lat[:-1], lat[1:]) >= min_lat)
+        )
+        visible = np.zeros(len(lon), dtype=bool)
+        visible[:-1] |= segments
+        visible[1:] |= segments
+        visible = np.flatnonzero(visible)
+    runs = np.split(visible, np.flatnonzero(np.diff(visible) > 1) + 1)
+    runs = [run for run in runs if len(run) >= 2]
+
+    n_visible = sum(len(run) for run in runs)
+    if n_visible <= max_points:
+        return [(run, np.arange(len(run))) for run in runs]
+    if len(runs) > max_points // 2:
+        longest = sorted(range(len(runs)), key=lambda i: -len(runs[i]))
+        runs = [runs[i] for i in sorted(longest[: max_points // 2])]
+        n_visible = sum(len(run) for run in runs)
+    # both ends of each run, plus its share of the remaining points
+    spare = max_points - 2 * len(runs)
+    n_inner = n_visible - 2 * len(runs)
+    return [
+        (run, decimate_indices(len(run), 2 + (len(run) - 2) * spare // n_inner))
+        for run in runs
+    ]
+
+
+def query_viewport(
+    filepath: Path,
+    zoom: int,
+    bbox: tuple[float, float, float, float] | None = None,
+    max_points: int = MAX_TRACE_POINTS,
+) -> dict:
+    """
+    Get the trace of each beacon visible in a viewport, at the level of detail
+    of a zoom level.
+
+    Only the artifacts of the session are read, built beforehand by its
+    processing job: they are never built here, within a request.
+
+    Parameters
+    ----------
+    filepath : Path
+        Path of the stored session file, compressed or not.
+    zoom : int
+        Web map zoom level, selects the level of detail.
+    bbox : tuple[float, float, float, float], optional
+        Viewport as ``(min_lon, min_lat, max_lon, max_lat)``. Whole trace if
+        not given. Points just outside are included so lines reach the edges.
+    max_points : int, optional
+        Maximum number of points per beacon, decimated evenly beyond it
+        within each visible run, whose ends are kept. See ``_select_runs``.
+
+    Returns
+    -------
+    dict
+        GeoJSON ``FeatureCollection`` with a ``MultiLineString`` per beacon
+        (one line per visible run). Properties hold, per line, the ``data``,
+        ``azimuth`` and ``time`` of each point, and the ``data_min`` and
+        ``data_max`` of the samples between it and the next point.
+        The collection properties hold the ``bounds`` of the whole session.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the columns or the pyramid of the session are missing or outdated.
+    """
+    parsed = load_session_columns(filepath, build=False)
+    pyramid = load_trace_pyramid(filepath, parsed, build=False)
+    columns = parsed.columns
+    offsets = pyramid["lod_offsets"]
+    tolerance = zoom_tolerance(zoom)
+
+    all_rows = np.asarray(pyramid["lod_rows"])
+    bounds = None
+    if len(all_rows):
+        lon, lat = columns["longitude"][all_rows], columns["latitude"][all_rows]
+        bounds = [
+            float(lon.min()), float(lat.min()), float(lon.max()), float(lat.max())
+        ]
+
+    features = []
+    for beacon_code, beacon_id in enumerate(parsed.beacon_ids):
+        start, end = offsets[beacon_code], offsets[beacon_code + 1]
+        rows = all_rows[start:end]
+        kept = np.flatnonzero(pyramid["lod_significance"][start:end] >= tolerance)
+        lines = {name: [] for name in ("coordinates", *LINE_PROPERTIES)}
+        if len(kept):
+            data = np.asarray(columns["data"][rows], dtype=np.float64)
+            data_min = np.fmin.reduceat(data, kept)
+            data_max = np.fmax.reduceat(data, kept)
+            kept_rows = rows[kept]
+            lon = columns["longitude"][kept_rows]
+            lat = columns["latitude"][kept_rows]
+
+            for run, selected in _select_runs(lon, lat, bbox, max_points):
+                points = run[selected]
+                lines["coordinates"].append(
+                    np.stack([lon[points], lat[points]], axis=1).round(6).tolist()
+                )
+                lines["data"].append(to_json_list(data[kept[points]]))
+                # the samples between each returned point and the next one
+                lines["data_min"].append(
+                    to_json_list(np.fmin.reduceat(data_min[run], selected))
+                )
+                lines["data_max"].append(
+                    to_json_list(np.fmax.reduceat(data_max[run], selected))
+                )
+                lines["azimuth"].append(
+                    to_json_list(columns["azimuth"][kept_rows[points]], 2)
+                )
+                lines["time"].append(
+                    columns["timestamp"][kept_rows[points]].astype(np.int64).tolist()
+                )
+
+        features.append(
+            {
+                "type": "Feature",
+                "geometry": {
+                    "type": "MultiLineString",
+                    "coordinates": lines.pop("coordinates"),
+                },
+                "properties": {
+                    "beacon_id": beacon_id,
+                    "n_points_total": int(end - start),
+                    **lines,
+                },
+            }
+        )
+
+    return {
+        "type": "FeatureCollection",
+        "properties": {
+            "timezone": parsed.header.get("timezone"),
+            "zoom": zoom,
+            "bounds": bounds,
+        },
+        "features": features,
+    }
@@ -9,10 +9,25 @@ from .user_credentials_validator import (  # noqa: F401
 from . user_login_signin import (  # noqa: F401
     salt_and_hash_password,
     hash_password,
+    decoy_salt,
     valid_login,
     register_user,
 )
+from .password_hashing import (  # noqa: F401
+    HashingBusyError,
+    RETRY_AFTER_S,
+    get_hashing_executor,
+)
+from .stored_passhash import (  # noqa: F401
+    PASSHASH_SCHEMES,
+    passhash_scheme,
+)
 from . user_getters import (  # noqa: F401
     get_user_by_email,
     get_user_by_id,
 )
+from .user_cache import (  # noqa: F401
+    get_cached_user_by_email,
+    invalidate_cached_user,
+    load_jwt_user,
+)
@@ -0,0 +1,115 @@
+"""
+Executor of the password hashing of logins and signups.
+
+Argon2 and the rehash of the stored hashes take hundreds of milliseconds of CPU
+and tens of MB of memory per call. Run in the request threads, a few concurrent
+logins take all the CPU of the server and stall every other request.
+
+Each server process hashes in a pool of ``HASH_WORKERS`` worker processes, and
+admits at most ``HASH_QUEUE_LIMIT`` more hashes waiting for them. Beyond that,
+``HashingBusyError`` is raised and the views answer 503 with ``Retry-After``,
+instead of queueing requests that would time out anyway. With 0 workers the
+hashes run in the request threads, still bounded by the same limit.
+"""
+
+from flask import current_app
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import threading
+
+
+# Seconds clients are asked to wait before retrying, when the executor is busy
+RETRY_AFTER_S = 1
+
+
+class HashingBusyError(RuntimeError):
+    """
+    Raised when the password hashing of the process admits no more work.
+    """
+
+
+class HashingExecutor:
+    """
+    Bounded executor of password hashing functions.
+
+    Parameters
+    ----------
+    workers : int
+        Worker processes; 0 to run the functions in the calling thread.
+    queue_limit : int
+        Calls admitted beyond the running ones, waiting for a worker.
+    """
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.max_pending = max(workers, 1) + queue_limit
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor | None:
+        if self.workers <= 0:
+            return None
+        with self._pool_lock:
+            # a forked server process can not use the workers of its parent
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def run(self, fn, /, *args):
+        """
+        Run ``fn(*args)`` in a worker and wait for its result.
+
+        ``fn`` must be a module level function, and its arguments picklable.
+
+        Raises
+        ------
+        HashingBusyError
+            If ``max_pending`` calls are already running or waiting.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusyError("Password hashing is saturated")
+        try:
+            pool = self._get_pool()
+            if pool is None:
+                return fn(*args)
+            try:
+                return pool.submit(fn, *args).result()
+            except BrokenProcessPool as e:
+                # a worker died (e.g. killed when out of memory): start anew
+                with self._pool_lock:
+                    if self._pool is pool:
+                        self._pool = None
+                pool.shutdown(wait=False)
+                raise HashingBusyError("Password hashing workers restarting") from e
+        finally:
+            self._slots.release()
+
+    def shutdown(self) -> None:
+        with self._pool_lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown()
+            self._pool = None
+
+
+def get_hashing_executor() -> HashingExecutor:
+    """
+    Get the password hashing executor of the current app.
+    """
+    executor = current_app.extensions.get("hashing_executor")
+    if executor is None:
+        executor = current_app.extensions.setdefault(
+            "hashing_executor",
+            HashingExecutor(
+                current_app.config["HASH_WORKERS"],
+                current_app.config["HASH_QUEUE_LIMIT"],
+            ),
+        )
+    return executor
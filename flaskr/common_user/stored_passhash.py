@@ -0,0 +1,111 @@
+"""
+Verifiers of the password hashes stored for the users.
+
+The client apps send the Argon2 ID hash of the password (``passHash``), which is
+already slow to compute from the password. The server stores it hashed again,
+so a leaked database does not hold the values accepted on login. Two schemes
+are supported, chosen with ``PASSHASH_SCHEME``:
+
+- ``hmac-sha256``: HMAC-SHA256 of the ``passHash``, keyed by the server secret
+  ``PASSHASH_PEPPER``. Verifying takes microseconds. Guessing passwords from a
+  leaked database still costs an Argon2 per guess, and needs the pepper too.
+- ``werkzeug``: ``generate_password_hash`` of werkzeug (scrypt), the scheme of
+  the first versions of the server. Verifying takes tens of milliseconds of CPU.
+
+The scheme of each stored hash is told by its prefix, so both are verified. On
+a successful login, hashes of the other scheme are replaced by one of the
+configured scheme, see ``valid_login``. Changing ``PASSHASH_PEPPER`` invalidates
+the ``hmac-sha256`` hashes stored.
+"""
+
+from .password_hashing import get_hashing_executor
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import hashlib
+import hmac
+
+
+HMAC_PREFIX = "hmac-sha256$"
+PASSHASH_SCHEMES = ("hmac-sha256", "werkzeug")
+
+
+def passhash_scheme(stored_passhash: str) -> str:
+    """
+    Get the scheme of a stored hash, one of ``PASSHASH_SCHEMES``.
+    """
+    if stored_passhash.startswith(HMAC_PREFIX):
+        return "hmac-sha256"
+    return "werkzeug"
+
+
+def _hmac_passhash(passHash: str) -> str:
+    digest = hmac.new(
+        current_app.config["PASSHASH_PEPPER"].encode("utf-8"),
+        passHash.encode("utf-8"),
+        hashlib.sha256,
+    ).hexdigest()
+    return HMAC_PREFIX + digest
+
+
+def make_stored_passhash(passHash: str) -> str:
+    """
+    Hash a client ``passHash`` to store it, with the configured scheme.
+
+    Parameters
+    ----------
+    passHash : str
+        Argon2 ID hash of the password.
+
+    Returns
+    -------
+    str
+        Hash to store in ``UserCredentials.passhash``.
+
+    Raises
+    ------
+    HashingBusyError
+        If the scheme is ``werkzeug`` and the password hashing is saturated.
+    """
+    if current_app.config["PASSHASH_SCHEME"] == "hmac-sha256":
+        return _hmac_passhash(passHash)
+    return get_hashing_executor().run(generate_password_hash, passHash)
+
+
+def check_stored_passhash(stored_passhash: str, passHash: str) -> bool:
+    """
+    Check a client ``passHash`` against a stored hash, of any scheme.
+
+    Parameters
+    ----------
+    stored_passhash : str
+        Hash stored in ``UserCredentials.passhash``.
+    passHash : str
+        Argon2 ID hash of the password.
+
+    Returns
+    -------
+    bool
+        Whether they match.
+
+    Raises
+    ------
+    HashingBusyError
+        If the stored hash is a ``werkzeug`` one and the password hashing is
+        saturated.
+    """
+    if passhash_scheme(stored_passhash) == "hmac-sha256":
+        if not current_app.config["PASSHASH_PEPPER"]:
+            # werkzeug scheme without the pepper of the former hmac-sha256 one
+            current_app.logger.error("PASSHASH_PEPPER is required to verify login")
+            return False
+        return hmac.compare_digest(stored_passhash, _hmac_passhash(passHash))
+    return get_hashing_executor().run(check_password_hash, stored_passhash, passHash)
+
+
+def needs_rehash(stored_passhash: str) -> bool:
+    """
+    Check whether a stored hash is not of the configured scheme.
+    """
+    return passhash_scheme(stored_passhash) != current_app.config["PASSHASH_SCHEME"]
@@ -0,0 +1,152 @@
+"""
+Cache of the users of the authenticated requests.
+
+Every authenticated request resolves its JWT identity (the email) to its
+``UserCredentials`` row. flask-jwt-extended loads it once per request with the
+``user_lookup_loader`` registered in ``create_app``, and ``get_current_user``
+returns it to the views. Across requests, users are kept in a bounded cache
+for ``USER_CACHE_TTL`` seconds, so most requests do not query them at all.
+
+The cache is local to each server process. Changes made through the ORM in
+this process invalidate it; changes made by other processes are seen once the
+entries expire, so ``USER_CACHE_TTL`` bounds the staleness. Set it to 0 to
+disable the cache. Logins do not use it, see ``valid_login``.
+"""
+
+from flaskr.db_tables import UserCredentials
+from .user_getters import get_user_by_email
+
+from flask import current_app, has_app_context
+import sqlalchemy
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class UserCache:
+    """
+    Thread-safe LRU cache of users by email, whose entries expire.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of users kept; the least recently used are dropped.
+    ttl : float
+        Seconds an entry is valid after it is stored.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # email -> (expiry, user)
+        self._lock = threading.Lock()
+
+    def get(self, email: str) -> UserCredentials | None:
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None:
+                return None
+            expiry, user = entry
+            if expiry < time.monotonic():
+                del self._entries[email]
+                return None
+            self._entries.move_to_end(email)
+            return user
+
+    def put(self, email: str, user: UserCredentials) -> None:
+        with self._lock:
+            self._entries[email] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        """
+        Drop the entry of a user, whatever the email it is cached under.
+        """
+        with self._lock:
+            for email, (_, user) in list(self._entries.items()):
+                if user.id == user_id:
+                    del self._entries[email]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def get_user_cache() -> UserCache | None:
+    """
+    Get the user cache of the current app, ``None`` if disabled.
+    """
+    if current_app.config["USER_CACHE_TTL"] <= 0:
+        return None
+    cache = current_app.extensions.get("user_cache")
+    if cache is None:
+        cache = current_app.extensions.setdefault(
+            "user_cache",
+            UserCache(
+                current_app.config["USER_CACHE_SIZE"],
+                current_app.config["USER_CACHE_TTL"],
+            ),
+        )
+    return cache
+
+
+def get_cached_user_by_email(usermail: str) -> UserCredentials | None:
+    """
+    Get a user by email, from the cache if possible.
+    Users not found are not cached, so new users are found at once.
+
+    Parameters
+    ----------
+    usermail : str
+        Email of the user.
+
+    Returns
+    -------
+    UserCredentials | None
+        User with the email provided, detached from any database session.
+        ``None`` if not found.
+    """
+    usermail = usermail.lower()
+    cache = get_user_cache()
+    if cache is not None and (user := cache.get(usermail)) is not None:
+        return user
+
+    user = get_user_by_email(usermail)
+    if cache is not None and user is not None:
+        cache.put(usermail, user)
+    return user
+
+
+def invalidate_cached_user(user: UserCredentials) -> None:
+    """
+    Drop a user from the cache of the current app, after changing it.
+
+    Parameters
+    ----------
+    user : UserCredentials
+        User that changed.
+    """
+    cache = current_app.extensions.get("user_cache")
+    if cache is not None:
+        cache.invalidate(user.id)
+
+
+@sqlalchemy.event.listens_for(UserCredentials, "after_update")
+@sqlalchemy.event.listens_for(UserCredentials, "after_delete")
+def _invalidate_on_change(mapper, connection, target: UserCredentials):
+    if has_app_context():
+        invalidate_cached_user(target)
+
+
+def load_jwt_user(jwt_header: dict, jwt_data: dict) -> UserCredentials | None:
+    """
+    ``user_lookup_loader`` of flask-jwt-extended: the user of the JWT identity.
+    """
+    identity = jwt_data[current_app.config["JWT_IDENTITY_CLAIM"]]
+    return get_cached_user_by_email(identity)
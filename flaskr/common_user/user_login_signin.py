@@ -1,17 +1,33 @@
 from flaskr.db_tables import UserCredentials
+from flaskr.env_config import ARGON2_TIME_COST, ARGON2_MEMORY_COST, ARGON2_PARALLELISM
 from .user_getters import get_user_by_email
+from .password_hashing import get_hashing_executor
+from .stored_passhash import check_stored_passhash, make_stored_passhash, needs_rehash
+from .user_cache import invalidate_cached_user
 
 from flask import current_app
 import sqlalchemy
+from sqlalchemy.dialects import postgresql, sqlite
 from argon2 import PasswordHasher, Type
-from werkzeug.security import generate_password_hash, check_password_hash
 
 import os
 import base64
+import hashlib
+import hmac
 
 
+# INSERT statements supporting ON CONFLICT DO NOTHING, by dialect name
+_INSERT_ON_CONFLICT = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+# Same parameters as the client apps, which hash the passwords before login
 passwordHasher = PasswordHasher(
-    time_cost=6, memory_cost=65536, parallelism=2, type=Type.ID
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST,
+    parallelism=ARGON2_PARALLELISM,
+    type=Type.ID,
 )
 
 
@@ -57,6 +73,32 @@ def hash_password(password: str, salt: str) -> str:
     return passwordHasher.hash(password, salt=salt)
 
 
+def decoy_salt(usermail: str) -> str:
+    """
+    Get the salt served for an email that is not registered.
+
+    It is derived from the email with an HMAC keyed by the ``SECRET_KEY`` of
+    the app: the same email always gets the same salt, with the format of the
+    real ones, so the response does not tell whether the email is registered.
+
+    Parameters
+    ----------
+    usermail : str
+        Email of the (unregistered) user.
+
+    Returns
+    -------
+    str
+        Salt, 16 bytes encoded in base64.
+    """
+    digest = hmac.new(
+        current_app.config["SECRET_KEY"].encode("utf-8"),
+        b"decoy-salt:" + usermail.lower().encode("utf-8"),
+        hashlib.sha256,
+    ).digest()
+    return base64.b64encode(digest[:16]).decode("utf-8")
+
+
 def valid_login(usermail: str, *, password=None, passHash=None) -> UserCredentials:
     """
     Attempt to use the provided login information to login.
@@ -80,6 +122,8 @@ def valid_login(usermail: str, *, password=None, passHash=None) -> UserCredentia
         If the user is not registered.
     ValueError
         If the password is invalid.
+    HashingBusyError
+        If the password hashing of the server is saturated.
     """
     usermail = usermail.lower()
 
@@ -89,18 +133,29 @@ def valid_login(usermail: str, *, password=None, passHash=None) -> UserCredentia
     if user is None:  # User not found
         raise TypeError("User is not registered")
 
-    # If only the password is provided, then we need to hash it before comparing
+    # If only the password is provided, then we need to hash it before comparing.
+    # Argon2 is CPU bound, so it is run out of the request thread.
     if passHash is None:
-        # Calculate the hash of the password with Argon2
         decoded_salt = base64.b64decode(user.salt)
-        passHash = hash_password(password, salt=decoded_salt)
+        passHash = get_hashing_executor().run(hash_password, password, decoded_salt)
 
     # Check if the passHashes coincide (db one is rehashed)
-    if check_password_hash(user.passhash, passHash):
-        return user
-    else:
+    if not check_stored_passhash(user.passhash, passHash):
         raise ValueError("Invalid password")
 
+    # Migrate the stored hash to the configured scheme, see stored_passhash.py
+    if needs_rehash(user.passhash):
+        new_passhash = make_stored_passhash(passHash)
+        with current_app.Session() as sql_db:
+            # unless another login already did it
+            sql_db.query(UserCredentials).filter_by(
+                id=user.id, passhash=user.passhash
+            ).update({"passhash": new_passhash})
+            sql_db.commit()
+        invalidate_cached_user(user)
+        user.passhash = new_passhash
+    return user
+
 
 def register_user(
     usermail: str,
@@ -132,16 +187,11 @@ def register_user(
         If the user already exists.
     AssertionError
         If both password and (passHash or salt) is provided.
+    HashingBusyError
+        If the password hashing of the server is saturated.
     """
     usermail = usermail.lower()
 
-    # Check if the user already exists
-    with current_app.Session() as sql_db:
-        user = sql_db.query(UserCredentials).filter_by(email=usermail).first()
-    if user is not None:
-        raise ValueError("User already exists")
-
-    # If the password is provided, create a salt and hash it
     if password:
         assert (
             passHash is None
@@ -149,14 +199,18 @@ def register_user(
         assert (
             salt is None
         ), "Do not provide 'salt'. It is created by the server if password is provided."
-        salt, passHash = salt_and_hash_password(password)
     elif not (passHash and salt):
         # password nor (passHash and salt) not provided
         raise RuntimeError("Either password or (passHash and salt) must be provided")
 
+    # If the password is provided, create a salt and hash it.
+    # Argon2 is CPU bound, so it is run out of the request thread.
+    if password:
+        salt, passHash = get_hashing_executor().run(salt_and_hash_password, password)
+
     # Create the user
     # rehash the hash, so locally we don't store the same hash as client apps
-    passHash = generate_password_hash(passHash)
+    passHash = make_stored_passhash(passHash)
     try:
         new_user = UserCredentials(
             username=username,
@@ -167,6 +221,30 @@ def register_user(
     except sqlalchemy.exc.DataError as e:
         raise RuntimeError("Invalid data provided") from e
 
+    # A single INSERT, the unique index on the email rejects existing users.
+    # Checking first would need another round trip, and race with other signups.
     with current_app.Session() as sql_db:
-        sql_db.add(new_user)
+        insert = _INSERT_ON_CONFLICT.get(sql_db.get_bind().dialect.name)
+        if insert is None:
+            sql_db.add(new_user)
+            try:
+                sql_db.commit()
+            except sqlalchemy.exc.IntegrityError as e:
+                raise ValueError("User already exists") from e
+            return
+
+        table = UserCredentials.__table__
+        user_id = sql_db.execute(
+            insert(table)
+            .values(
+                username=new_user.username,
+                email=new_user.email,
+                passhash=new_user.passhash,
+                salt=new_user.salt,
+            )
+            .on_conflict_do_nothing()
+            .returning(table.c.id)
+        ).scalar()
         sql_db.commit()
+    if user_id is None:
+        raise ValueError("User already exists")
@@ -0,0 +1,171 @@
+"""
+Database engine of the app, with its connection pool.
+
+Each server process (e.g. each gunicorn worker) has its own engine and pool, so
+the connections opened to the database can reach, per deployment::
+
+    server processes * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+
+plus the job worker processes. Size them against ``max_connections``. The pool
+of each process measures how long requests wait for a connection, see
+``pool_metrics``.
+"""
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
+
+import os
+import threading
+import time
+import weakref
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    ``QueuePool`` that measures the time spent waiting for a connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics_lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_errors = 0
+        self.checkout_wait_s = 0.0
+        self.checkout_wait_max_s = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:  # timed out, or could not connect
+            with self._metrics_lock:
+                self.checkout_errors += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._metrics_lock:
+                self.checkouts += 1
+                self.checkout_wait_s += waited
+                self.checkout_wait_max_s = max(self.checkout_wait_max_s, waited)
+
+
+def engine_options(config: dict) -> dict:
+    """
+    Get the keyword arguments of ``create_engine`` from the app configuration.
+
+    Options that do not apply to the database of ``SQLALCHEMY_DATABASE_URI``
+    are left out: SQLite keeps its own pool unless it is a file database,
+    and the statement timeout and ``executemany`` mode are PostgreSQL ones.
+
+    Parameters
+    ----------
+    config : dict
+        App configuration, with the ``DB_*`` settings of ``env_config.py``.
+
+    Returns
+    -------
+    dict
+        Keyword arguments for ``create_engine``.
+    """
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    options = {
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+    }
+    in_memory = url.get_backend_name() == "sqlite" and url.database in (
+        None,
+        "",
+        ":memory:",
+    )
+    if not in_memory:
+        options.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=config["DB_POOL_SIZE"],
+            max_overflow=config["DB_MAX_OVERFLOW"],
+            pool_timeout=config["DB_POOL_TIMEOUT"],
+        )
+    if url.get_backend_name() == "postgresql":
+        if config["DB_STATEMENT_TIMEOUT_MS"]:
+            timeout_ms = config["DB_STATEMENT_TIMEOUT_MS"]
+            options["connect_args"] = {"options": f"-c statement_timeout={timeout_ms}"}
+        # the default driver depends on the version of SQLAlchemy
+        driver = url.get_dialect().driver
+        if driver == "psycopg2" and config["DB_EXECUTEMANY_MODE"]:
+            options["executemany_mode"] = config["DB_EXECUTEMANY_MODE"]
+    return options
+
+
+def create_db_engine(config: dict) -> Engine:
+    """
+    Create the database engine of the app.
+
+    The engine is safe to create before forking server processes (e.g. with
+    gunicorn ``preload_app``): forked children drop the pooled connections
+    inherited from the parent, without closing them, and open their own.
+
+    Parameters
+    ----------
+    config : dict
+        App configuration, see ``engine_options``.
+
+    Returns
+    -------
+    Engine
+        The new engine.
+    """
+    engine = create_engine(
+        config["SQLALCHEMY_DATABASE_URI"], **engine_options(config)
+    )
+
+    # a weak reference, not to keep alive the engines of discarded apps
+    engine_ref = weakref.ref(engine)
+
+    def dispose_in_child():
+        if (forked_engine := engine_ref()) is not None:
+            forked_engine.dispose(close=False)
+
+    os.register_at_fork(after_in_child=dispose_in_child)
+    return engine
+
+
+def pool_metrics(engine: Engine) -> dict:
+    """
+    Get the state and checkout metrics of the connection pool of this process.
+
+    Parameters
+    ----------
+    engine : Engine
+        Engine of the app.
+
+    Returns
+    -------
+    dict
+        Metrics of the pool. The checkout ones are only measured by the
+        ``InstrumentedQueuePool``, used by all but in-memory databases.
+    """
+    pool = engine.pool
+    metrics = {
+        "pid": os.getpid(),
+        "pool_class": type(pool).__name__,
+        "status": pool.status(),
+    }
+    if isinstance(pool, QueuePool):
+        metrics.update(
+            pool_size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=pool.overflow(),
+        )
+    if isinstance(pool, InstrumentedQueuePool):
+        with pool._metrics_lock:
+            metrics.update(
+                checkouts=pool.checkouts,
+                checkout_errors=pool.checkout_errors,
+                checkout_wait_s_total=pool.checkout_wait_s,
+                checkout_wait_s_max=pool.checkout_wait_max_s,
+                checkout_wait_s_mean=(
+                    pool.checkout_wait_s / pool.checkouts if pool.checkouts else 0.0
+                ),
+            )
+    return metrics
@@ -0,0 +1,103 @@
+"""
+Lightweight schema migrations, run on startup after ``create_all``.
+
+``Base.metadata.create_all`` only creates missing tables. This module brings
+existing tables up to date with ``db_tables.py`` by adding what is missing:
+
+- nullable columns, with ``ALTER TABLE ... ADD COLUMN``;
+- indexes, including unique ones.
+
+Nothing is ever dropped or altered, so every step is safe to run again, and by
+several server processes at once. Changes that cannot be done this way (e.g.
+new non-nullable columns) need a manual migration.
+"""
+
+from flaskr.db_tables import Base
+
+import sqlalchemy
+from sqlalchemy.engine import Engine
+
+from logging import getLogger
+
+
+logger = getLogger(__name__)
+
+
+def _add_column(connection, table: sqlalchemy.Table, column: sqlalchemy.Column):
+    column_type = column.type.compile(dialect=connection.dialect)
+    preparer = connection.dialect.identifier_preparer
+    connection.execute(
+        sqlalchemy.text(
+            f"ALTER TABLE {preparer.format_table(table)} "
+            f"ADD COLUMN {preparer.format_column(column)} {column_type}"
+        )
+    )
+
+
+def upgrade_schema(engine: Engine) -> list[str]:
+    """
+    Add the columns and indexes of the models missing in the database.
+
+    Unique indexes that cannot be created because of duplicated rows are
+    skipped with an error in the log; they are created on a later startup,
+    once the duplicates are removed.
+
+    Parameters
+    ----------
+    engine : Engine
+        Engine of the database, whose tables already exist.
+
+    Returns
+    -------
+    list[str]
+        Description of each change applied.
+    """
+    changes = []
+    inspector = sqlalchemy.inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue  # created by create_all
+
+        existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            if not column.nullable:
+                logger.error(
+                    f"Cannot add non-nullable column {table.name}.{column.name}, "
+                    "migrate it manually"
+                )
+                continue
+            try:
+                with engine.begin() as connection:
+                    _add_column(connection, table, column)
+            except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.ProgrammingError):
+                # added meanwhile by another server process
+                columns = sqlalchemy.inspect(engine).get_columns(table.name)
+                if column.name in {c["name"] for c in columns}:
+                    continue
+                raise
+            changes.append(f"added column {table.name}.{column.name}")
+
+        existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if index.name in existing_indexes:
+                continue
+            try:
+                index.create(engine)
+            except sqlalchemy.exc.IntegrityError as e:
+                logger.error(f"Cannot create unique index {index.name}: {e.orig}")
+                continue
+            except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.ProgrammingError):
+                # created meanwhile by another server process
+                indexes = sqlalchemy.inspect(engine).get_indexes(table.name)
+                if index.name in {i["name"] for i in indexes}:
+                    continue
+                raise
+            changes.append(f"created index {index.name}")
+
+    for change in changes:
+        logger.warning(f"Database schema upgraded: {change}")
+    return changes
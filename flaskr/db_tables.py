@@ -1,4 +1,13 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+)
 from sqlalchemy.orm import DeclarativeBase
 
 import re
@@ -19,7 +28,7 @@ class UserCredentials(Base):
     ----------
     id: Integer, primary key
     username: String, max length 15, not nullable
-    email: String, max length 80, not nullable
+    email: String, max length 80, not nullable, unique index
     passhash: String, max length 180, not nullable
     salt: String, max length 50, not nullable
 
@@ -32,7 +41,7 @@ class UserCredentials(Base):
 
     id = Column(Integer, primary_key=True)
     username = Column(String(21), nullable=False)
-    email = Column(String(80), nullable=False)
+    email = Column(String(80), nullable=False, unique=True, index=True)
     passhash = Column(String(180), nullable=False)
     salt = Column(String(50), nullable=False)
 
@@ -47,6 +56,45 @@ class UserCredentials(Base):
         return f"<User {self.id} : {self.username} : {self.email}>"
 
 
+class SessionBlobs(Base):
+    """
+    SessionBlobs table model, the stored contents of the session files, shared
+    by the files with the same contents
+
+    Attributes
+    ----------
+    id: Integer, primary key
+    sha256: String, hex SHA-256 of the decompressed contents, unique
+    size_bytes: BigInteger, size of the decompressed contents, in bytes
+    encoding: String, max length 8, compression of the stored file, null if
+        stored uncompressed
+    refcount: Integer, number of SessionFiles pointing at the blob
+
+    See also
+    --------
+    SessionFiles
+       Table model for storing user files, referencing it by blob_id
+    flaskr.common_files.blob_store
+       Where and how the blobs are stored
+    """
+    __tablename__ = "SessionBlobs"
+
+    id = Column(Integer, primary_key=True)
+    sha256 = Column(String(64), nullable=False, unique=True)
+    size_bytes = Column(BigInteger, nullable=False)
+    encoding = Column(String(8), nullable=True)
+    refcount = Column(Integer, nullable=False)
+
+    def __init__(self, sha256, size_bytes, encoding=None):
+        self.sha256 = sha256
+        self.size_bytes = size_bytes
+        self.encoding = encoding
+        self.refcount = 1
+
+    def __repr__(self):
+        return f"<Blob {self.id} : {self.sha256} : {self.refcount}>"
+
+
 class SessionFiles(Base):
     """
     SessionFiles table model
@@ -56,26 +104,174 @@ class SessionFiles(Base):
     id: Integer, primary key
     user_id: Integer, foreign key to UserCredentials.id
     filename: String, max length 100, not nullable
+    blob_id: Integer, foreign key to SessionBlobs.id, indexed, the stored
+        contents of the file; null for files stored in the directory of their
+        user, before the blob store
+    size_bytes: BigInteger, size of the (decompressed) file, in bytes
+    sha256: String, hex SHA-256 of the (decompressed) file, indexed
+    uploaded_at: DateTime, UTC instant of the upload
+    version_scheme: Integer, version of the session file format, indexed
+    app_version: String, max length 32, version of the app that recorded it,
+        indexed
+    timezone: String, max length 64, timezone of the device, indexed
+    start_instant, finish_instant: DateTime, UTC instants the session started
+        and finished
+    device_model: String, max length 100, model of the device, indexed
+    n_beacons: Integer, number of beacons recorded, indexed
+
+    All but filename are nullable: they are read when the file is stored, from
+    the header line of the file. Files stored before these columns existed are
+    filled in with the backfill-session-metadata command.
+
+    The pair (user_id, filename) is unique, and its index also serves the
+    lookups by user_id alone. Listings of a user are sorted and filtered with
+    the (user_id, start_instant) and (user_id, uploaded_at) indexes. The header
+    fields are indexed on their own, to select the files of all users by app,
+    device or format, e.g. those to process again after a client fix.
 
     See also
     --------
     UserCredentials
        Table model for storing user credentials, referenced by user_id
+    SessionBlobs
+       Table model for the stored contents, referenced by blob_id
+    SessionSummaries
+       Table model for storing session statistics, referenced by file_id
     """
     __tablename__ = "SessionFiles"
+    __table_args__ = (
+        Index("ix_SessionFiles_user_id_filename", "user_id", "filename", unique=True),
+        Index("ix_SessionFiles_user_id_start_instant", "user_id", "start_instant"),
+        Index("ix_SessionFiles_user_id_uploaded_at", "user_id", "uploaded_at"),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("UserCredentials.id"))
     filename = Column(String(100), nullable=False)
+    blob_id = Column(Integer, ForeignKey("SessionBlobs.id"), nullable=True, index=True)
+    size_bytes = Column(BigInteger, nullable=True)
+    sha256 = Column(String(64), nullable=True, index=True)
+    uploaded_at = Column(DateTime, nullable=True)
+    version_scheme = Column(Integer, nullable=True, index=True)
+    app_version = Column(String(32), nullable=True, index=True)
+    timezone = Column(String(64), nullable=True, index=True)
+    start_instant = Column(DateTime, nullable=True)
+    finish_instant = Column(DateTime, nullable=True)
+    device_model = Column(String(100), nullable=True, index=True)
+    n_beacons = Column(Integer, nullable=True, index=True)
 
-    def __init__(self, user_id, filename):
-        self.user_id = user_id
-        self.filename = filename
+    def __init__(self, user_id, filename, **metadata):
+        super().__init__(user_id=user_id, filename=filename, **metadata)
 
     def __repr__(self):
         return f"<File {self.id} : {self.filename}>"
 
 
+class SessionSummaries(Base):
+    """
+    SessionSummaries table model, computed once when a session file is stored
+
+    Attributes
+    ----------
+    id: Integer, primary key
+    file_id: Integer, foreign key to SessionFiles.id, indexed
+    beacon_id: String, max length 32, null for the whole session
+    start: DateTime, UTC instant of the first sample
+    finish: DateTime, UTC instant of the last sample
+    duration_s: Float, seconds between the first and last samples
+    n_samples: Integer, number of samples
+    sampling_rate_hz: Float, mean samples per second; for the whole session,
+        the median of those of its beacons; nullable
+    min_latitude, max_latitude, min_longitude, max_longitude: Float, bounding
+        box of the samples with GPS fix, nullable
+    distance_m: Float, distance travelled along the route, in meters
+    data_min, data_mean, data_max: Float, statistics of the data, nullable
+    data_p05, data_p25, data_p50, data_p75, data_p95: Float, percentiles of
+        the data, nullable
+
+    See also
+    --------
+    SessionFiles
+       Table model for storing user files, referenced by file_id
+    """
+    __tablename__ = "SessionSummaries"
+
+    id = Column(Integer, primary_key=True)
+    file_id = Column(Integer, ForeignKey("SessionFiles.id"), nullable=False, index=True)
+    beacon_id = Column(String(32), nullable=True)
+    start = Column(DateTime, nullable=True)
+    finish = Column(DateTime, nullable=True)
+    duration_s = Column(Float, nullable=False)
+    n_samples = Column(Integer, nullable=False)
+    sampling_rate_hz = Column(Float, nullable=True)
+    min_latitude = Column(Float, nullable=True)
+    max_latitude = Column(Float, nullable=True)
+    min_longitude = Column(Float, nullable=True)
+    max_longitude = Column(Float, nullable=True)
+    distance_m = Column(Float, nullable=False)
+    data_min = Column(Float, nullable=True)
+    data_mean = Column(Float, nullable=True)
+    data_max = Column(Float, nullable=True)
+    data_p05 = Column(Float, nullable=True)
+    data_p25 = Column(Float, nullable=True)
+    data_p50 = Column(Float, nullable=True)
+    data_p75 = Column(Float, nullable=True)
+    data_p95 = Column(Float, nullable=True)
+
+    def __init__(self, file_id, beacon_id=None, **statistics):
+        super().__init__(file_id=file_id, beacon_id=beacon_id, **statistics)
+
+    def __repr__(self):
+        return f"<Summary {self.id} : {self.file_id} : {self.beacon_id}>"
+
+
+class ProcessingJobs(Base):
+    """
+    ProcessingJobs table model, the queue of background work on session files
+
+    Attributes
+    ----------
+    id: Integer, primary key
+    file_id: Integer, foreign key to SessionFiles.id, indexed
+    kind: String, max length 30, not nullable, see ``flaskr.jobs.JOB_HANDLERS``
+    status: String, max length 10, not nullable, indexed: "queued", "running",
+        "done" or "failed"
+    attempts: Integer, number of times the job was started
+    last_error: String, max length 500, error of the last failed attempt
+    created_at: DateTime, UTC instant the job was enqueued
+    updated_at: DateTime, UTC instant of the last change of status
+    run_after: DateTime, UTC instant from which the job can be started
+
+    See also
+    --------
+    SessionFiles
+       Table model for storing user files, referenced by file_id
+    """
+    __tablename__ = "ProcessingJobs"
+
+    id = Column(Integer, primary_key=True)
+    file_id = Column(Integer, ForeignKey("SessionFiles.id"), nullable=False, index=True)
+    kind = Column(String(30), nullable=False)
+    status = Column(String(10), nullable=False, index=True)
+    attempts = Column(Integer, nullable=False)
+    last_error = Column(String(500), nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    run_after = Column(DateTime, nullable=False)
+
+    def __init__(self, file_id, kind, now):
+        self.file_id = file_id
+        self.kind = kind
+        self.status = "queued"
+        self.attempts = 0
+        self.created_at = now
+        self.updated_at = now
+        self.run_after = now
+
+    def __repr__(self):
+        return f"<Job {self.id} : {self.kind} : {self.file_id} : {self.status}>"
+
+
 class UserClientInfo(Base):
     """
     UserClientInfo table model
@@ -28,6 +28,18 @@ if JWT_SECRET_KEY is None:
     )
     JWT_SECRET_KEY = "dev"
 
+# Secret key of the HMAC of the stored password hashes; changing it invalidates
+# them, see flaskr/common_user/stored_passhash.py. Required with the
+# hmac-sha256 scheme, except in development (SECRET_KEY "dev") and testing
+PASSHASH_PEPPER = os.environ.get("PASSHASH_PEPPER", default=None)
+if not PASSHASH_PEPPER:
+    warn(
+        "Configuration pending: No password hash pepper found.\n"
+        "Required by the hmac-sha256 password hashes, out of development.\n"
+        "    Set with PASSHASH_PEPPER=<key>"
+    )
+    PASSHASH_PEPPER = None
+
 if (
     (POSTGRES_DB := os.environ.get("POSTGRES_DB"))
     and (POSTGRES_USER := os.environ.get("POSTGRES_USER"))
@@ -65,3 +77,95 @@ if CLIENT_BUILD_NUMBER_DEPRECATED == "":
         "    Set with CLIENT_BUILD_NUMBER_DEPRECATED=<n>"
     )
     CLIENT_BUILD_NUMBER_DEPRECATED = "0"
+
+# Compression of the session files stored on disk: "gzip", "zstd" or "" (none)
+# Files already stored keep their compression, see the compress-sessions command
+SESSION_FILES_COMPRESSION = os.environ.get("SESSION_FILES_COMPRESSION", "")
+SESSION_FILES_COMPRESSION = SESSION_FILES_COMPRESSION.strip().lower()
+if SESSION_FILES_COMPRESSION in ("", "none"):
+    SESSION_FILES_COMPRESSION = None
+
+# URI prefix of the internal nginx locations that serve the session files, e.g.
+# "/_sessions"; downloads are then sent by nginx (X-Accel-Redirect). Empty to
+# send them from the server
+SESSION_FILES_ACCEL_REDIRECT = os.environ.get("SESSION_FILES_ACCEL_REDIRECT", "")
+
+# Storage of the session files: "local" (the instance folder) or "s3", an
+# S3-compatible object store shared by several server nodes, see
+# flaskr/common_files/storage.py
+SESSION_STORAGE = os.environ.get("SESSION_STORAGE", "local").strip().lower()
+# Bucket and prefix of the keys of the files, with SESSION_STORAGE=s3. The
+# credentials are read by boto3, e.g. from AWS_ACCESS_KEY_ID and
+# AWS_SECRET_ACCESS_KEY
+SESSION_STORAGE_S3_BUCKET = os.environ.get("SESSION_STORAGE_S3_BUCKET", "").strip()
+SESSION_STORAGE_S3_PREFIX = os.environ.get("SESSION_STORAGE_S3_PREFIX", "").strip()
+# URL of the object store, e.g. "http://minio:9000"; empty for AWS S3
+SESSION_STORAGE_S3_ENDPOINT_URL = os.environ.get(
+    "SESSION_STORAGE_S3_ENDPOINT_URL", ""
+).strip()
+SESSION_STORAGE_S3_REGION = os.environ.get("SESSION_STORAGE_S3_REGION", "").strip()
+# Seconds the download links to the object store are valid
+SESSION_STORAGE_URL_EXPIRES_S = int(
+    os.environ.get("SESSION_STORAGE_URL_EXPIRES_S", "300")
+)
+# MiB of local copies of the files and artifacts kept by each node with
+# SESSION_STORAGE=s3; the least recently used are removed beyond it
+SESSION_STORAGE_CACHE_MAX_MB = int(
+    os.environ.get("SESSION_STORAGE_CACHE_MAX_MB", "10240")
+)
+
+# Background processing of the uploaded session files, see flaskr/jobs.py
+# Worker threads started in each server process; 0 to only run the jobs with
+# the run-jobs command
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "1"))
+# Times a job is attempted before it is marked as failed
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+
+# Cache of the users of the authenticated requests, per server process
+# Seconds a user is kept, also the delay to see changes made by other processes;
+# 0 to disable the cache
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "60"))
+# Maximum number of users kept
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "1024"))
+
+# Connection pool of the database engine, per server process; see flaskr/db_engine.py
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+# Seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+# Seconds after which connections are replaced; -1 to keep them
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+# Test connections before using them, to survive database restarts
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").strip().lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# PostgreSQL only: milliseconds before a statement is cancelled; 0 for no limit
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", "0"))
+# PostgreSQL with psycopg2 only: executemany_mode of the dialect
+DB_EXECUTEMANY_MODE = os.environ.get("DB_EXECUTEMANY_MODE", "values_plus_batch")
+# Serve the pool metrics of each server process at /api/v1/metrics/db_pool
+DB_POOL_METRICS = os.environ.get("DB_POOL_METRICS", "").strip().lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# Argon2 ID parameters of the password hashes. They must be the ones of the
+# client apps: the server hashes the passwords of the web logins to compare them
+# with the hashes computed by the apps on signup
+ARGON2_TIME_COST = int(os.environ.get("ARGON2_TIME_COST", "6"))
+ARGON2_MEMORY_COST = int(os.environ.get("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.environ.get("ARGON2_PARALLELISM", "2"))
+
+# Scheme of the password hashes stored: "hmac-sha256" or "werkzeug" (slow, as
+# the first versions of the server); stored hashes migrate to it on login
+PASSHASH_SCHEME = os.environ.get("PASSHASH_SCHEME", "hmac-sha256").strip().lower()
+
+# Password hashing of logins and signups, per server process; see
+# flaskr/common_user/password_hashing.py
+# Worker processes; 0 to hash in the request threads
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", "2"))
+# Hashes admitted waiting for a worker; beyond them, requests get 503
+HASH_QUEUE_LIMIT = int(os.environ.get("HASH_QUEUE_LIMIT", "4"))
@@ -0,0 +1,367 @@
+"""
+Background jobs on the stored session files, queued in the database.
+
+Uploads only store the file and enqueue its jobs, so the request returns as soon
+as the file is safe on disk. The jobs are run by worker threads started in each
+server process (``JOB_WORKERS``) and/or by dedicated worker processes started
+with ``flask --app flaskr run-jobs``. No broker is needed: workers claim jobs
+from the ``ProcessingJobs`` table with a conditional update, so any number of
+them can share the queue.
+"""
+
+from flaskr.db_tables import ProcessingJobs, SessionFiles
+from flaskr.common_files import (
+    build_session_artifacts,
+    get_columns_key,
+    get_storage,
+    get_stored_location,
+    sweep_uploads,
+)
+
+from flask import Flask, current_app
+import sqlalchemy
+
+from datetime import datetime, timedelta, timezone
+import os
+import threading
+import time
+
+
+# seconds an idle worker waits before looking for new jobs
+POLL_INTERVAL_S = 5.0
+# delay before the first retry of a failed job, doubled on each attempt
+RETRY_BACKOFF_S = 10.0
+# seconds between the heartbeats of a running job, see _heartbeat
+HEARTBEAT_INTERVAL_S = 60.0
+# running jobs without a heartbeat for this time are assumed lost, and run again
+JOB_TIMEOUT = timedelta(minutes=5)
+# seconds between the removals of the expired resumable uploads and of the
+# least recently used local copies of the object store, per worker
+SWEEP_INTERVAL_S = 3600.0
+
+# set when a job is enqueued, to wake up the idle workers of this process
+_job_enqueued = threading.Event()
+_start_lock = threading.Lock()
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _run_session_artifacts(session_file: SessionFiles) -> None:
+    """
+    Build the columns, trace pyramid and summaries of a session file, and
+    store the artifacts for the other nodes, see ``get_artifacts_filepath``.
+    """
+    location = get_stored_location(session_file)
+    if location is None:
+        raise ValueError("Session file not found")
+    storage, key = location
+    columns_key = get_columns_key(key)
+    # e.g. built on another node for a previous upload of the same contents
+    storage.fetch_dir(columns_key)
+    filepath = storage.local_path(key)
+    if filepath is None:
+        raise ValueError("Session file not found")
+    build_session_artifacts(filepath, session_file)
+    storage.store_dir(columns_key)
+
+
+# kind of job -> function run with the SessionFiles entry of the job
+# Handlers raise ValueError for errors that a retry would not fix.
+JOB_HANDLERS = {
+    "session_artifacts": _run_session_artifacts,
+}
+
+
+def notify_jobs_enqueued() -> None:
+    """
+    Wake up the workers of this process after jobs were enqueued, e.g. with
+    ``add_session_file(..., job_kinds=JOB_HANDLERS)``, starting them if needed,
+    e.g. in a server process forked after ``create_app``.
+    """
+    start_job_workers(current_app._get_current_object())
+    _job_enqueued.set()
+
+
+def enqueue_session_jobs(session_file: SessionFiles) -> None:
+    """
+    Enqueue the jobs of a stored session file again, e.g. to build its
+    artifacts when missing or outdated, and wake up the workers.
+
+    Parameters
+    ----------
+    session_file : SessionFiles
+        Database entry of the file.
+    """
+    with current_app.Session() as sql_db:
+        sql_db.add_all(
+            ProcessingJobs(session_file.id, kind, _utcnow()) for kind in JOB_HANDLERS
+        )
+        sql_db.commit()
+    notify_jobs_enqueued()
+
+
+def claim_next_job() -> ProcessingJobs | None:
+    """
+    Claim the oldest job ready to run, marking it as running.
+
+    Queued jobs past their ``run_after`` instant are ready, and so are running
+    jobs older than ``JOB_TIMEOUT``, whose worker is assumed dead. Several
+    workers may race for the same job: only the one whose update matches wins.
+
+    Returns
+    -------
+    ProcessingJobs | None
+        The claimed job, ``None`` if no job is ready.
+    """
+    now = _utcnow()
+    ready = sqlalchemy.or_(
+        (ProcessingJobs.status == "queued") & (ProcessingJobs.run_after <= now),
+        (ProcessingJobs.status == "running")
+        & (ProcessingJobs.updated_at < now - JOB_TIMEOUT),
+    )
+    with current_app.Session(expire_on_commit=False) as sql_db:
+        while True:
+            job = (
+                sql_db.query(ProcessingJobs)
+                .filter(ready)
+                .order_by(ProcessingJobs.id)
+                .first()
+            )
+            if job is None:
+                return None
+            claimed = (
+                sql_db.query(ProcessingJobs)
+                .filter(ProcessingJobs.id == job.id, ready)
+                .update(
+                    {
+                        "status": "running",
+                        "attempts": ProcessingJobs.attempts + 1,
+                        "updated_at": now,
+                    },
+                    synchronize_session=False,
+                )
+            )
+            sql_db.commit()
+            if claimed:
+                sql_db.refresh(job)
+                return job
+            # another worker claimed it first, look for the next one
+
+
+def _heartbeat(app: Flask, job: ProcessingJobs, stop: threading.Event) -> None:
+    """
+    Refresh the ``updated_at`` of a running job every ``HEARTBEAT_INTERVAL_S``
+    until ``stop`` is set, so that it is not reclaimed while it runs, however
+    long it takes.
+    """
+    with app.app_context():
+        while not stop.wait(HEARTBEAT_INTERVAL_S):
+            try:
+                with app.Session() as sql_db:
+                    alive = (
+                        sql_db.query(ProcessingJobs)
+                        .filter_by(id=job.id, status="running", attempts=job.attempts)
+                        .update({"updated_at": _utcnow()}, synchronize_session=False)
+                    )
+                    sql_db.commit()
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                app.logger.error(f"Heartbeat of job {job.id} failed: {e!r}")
+                continue
+            if not alive:
+                return  # finished, or reclaimed after all
+
+
+def _finish_job(job: ProcessingJobs, error: Exception | None) -> None:
+    """
+    Record the outcome of a job, scheduling a retry for unexpected errors.
+    """
+    now = _utcnow()
+    if error is None:
+        job.status = "done"
+        job.last_error = None
+    else:
+        job.last_error = f"{type(error).__name__}: {error}"[:500]
+        retry = not isinstance(error, ValueError) and (
+            job.attempts < current_app.config["JOB_MAX_ATTEMPTS"]
+        )
+        job.status = "queued" if retry else "failed"
+        job.run_after = now + timedelta(
+            seconds=RETRY_BACKOFF_S * 2 ** (job.attempts - 1)
+        )
+    job.updated_at = now
+    with current_app.Session() as sql_db:
+        sql_db.merge(job)
+        sql_db.commit()
+
+
+def run_job(job: ProcessingJobs) -> None:
+    """
+    Run a claimed job and record its outcome.
+
+    Parameters
+    ----------
+    job : ProcessingJobs
+        Job returned by ``claim_next_job``.
+    """
+    error = None
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(
+        target=_heartbeat,
+        args=(current_app._get_current_object(), job, stop_heartbeat),
+        name=f"job-heartbeat-{job.id}",
+        daemon=True,
+    )
+    heartbeat.start()
+    try:
+        if job.attempts > current_app.config["JOB_MAX_ATTEMPTS"]:
+            # its worker was lost on every attempt, e.g. killed for memory
+            raise ValueError("Too many attempts")
+        with current_app.Session() as sql_db:
+            session_file = sql_db.get(SessionFiles, job.file_id)
+        if session_file is None:
+            raise ValueError("Session file entry not found")
+        JOB_HANDLERS[job.kind](session_file)
+    except Exception as e:
+        current_app.logger.warning(f"Job {job.id} ({job.kind}) failed: {e!r}")
+        error = e
+    finally:
+        stop_heartbeat.set()
+        heartbeat.join()
+    _finish_job(job, error)
+
+
+def run_pending_jobs() -> int:
+    """
+    Run the jobs ready to run, until there are none left.
+
+    Returns
+    -------
+    int
+        Number of jobs run.
+    """
+    n_jobs = 0
+    while job := claim_next_job():
+        run_job(job)
+        n_jobs += 1
+    return n_jobs
+
+
+def get_jobs_for_file(session_file: SessionFiles) -> list[ProcessingJobs]:
+    """
+    Get the jobs of a session file.
+
+    Parameters
+    ----------
+    session_file : SessionFiles
+        Database entry of the file.
+
+    Returns
+    -------
+    list[ProcessingJobs]
+        Jobs of the file, oldest first.
+    """
+    with current_app.Session() as sql_db:
+        return (
+            sql_db.query(ProcessingJobs)
+            .filter_by(file_id=session_file.id)
+            .order_by(ProcessingJobs.id)
+            .all()
+        )
+
+
+def overall_status(jobs: list[ProcessingJobs]) -> str:
+    """
+    Summarize the status of the jobs of a file in a single one.
+
+    Returns
+    -------
+    str
+        "failed" if any job failed, else "running" or "queued" if any job is
+        pending, else "done". Also "done" if the file has no jobs.
+    """
+    statuses = {job.status for job in jobs}
+    for status in ("failed", "running", "queued"):
+        if status in statuses:
+            return status
+    return "done"
+
+
+def job_worker_loop(app: Flask, stop: threading.Event | None = None) -> None:
+    """
+    Run jobs as they are enqueued, until ``stop`` is set. Expired resumable
+    uploads and the local copies of the object store beyond
+    ``SESSION_STORAGE_CACHE_MAX_MB`` are also removed, every
+    ``SWEEP_INTERVAL_S``.
+
+    Parameters
+    ----------
+    app : Flask
+        Application whose database and instance folder to use.
+    stop : threading.Event, optional
+        Event to stop the loop. Runs forever by default.
+    """
+    stop = stop or threading.Event()
+    next_sweep = time.monotonic()
+    with app.app_context():
+        while not stop.is_set():
+            if time.monotonic() >= next_sweep:
+                try:
+                    if n_removed := sweep_uploads():
+                        app.logger.info(f"Removed {n_removed} expired uploads")
+                except OSError as e:
+                    app.logger.error(f"Cannot remove the expired uploads: {e!r}")
+                try:
+                    max_bytes = app.config["SESSION_STORAGE_CACHE_MAX_MB"] * 2**20
+                    if n_removed := get_storage().prune_cache(max_bytes):
+                        app.logger.info(f"Removed {n_removed} cached objects")
+                except OSError as e:
+                    app.logger.error(f"Cannot prune the storage cache: {e!r}")
+                next_sweep = time.monotonic() + SWEEP_INTERVAL_S
+            try:
+                ran = run_pending_jobs()
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                app.logger.error(f"Job worker cannot reach the database: {e!r}")
+                ran = 0
+            if not ran:
+                _job_enqueued.wait(POLL_INTERVAL_S)
+                _job_enqueued.clear()
+
+
+def start_job_workers(app: Flask) -> list[threading.Thread]:
+    """
+    Start the ``JOB_WORKERS`` worker threads of this process, once.
+
+    Workers are started by ``create_app``, and again after a fork when jobs
+    are enqueued, so that forked server processes run their own ones. None are
+    started with ``JOB_WORKERS = 0``: the jobs are then only run by
+    ``flask --app flaskr run-jobs``.
+
+    Parameters
+    ----------
+    app : Flask
+        Application the workers run for.
+
+    Returns
+    -------
+    list[threading.Thread]
+        The worker threads of this process.
+    """
+    with _start_lock:
+        pid, threads = app.extensions.get("job_workers", (None, []))
+        if pid == os.getpid():
+            return threads
+        threads = [
+            threading.Thread(
+                target=job_worker_loop,
+                args=(app,),
+                name=f"job-worker-{i}",
+                daemon=True,
+            )
+            for i in range(app.config["JOB_WORKERS"])
+        ]
+        app.extensions["job_workers"] = (os.getpid(), threads)
+        for thread in threads:
+            thread.start()
+    return threads
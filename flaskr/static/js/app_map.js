@@ -6,10 +6,9 @@ const tiles = new TileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png'
     attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
 }).addTo(map);
 
-// Optimization variables
-const CHUNK_SIZE = 1000; // CSV rows to process at a time
-const MAX_POINTS_PER_BEACON = 3000; // Limit points to prevent memory issues
-let worker;
+// Session shown, and pending request of the visible area
+let currentFilename = null;
+let viewportRequest = null;
 
 // Color palette for different beacons
 const beaconColors = [
@@ -65,26 +64,66 @@ function getUrlParameter(name) {
     return decodeURIComponent(results[2].replace(/\+/g, ' '));
 }
 
-// Initialize Web Worker
-function initWorker() {
-    if (worker) {
-        worker.terminate();
+// Format a UTC instant (ms) as the local time of the session
+function formatLocalTime(time, timezone) {
+    try {
+        return new Date(time).toLocaleTimeString('es-ES', { timeZone: timezone || undefined });
+    } catch (e) {  // unknown time zone
+        return new Date(time).toISOString();
     }
-    worker = new Worker('/static/js/app_map_worker.js');
-
-    worker.onmessage = function (e) {
-        switch (e.data.type) {
-            case 'chunk':
-                processDataChunk(e.data.data);
-                break;
-            case 'complete':
-                finalizeProcessing();
-                break;
-            case 'error':
-                console.error('Worker error:', e.data.error);
-                break;
+}
+
+// Convert a GeoJSON trace from the server into points and lines per beacon
+function applyTrace(trace) {
+    const timezone = trace.properties.timezone;
+
+    trace.features.forEach(feature => {
+        const props = feature.properties;
+        const beaconId = props.beacon_id;
+        const points = [];
+        const lines = [];
+        feature.geometry.coordinates.forEach((line, j) => {
+            lines.push(line.map(([longitude, latitude]) => [latitude, longitude]));
+            line.forEach(([longitude, latitude], i) => {
+                points.push({
+                    beacon_id: beaconId,
+                    localized_timestamp: formatLocalTime(props.time[j][i], timezone),
+                    data: props.data[j][i] ?? NaN,
+                    data_min: props.data_min[j][i] ?? NaN,
+                    data_max: props.data_max[j][i] ?? NaN,
+                    latitude: latitude,
+                    longitude: longitude,
+                    azimuth: props.azimuth[j][i] ?? NaN,
+                });
+            });
+        });
+        points.lines = lines;
+        points.totalPoints = props.n_points_total;
+        beaconData[beaconId] = points;
+        if (!beaconLayers[beaconId]) {
+            beaconLayers[beaconId] = new LayerGroup().addTo(map);
         }
-    };
+    });
+}
+
+// Fetch the traces at the level of detail of the zoom, optionally only in a viewport
+async function fetchTrace(filename, zoom, bounds, signal) {
+    let url = `/profile/session_trace/viewport?filename=${encodeURIComponent(filename)}&zoom=${zoom}`;
+    if (bounds) {
+        url += `&bbox=${bounds.getWest()},${bounds.getSouth()},${bounds.getEast()},${bounds.getNorth()}`;
+    }
+    let response = await fetch(url, { signal });
+    // The session is still being processed: ask again after the delay given
+    while (response.status === 503) {
+        const delay = Number(response.headers.get('Retry-After')) || 2;
+        await new Promise(resolve => setTimeout(resolve, delay * 1000));
+        signal?.throwIfAborted();
+        response = await fetch(url, { signal });
+    }
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    return response.json();
 }
 
 // Function to load and process data
@@ -97,44 +136,47 @@ async function loadData(filename) {
 
     // Clear previous data
     clearMapData();
-    initWorker();
+    currentFilename = filename;
 
     try {
-        // Fetch the data from your API endpoint
-        const response = await fetch(`/profile/download_session?filename=${encodeURIComponent(filename)}`);
-
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
+        // Overview of the whole session, to know its beacons and bounds
+        const trace = await fetchTrace(filename, map.getZoom());
+        applyTrace(trace);
+        finalizeProcessing();
+
+        // From now on, only what is visible in the viewport is requested
+        const bounds = trace.properties.bounds;
+        map.on('moveend', loadViewport);
+        if (bounds) {
+            map.fitBounds([[bounds[1], bounds[0]], [bounds[3], bounds[2]]]);
         }
-
-        const text = await response.text();
-
-        // Split the text into lines and remove the first 2 lines (JSON header)
-        const lines = text.split('\n').slice(2).join('\n');
-
-        // Send to worker for processing
-        worker.postMessage({
-            lines: lines,
-            chunkSize: CHUNK_SIZE
-        });
     } catch (error) {
         console.error('Error loading data:', error);
+        document.getElementById('status').textContent = 'Error al cargar los datos.';
     }
 }
 
-// Process data chunks from worker
-function processDataChunk(chunk) {
-    chunk.forEach(row => {
-        if (!beaconData[row.beacon_id]) {
-            beaconData[row.beacon_id] = [];
-            beaconLayers[row.beacon_id] = new LayerGroup().addTo(map);
-        }
+// Reload the traces of the visible area, at the current zoom
+async function loadViewport() {
+    if (viewportRequest) {
+        viewportRequest.abort();
+    }
+    viewportRequest = new AbortController();
 
-        beaconData[row.beacon_id].push(row);
-    });
+    try {
+        const trace = await fetchTrace(
+            currentFilename, map.getZoom(), map.getBounds().pad(0.25), viewportRequest.signal
+        );
+        applyTrace(trace);
+        plotBeaconData();
+    } catch (error) {
+        if (error.name !== 'AbortError') {
+            console.error('Error loading viewport:', error);
+        }
+    }
 }
 
-// Finalize processing after all chunks are done
+// Plot the loaded data and create the controls
 function finalizeProcessing() {
     // Clear any existing filter control
     if (map.beaconFilterControl) {
@@ -263,67 +305,47 @@ function finalizeProcessing() {
     map.beaconFilterControl = new BeaconFilterControl();
     map.addControl(map.beaconFilterControl);
 
-    // Plot the data for each beacon
+    plotBeaconData();
+}
+
+// Plot the current points of each beacon
+function plotBeaconData() {
     Object.keys(beaconData).forEach((beaconId, index) => {
         const color = beaconColors[index % beaconColors.length];
         const layerGroup = beaconLayers[beaconId];
+        layerGroup.clearLayers();
 
-        // Filter valid points
-        const validPoints = beaconData[beaconId].filter(
-            point => !isNaN(point.latitude) && !isNaN(point.longitude)
-        );
+        // Lines, already simplified by the server for the current zoom
+        beaconData[beaconId].lines.forEach(line => {
+            new Polyline(line, { color }).addTo(layerGroup);
+        });
 
-        if (validPoints.length > 0) {
-            // Create simplified polyline (only latitude and longitude)
-            // For the path
-            const simplifiedPoints = [];
-            for (let i = 0;
-                i < validPoints.length;
-                i += Math.max(1, Math.floor(validPoints.length / MAX_POINTS_PER_BEACON))
-            ) {
-                simplifiedPoints.push([validPoints[i].latitude, validPoints[i].longitude]);
-            }
-            const path = new Polyline(simplifiedPoints, { color }).addTo(layerGroup);
-
-            // For the markers - at this point to plot over path
-            for (let i = 0;
-                i < validPoints.length;
-                i += Math.max(1, Math.floor(validPoints.length / MAX_POINTS_PER_BEACON))
-            ) {
-                const intensityColor = getIntensityColor(color, validPoints[i].data);
-                const marker = new CircleMarker([validPoints[i].latitude, validPoints[i].longitude], {
-                    radius: 5,
-                    fillColor: intensityColor,
-                    color: '#000',
-                    weight: 1,
-                    opacity: 1,
-                    fillOpacity: 0.8
-                }).bindPopup(createPopupContent(validPoints[i]));
-                layerGroup.addLayer(marker);
-            }
-            
-            // Fit map to show all points from first beacon
-            if (index === 0) {
-                map.fitBounds(path.getBounds());
-            }
-        }
+        // For the markers - at this point to plot over path
+        beaconData[beaconId].forEach(point => {
+            const intensityColor = getIntensityColor(color, point.data);
+            const marker = new CircleMarker([point.latitude, point.longitude], {
+                radius: 5,
+                fillColor: intensityColor,
+                color: '#000',
+                weight: 1,
+                opacity: 1,
+                fillOpacity: 0.8
+            }).bindPopup(createPopupContent(point));
+            layerGroup.addLayer(marker);
+        });
     });
 
-    // Show status message
-    // If any beacon series has more than MAX_POINTS_PER_BEACON, show a warning
-    const hasLargeBeacon = Object.values(beaconData).some(data => data.length > MAX_POINTS_PER_BEACON);
-    if (hasLargeBeacon) {
-        document.getElementById('status').textContent = 'Datos cargados. Se ha limitado a ' + MAX_POINTS_PER_BEACON + ' puntos por beacon.';
-    } else {
-        document.getElementById('status').textContent = 'Información cargada correctamente.';
-    }
+    const nPoints = Object.values(beaconData).reduce((n, points) => n + points.length, 0);
+    const nTotal = Object.values(beaconData).reduce((n, points) => n + points.totalPoints, 0);
+    document.getElementById('status').textContent =
+        `Información cargada correctamente: ${nPoints} de ${nTotal} puntos visibles a este nivel de zoom.`;
 }
 
 function createPopupContent(point) {
     return `
         <b>Beacon ID:</b> ${point.beacon_id}<br>
         <b>Time:</b> ${point.localized_timestamp}<br>
-        <b>Value:</b> ${point.data}<br>
+        <b>Value:</b> ${point.data} (${point.data_min} – ${point.data_max})<br>
         <b>Latitude:</b> ${point.latitude.toFixed(6)}<br>
         <b>Longitude:</b> ${point.longitude.toFixed(6)}<br>
         <b>Azimuth:</b> ${point.azimuth.toFixed(2)}°
@@ -338,6 +360,7 @@ function clearMapData() {
     beaconData = {};
     beaconLayers = {};
     beaconFilters = {};
+    map.off('moveend', loadViewport);
 
     // Remove filter control if it exists
     if (map.beaconFilterControl) {
@@ -357,34 +380,9 @@ function updateBeaconVisibility() {
     });
 }
 
-// Update data points color intensity based on 
+// Update data points color intensity based on the sliders
 function refreshMarkerColors() {
-    Object.keys(beaconData).forEach((beaconId, index) => {
-        const color = beaconColors[index % beaconColors.length];
-        const validPoints = beaconData[beaconId].filter(
-            point => !isNaN(point.latitude) && !isNaN(point.longitude)
-        );
-
-        // Clear only CircleMarkers from layerGroup
-        beaconLayers[beaconId].eachLayer(layer => {
-            if (layer instanceof CircleMarker) {
-                beaconLayers[beaconId].removeLayer(layer);
-            }
-        });
-
-        validPoints.forEach(point => {
-            const intensityColor = getIntensityColor(color, point.data);
-            const marker = new CircleMarker([point.latitude, point.longitude], {
-                radius: 5,
-                fillColor: intensityColor,
-                color: '#000',
-                weight: 1,
-                opacity: 1,
-                fillOpacity: 0.8
-            }).bindPopup(createPopupContent(point));
-            beaconLayers[beaconId].addLayer(marker);
-        });
-    });
+    plotBeaconData();
 }
 
 
@@ -398,9 +396,3 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 });
 
-// Clean up worker when page unloads
-window.addEventListener('beforeunload', () => {
-    if (worker) {
-        worker.terminate();
-    }
-});
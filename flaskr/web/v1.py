@@ -1,14 +1,27 @@
 from flaskr.web import web_bp
 from flaskr.common_user import (
     CredentialsValidator,
-    get_user_by_email,
     valid_login,
     register_user,
+    HashingBusyError,
+    RETRY_AFTER_S,
 )
 from flaskr.common_files import (
     get_files_for_user,
+    get_files_with_summary_for_user,
     get_file_for_user_by_name,
-    get_sessions_dir_for_user,
+    get_artifacts_filepath,
+    get_stored_location,
+    get_files_for_user_in_period,
+    iter_sessions_zip,
+    session_accel_path,
+    query_viewport,
+)
+from flaskr.jobs import enqueue_session_jobs, get_jobs_for_file, overall_status
+from flaskr.common_files.compression import (
+    get_file_encoding,
+    iter_decompressed,
+    stored_name,
 )
 
 from flask import (
@@ -24,13 +37,22 @@ from flask import (
 from flask_jwt_extended import (
     create_access_token,
     jwt_required,
+    get_current_user,
     get_jwt_identity,
     set_access_cookies,
     unset_jwt_cookies,
 )
 # import folium
 
+from datetime import date, datetime, timedelta, timezone
 from logging import warning
+from pathlib import Path
+
+
+# shown when the password hashing of the server is saturated
+SERVER_BUSY_MESSAGE = "Servidor ocupado, inténtalo de nuevo en unos segundos"
+# seconds before asking again for the trace of a session being processed
+PROCESSING_RETRY_AFTER_S = 2
 
 
 @web_bp.route("/", methods=["GET"])
@@ -74,6 +96,12 @@ def login():
             return render_template("login.html", error_message="Contraseña incorrecta")
         except TypeError:
             return render_template("login.html", error_message="Usuario no registrado")
+        except HashingBusyError:
+            return (
+                render_template("login.html", error_message=SERVER_BUSY_MESSAGE),
+                503,
+                {"Retry-After": RETRY_AFTER_S},
+            )
 
         # If the password is correct, log the user in
         access_token = create_access_token(identity=user.email)
@@ -136,6 +164,12 @@ def signup():
             register_user(usermail=email, username=username, password=password)
         except ValueError:
             return render_template("signup.html", error_message="Email ya registrado")
+        except HashingBusyError:
+            return (
+                render_template("signup.html", error_message=SERVER_BUSY_MESSAGE),
+                503,
+                {"Retry-After": RETRY_AFTER_S},
+            )
 
         # Log the user in with JWT token
         access_token = create_access_token(identity=email)
@@ -150,17 +184,14 @@ def profile():
     """
     Profile page of the user
     """
-    current_user = get_jwt_identity()
+    user = get_current_user()
 
     # Redirect to login if the user is not logged in
-    if not current_user:
+    if not user:
         return redirect("/login")
+    # files and their summary statistics, in a single query
+    user_files = get_files_with_summary_for_user(user)
 
-    # Get the user
-    user = get_user_by_email(current_user)
-    user_files = get_files_for_user(user)
-
-    # TODO: add files to the template
     return render_template(
         "profile.html", user=user, user_files=user_files, n_files=len(user_files)
     )
@@ -180,8 +211,7 @@ def download_session():
         return redirect("/profile")
 
     # Get the user
-    current_user = get_jwt_identity()
-    user = get_user_by_email(current_user)
+    user = get_current_user()
 
     # Get the filename from the database
     file = get_file_for_user_by_name(user, requested_filename)
@@ -191,11 +221,129 @@ def download_session():
         )
         return redirect("/profile")
 
-    # Get the filepath
-    filepath = get_sessions_dir_for_user(user) / file.filename
+    # Get where it is stored
+    location = get_stored_location(file)
+    if location is None:
+        warning(f"Session file {file.filename} of user {user.email} is missing.")
+        return redirect("/profile")
+    storage, key = location
+    encoding = get_file_encoding(Path(key))
+
+    if encoding is not None and not request.accept_encodings[encoding]:
+        # the client can not decompress it, stream it decompressed; this
+        # representation has no ETag nor ranges
+        filepath = storage.local_path(key)
+        if filepath is None:
+            return redirect("/profile")
+        response = Response(iter_decompressed(filepath), mimetype="text/plain")
+        response.headers.set(
+            "Content-Disposition", "attachment", filename=file.filename
+        )
+        response.vary.add("Accept-Encoding")
+        return response
 
-    # Download the file
-    return send_file(filepath, mimetype="text/plain", as_attachment=True)
+    # serve the stored bytes as they are, the client decompresses them
+    if url := storage.download_url(key, file.filename, encoding):
+        # the object store sends the file, and answers conditional and range
+        # requests
+        response = redirect(url)
+    elif accel_prefix := current_app.config["SESSION_FILES_ACCEL_REDIRECT"]:
+        # nginx sends the file, see server_configuration/surCO_app
+        response = Response(mimetype="text/plain")
+        response.headers["X-Accel-Redirect"] = session_accel_path(
+            accel_prefix, storage.cache_path(key), encoding
+        )
+        response.headers.set(
+            "Content-Disposition", "attachment", filename=file.filename
+        )
+    else:
+        # with its ETag and Last-Modified, answering conditional and range
+        # requests (304, 206)
+        response = send_file(
+            storage.cache_path(key),
+            mimetype="text/plain",
+            as_attachment=True,
+            download_name=file.filename,
+            conditional=True,
+        )
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+    if encoding is not None:
+        response.vary.add("Accept-Encoding")
+    # the sessions of a user are not for shared caches; always revalidated
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.cache_control.public = False
+    return response
+
+
+def parse_period_bound(value: str | None, end: bool = False) -> datetime | None:
+    """
+    Parse a bound of a period, an ISO 8601 date or date and time, into a naive
+    UTC datetime as stored in the database. Times without offset are UTC.
+
+    A date as the ``end`` bound includes the whole day: it is the start of the
+    next one. ``None`` or an empty value is no bound.
+
+    Raises
+    ------
+    ValueError
+        If the value is not a date nor a date and time.
+    """
+    if not value:
+        return None
+    try:
+        return datetime.combine(date.fromisoformat(value), datetime.min.time()) + (
+            timedelta(days=1) if end else timedelta()
+        )
+    except ValueError:
+        pass  # not a bare date
+    instant = datetime.fromisoformat(value)
+    if instant.tzinfo is not None:
+        instant = instant.astimezone(timezone.utc).replace(tzinfo=None)
+    return instant
+
+
+@web_bp.route("/profile/download_sessions", methods=["GET"])
+@jwt_required(optional=False)
+def download_sessions():
+    """
+    Download the session files of the user in a zip archive, optionally only
+    those of the sessions between two dates (UTC, both included) or instants,
+    e.g.:
+
+    /profile/download_sessions?from=2025-06-01&to=2025-06-30
+    /profile/download_sessions?from=2025-06-01T08:00:00%2B02:00
+
+    The archive is streamed while it is built; compressed files are stored in
+    it as they are (e.g. ``session.txt.gz``).
+    """
+    try:
+        since = parse_period_bound(request.args.get("from"))
+        until = parse_period_bound(request.args.get("to"), end=True)
+    except ValueError:
+        return jsonify(
+            {"message": "from and to must be ISO 8601 dates or date and times"}
+        ), 400
+
+    # Get the user
+    user = get_current_user()
+
+    entries = []
+    for file in get_files_for_user_in_period(user, since, until):
+        location = get_stored_location(file)
+        if location is None:
+            warning(f"Session file {file.filename} of user {user.email} is missing.")
+            continue
+        storage, key = location
+        name = stored_name(file.filename, get_file_encoding(Path(key)))
+        entries.append((name, storage, key))
+
+    response = Response(iter_sessions_zip(entries), mimetype="application/zip")
+    response.headers.set(
+        "Content-Disposition", "attachment", filename=f"sessions_{user.username}.zip"
+    )
+    return response
 
 
 @web_bp.route("/profile/session_map", methods=["GET"])
@@ -205,19 +353,71 @@ def session_map():
     Session map page of the user
     """
     # Check if the user is logged in
-    if not get_jwt_identity():
+    user = get_current_user()
+    if not user:
         return redirect("/login")
 
-    # Get the user
-    current_user = get_jwt_identity()
-    user = get_user_by_email(current_user)
-
     # Get the sessions for the user
     user_files = get_files_for_user(user)
 
     # Render the map page with the user's files
     return render_template("session_map.html", user_files=user_files)
 
+
+@web_bp.route("/profile/session_trace/viewport", methods=["GET"])
+@jwt_required(optional=False)
+def session_trace_viewport():
+    """
+    Traces of the beacons of a session visible in the map viewport, at the
+    level of detail of the zoom, e.g.:
+
+    /profile/session_trace/viewport?filename=...&zoom=14&bbox=W,S,E,N
+
+    Without bbox, the whole session is returned at that zoom. Sessions whose
+    processing job has not built the trace yet get 503, with Retry-After.
+    """
+    requested_filename = request.args.get("filename")
+    zoom = request.args.get("zoom", type=int)
+    bbox = request.args.get("bbox")
+    if not requested_filename or zoom is None:
+        return jsonify({"message": "filename and zoom are required"}), 400
+    if bbox is not None:
+        try:
+            bbox = tuple(float(value) for value in bbox.split(","))
+        except ValueError:
+            bbox = ()
+        if len(bbox) != 4:
+            return jsonify({"message": "bbox must be W,S,E,N"}), 400
+
+    # Get the user
+    user = get_current_user()
+
+    file = get_file_for_user_by_name(user, requested_filename)
+    filepath = get_artifacts_filepath(file) if file else None
+    if not filepath:
+        return jsonify({"message": "Session not found"}), 404
+
+    try:
+        trace = query_viewport(filepath, zoom, bbox)
+    except FileNotFoundError:
+        # built by the processing job of the file, never within a request
+        status = overall_status(get_jobs_for_file(file))
+        if status == "failed":
+            return jsonify({"message": "Session file could not be parsed"}), 422
+        if status == "done":
+            # stored before its jobs existed, or its artifacts are outdated
+            enqueue_session_jobs(file)
+        return (
+            jsonify({"message": "Session being processed"}),
+            503,
+            {"Retry-After": PROCESSING_RETRY_AFTER_S},
+        )
+
+    response = jsonify(trace)
+    response.mimetype = "application/geo+json"
+    return response
+
+
 '''  # TODO: use folium to show a map of the user's routes
 @web_bp.route("/profile/map", methods=["GET"])
 def map():
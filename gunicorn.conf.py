@@ -0,0 +1,29 @@
+"""
+Configuration of gunicorn, loaded from the working directory on startup.
+
+Each worker process serves requests with a pool of threads (``gthread``
+workers), so slow clients (e.g. mobile uploads over a poor connection) hold a
+thread, not a whole worker, and the rest of the requests are still served.
+Concurrent requests reach::
+
+    GUNICORN_WORKERS * GUNICORN_THREADS
+
+Each worker process also has its own database pool, password hashing workers
+and job threads; see DB_POOL_SIZE, HASH_WORKERS and JOB_WORKERS.
+"""
+
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+# Worker processes; the CPU bound work (hashing, parsing) scales with them
+workers = int(os.environ.get("GUNICORN_WORKERS", "3"))
+# "gthread", or "sync" for one request at a time per worker (with GUNICORN_THREADS
+# set to 1; otherwise gunicorn runs gthread workers anyway)
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+# Threads per worker, each serving one request at a time
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+# Seconds a worker may stay unresponsive before it is restarted. With gthread
+# workers, long requests do not count, only a blocked main loop
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "30"))
+# Seconds idle keep-alive connections are kept open (gthread only)
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
@@ -0,0 +1,165 @@
+#!python3
+"""
+Benchmarks the hot database lookups before and after their indexes.
+
+A database is filled with 100k users and 1M session files, without the indexes
+of ``db_tables.py``. The queries of ``get_user_by_email``,
+``get_file_for_user_by_name`` and ``get_files_for_user`` are timed, then the
+indexes are created with ``upgrade_schema`` (as on the startup of an existing
+deployment) and the queries are timed again.
+
+Uses a throwaway SQLite database by default. Run from the project root:
+
+    python other/benchmark_db_lookups.py [--users 100000] [--files-per-user 10]
+        [--database-uri postgresql://...]
+
+A given ``--database-uri`` must point to an empty database: its tables are
+created and dropped by the benchmark.
+"""
+
+from pathlib import Path
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import sqlalchemy
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from flaskr.db_tables import Base, SessionFiles, UserCredentials  # noqa: E402
+from flaskr.db_migrations import upgrade_schema  # noqa: E402
+
+
+BATCH_SIZE = 50_000
+HOT_INDEXES = {
+    "UserCredentials": "ix_UserCredentials_email",
+    "SessionFiles": "ix_SessionFiles_user_id_filename",
+}
+
+
+def create_unindexed_tables(engine):
+    """
+    Create the tables as the first versions of the server did, without the
+    indexes on the hot lookup columns.
+    """
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for index_name in HOT_INDEXES.values():
+            connection.execute(sqlalchemy.text(f'DROP INDEX "{index_name}"'))
+
+
+def fill(engine, n_users: int, files_per_user: int):
+    users = UserCredentials.__table__
+    files = SessionFiles.__table__
+    with engine.begin() as connection:
+        for start in range(0, n_users, BATCH_SIZE):
+            connection.execute(
+                users.insert(),
+                [
+                    {
+                        "id": i + 1,
+                        "username": f"user{i}",
+                        "email": f"user{i}@email.com",
+                        "passhash": "x" * 100,
+                        "salt": "c2FsdA==",
+                    }
+                    for i in range(start, min(start + BATCH_SIZE, n_users))
+                ],
+            )
+        n_files = n_users * files_per_user
+        for start in range(0, n_files, BATCH_SIZE):
+            connection.execute(
+                files.insert(),
+                [
+                    {
+                        "user_id": i % n_users + 1,
+                        "filename": f"VIPV_{i // n_users:04d}.txt",
+                    }
+                    for i in range(start, min(start + BATCH_SIZE, n_files))
+                ],
+            )
+
+
+def time_lookups(Session, n_users: int, files_per_user: int, n_lookups: int):
+    """
+    Time the lookups of the app, returning median and p95 latencies in ms.
+    """
+    rng = random.Random(0)
+    queries = {
+        "user by email": lambda db, i: db.query(UserCredentials)
+        .filter_by(email=f"user{i}@email.com")
+        .first(),
+        "file by (user_id, filename)": lambda db, i: db.query(SessionFiles)
+        .filter_by(user_id=i + 1, filename=f"VIPV_{i % files_per_user:04d}.txt")
+        .first(),
+        "files by user_id": lambda db, i: db.query(SessionFiles)
+        .filter_by(user_id=i + 1)
+        .all(),
+    }
+    results = {}
+    with Session() as sql_db:
+        for name, query in queries.items():
+            latencies = []
+            for _ in range(n_lookups):
+                i = rng.randrange(n_users)
+                start = time.perf_counter()
+                query(sql_db, i)
+                latencies.append((time.perf_counter() - start) * 1000)
+                sql_db.expunge_all()
+            latencies.sort()
+            results[name] = (
+                statistics.median(latencies),
+                latencies[int(len(latencies) * 0.95) - 1],
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--files-per-user", type=int, default=10)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--database-uri", default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        uri = args.database_uri or f"sqlite:///{tmp_dir}/benchmark.db"
+        engine = sqlalchemy.create_engine(uri)
+        Session = sessionmaker(bind=engine)
+        try:
+            create_unindexed_tables(engine)
+            start = time.perf_counter()
+            fill(engine, args.users, args.files_per_user)
+            print(
+                f"Filled {args.users} users and "
+                f"{args.users * args.files_per_user} files "
+                f"in {time.perf_counter() - start:.1f}s"
+            )
+
+            before = time_lookups(
+                Session, args.users, args.files_per_user, args.lookups
+            )
+            start = time.perf_counter()
+            changes = upgrade_schema(engine)
+            print(f"{', '.join(changes)} in {time.perf_counter() - start:.1f}s")
+            after = time_lookups(
+                Session, args.users, args.files_per_user, args.lookups
+            )
+
+            print(f"\n{'lookup':<30} {'before (median/p95)':>22} {'after':>20}")
+            for name in before:
+                print(
+                    f"{name:<30} {before[name][0]:>9.3f} / {before[name][1]:>7.3f} ms"
+                    f" {after[name][0]:>7.3f} / {after[name][1]:>7.3f} ms"
+                )
+        finally:
+            Base.metadata.drop_all(engine)
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!python3
+"""
+Benchmarks the login throughput of the server versus the concurrent logins.
+
+gunicorn is started with a throwaway SQLite database, and batches of web logins
+(Argon2 and the rehash of the stored hash, both on the server) are sent at
+increasing concurrency, while ``/api/v1/up`` is probed to measure how much the
+logins stall the other requests. Two setups are compared:
+
+- ``inline``: the hashes run in the request threads, without bound, as the
+  server did before the hashing executor (``HASH_WORKERS=0``).
+- ``pool``: the hashes run in ``HASH_WORKERS`` processes per server process,
+  and logins beyond ``HASH_QUEUE_LIMIT`` waiting get 503.
+
+Run from the project root:
+
+    python other/benchmark_login_throughput.py [--concurrency 1 2 4 8 16 32]
+        [--workers 3] [--threads 8] [--hash-workers 2] [--hash-queue-limit 4]
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+
+import requests
+
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+BENCH_EMAIL = "login_benchmark@email.com"
+BENCH_PASSWORD = "login_benchmark"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(base_url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{base_url}/api/v1/up", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:  # not listening, or still starting
+            time.sleep(0.2)
+    raise TimeoutError("Server did not start")
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def login(base_url: str) -> tuple[int, float]:
+    start = time.perf_counter()
+    response = requests.post(
+        f"{base_url}/login",
+        data={"email": BENCH_EMAIL, "password": BENCH_PASSWORD},
+        allow_redirects=False,
+    )
+    return response.status_code, time.perf_counter() - start
+
+
+def probe_up(base_url: str, stop: threading.Event, latencies: list[float]):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            requests.get(f"{base_url}/api/v1/up", timeout=30)
+        except requests.RequestException:
+            pass
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.05)
+
+
+def run_batch(base_url: str, concurrency: int, n_logins: int):
+    up_latencies = []
+    stop = threading.Event()
+    prober = threading.Thread(target=probe_up, args=(base_url, stop, up_latencies))
+    prober.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: login(base_url), range(n_logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    prober.join()
+
+    ok = [latency for status, latency in results if status == 302]
+    busy = sum(status == 503 for status, _ in results)
+    errors = len(results) - len(ok) - busy
+    print(
+        f"{concurrency:>6} {len(ok) / elapsed:>9.2f}/s "
+        f"{statistics.median(ok) if ok else float('nan'):>8.2f}s "
+        f"{percentile(ok, 0.95):>8.2f}s {busy:>5} {errors:>6} "
+        f"{percentile(up_latencies, 0.95) * 1000:>9.0f} ms"
+    )
+
+
+def benchmark(setup: str, args, env: dict):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [
+            "gunicorn",
+            "-w",
+            str(args.workers),
+            "--threads",
+            str(args.threads),
+            "-b",
+            f"127.0.0.1:{port}",
+            "flaskr:create_app()",
+        ],
+        cwd=PROJECT_ROOT,
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_up(base_url)
+        requests.post(
+            f"{base_url}/signup",
+            data={
+                "email": BENCH_EMAIL,
+                "username": "login_benchmark",
+                "password": BENCH_PASSWORD,
+            },
+            allow_redirects=False,
+        )
+        # start the hashing workers of every server process
+        for _ in range(args.workers * 2):
+            login(base_url)
+
+        print(f"\n{setup}")
+        print(
+            f"{'conc.':>6} {'logins':>11} {'p50':>9} {'p95':>9} {'503':>5} "
+            f"{'errors':>6} {'up p95':>12}"
+        )
+        for concurrency in args.concurrency:
+            run_batch(base_url, concurrency, max(4 * concurrency, 16))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32]
+    )
+    parser.add_argument("--workers", type=int, default=3, help="gunicorn workers")
+    parser.add_argument(
+        "--threads", type=int, default=8, help="threads per gunicorn worker"
+    )
+    parser.add_argument("--hash-workers", type=int, default=2)
+    parser.add_argument("--hash-queue-limit", type=int, default=4)
+    args = parser.parse_args()
+
+    setups = {
+        "inline": {"HASH_WORKERS": "0", "HASH_QUEUE_LIMIT": "1000000"},
+        "pool": {
+            "HASH_WORKERS": str(args.hash_workers),
+            "HASH_QUEUE_LIMIT": str(args.hash_queue_limit),
+        },
+    }
+    print(f"{os.cpu_count()} CPUs, {args.workers} workers x {args.threads} threads")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for setup, settings in setups.items():
+            env = dict(
+                os.environ,
+                DATABASE_URI=f"sqlite:///{Path(tmp_dir) / f'{setup}.db'}",
+                JOB_WORKERS="0",
+                **settings,
+            )
+            benchmark(f"{setup}: {settings}", args, env)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!python3
+"""
+Benchmarks the verification of the client pass-hashes on API login.
+
+First, the verifiers of the stored hashes are timed alone: the ``werkzeug``
+scheme (scrypt, the default of ``generate_password_hash``; and pbkdf2) and the
+``hmac-sha256`` one. Then ``/api/v1/login`` is timed end to end with each
+scheme, in process with a throwaway SQLite database, measuring the wall and
+CPU time per login.
+
+Run from the project root:
+
+    python other/benchmark_passhash_verify.py [--logins 50]
+"""
+
+from pathlib import Path
+import argparse
+import base64
+import os
+import sys
+import tempfile
+import time
+
+TMP_DIR = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URI"] = f"sqlite:///{Path(TMP_DIR.name) / 'bench.db'}"
+# hash in this process, to measure all the CPU time of the logins
+os.environ["HASH_WORKERS"] = "0"
+os.environ["JOB_WORKERS"] = "0"
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from werkzeug.security import generate_password_hash, check_password_hash  # noqa: E402
+
+from flaskr import create_app  # noqa: E402
+from flaskr.common_user import (  # noqa: E402
+    get_user_by_email,
+    hash_password,
+    passhash_scheme,
+    register_user,
+)
+from flaskr.common_user.stored_passhash import (  # noqa: E402
+    check_stored_passhash,
+    make_stored_passhash,
+)
+
+
+BENCH_EMAIL = "passhash_benchmark@email.com"
+BENCH_PASSWORD = "passhash_benchmark"
+
+
+def time_calls(fn, n: int) -> tuple[float, float]:
+    """
+    Mean wall and CPU time of ``n`` calls of ``fn``, in milliseconds.
+    """
+    wall, cpu = time.perf_counter(), time.process_time()
+    for _ in range(n):
+        fn()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    return wall / n * 1000, cpu / n * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=50)
+    args = parser.parse_args()
+
+    app = create_app()
+    client = app.test_client()
+    with app.app_context():
+        register_user(usermail=BENCH_EMAIL, username="bench", password=BENCH_PASSWORD)
+        salt = base64.b64decode(get_user_by_email(BENCH_EMAIL).salt)
+    pass_hash = hash_password(BENCH_PASSWORD, salt=salt)
+
+    print(f"{'verifier':<24} {'wall':>10} {'CPU':>10}")
+    for method in ("scrypt", "pbkdf2"):
+        stored = generate_password_hash(pass_hash, method=method)
+        wall, cpu = time_calls(
+            lambda: check_password_hash(stored, pass_hash), args.logins
+        )
+        print(f"{'werkzeug ' + method:<24} {wall:>7.3f} ms {cpu:>7.3f} ms")
+    with app.app_context():
+        stored = make_stored_passhash(pass_hash)
+        wall, cpu = time_calls(
+            lambda: check_stored_passhash(stored, pass_hash), args.logins
+        )
+    print(f"{'hmac-sha256':<24} {wall:>7.3f} ms {cpu:>7.3f} ms")
+
+    def login():
+        response = client.post(
+            "/api/v1/login",
+            json={
+                "email": BENCH_EMAIL,
+                "passHash": pass_hash,
+                "app_build_number": 1000000,
+            },
+        )
+        assert response.status_code == 200, response.json
+
+    print(f"\n{'API login, scheme':<24} {'wall':>10} {'CPU':>10}")
+    for scheme in ("werkzeug", "hmac-sha256"):
+        app.config["PASSHASH_SCHEME"] = scheme
+        login()  # migrates the stored hash to the scheme
+        with app.app_context():
+            assert passhash_scheme(get_user_by_email(BENCH_EMAIL).passhash) == scheme
+        wall, cpu = time_calls(login, args.logins)
+        print(f"{scheme:<24} {wall:>7.3f} ms {cpu:>7.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
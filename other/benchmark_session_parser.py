@@ -0,0 +1,124 @@
+#!python3
+"""
+Benchmarks the session file parser of ``flaskr.common_files``.
+
+Each session is parsed with the vectorized ``parse_session``, with the chunked
+``iter_session_chunks`` and with a plain ``csv.reader`` row loop as reference.
+The sample sessions of ``test_runtime/data/sessions`` are used when they exist
+(the 4 MB and EMT ones are not committed); otherwise synthetic sessions of the
+same size are generated in a temporary directory.
+
+Run from the project root:
+
+    python other/benchmark_session_parser.py [--repeat 3]
+"""
+
+from pathlib import Path
+import argparse
+import csv
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from flaskr.common_files.session_parser import (  # noqa: E402
+    iter_session_chunks,
+    open_session_text,
+    parse_session,
+    parse_time_of_day,
+    read_header,
+)
+from synthetic_sessions import write_synthetic_session  # noqa: E402
+
+
+SAMPLES_DIR = (
+    Path(__file__).resolve().parent.parent / "test_runtime" / "data" / "sessions"
+)
+# sample session name -> size of the synthetic stand-in, in bytes
+SAMPLE_SESSIONS = {
+    "VIPV_2025-06-06T06_42_37.544229Z-2025-06-06T15_06_31.891352Z_light.txt": 13_000,
+    "VIPV_2025-06-06T06_42_37.544229Z-2025-06-06T15_06_31.891352Z.txt": 4_000_000,
+    "VIPV_2025-07-31_13-12-44Z-2025-07-31_21-08-05Z.txt": 40_000_000,
+}
+
+
+def parse_rows_reference(filepath: Path) -> int:
+    """
+    Row by row parse into Python lists, as a baseline.
+    """
+    with open_session_text(filepath) as text:
+        read_header(text)
+        reader = csv.reader(text)
+        next(reader)
+        beacon_index = {}
+        columns = [[] for _ in range(6)]
+        for row in reader:
+            if not row:
+                continue
+            columns[0].append(beacon_index.setdefault(row[0], len(beacon_index)))
+            columns[1].append(parse_time_of_day(row[1]))
+            for i in range(2, 6):
+                columns[i].append(float(row[i] or "nan"))
+    return len(columns[0])
+
+
+def parse_vectorized(filepath: Path) -> int:
+    return len(parse_session(filepath))
+
+
+def parse_chunked(filepath: Path) -> int:
+    return sum(len(chunk) for chunk in iter_session_chunks(filepath))
+
+
+PARSERS = {
+    "csv rows": parse_rows_reference,
+    "parse_session": parse_vectorized,
+    "iter_session_chunks": parse_chunked,
+}
+
+
+def best_time(parser, filepath: Path, repeat: int) -> tuple[float, int]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        n_rows = parser(filepath)
+        times.append(time.perf_counter() - start)
+    return min(times), n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sessions = []
+        for name, size in SAMPLE_SESSIONS.items():
+            filepath = SAMPLES_DIR / name
+            if not filepath.exists():
+                filepath = Path(tmp_dir) / f"synthetic_{size}.txt"
+                write_synthetic_session(filepath, size)
+            sessions.append(filepath)
+
+        print(f"{'session':<40} {'MB':>7} {'rows':>9}", end="")
+        print("".join(f" {name:>20}" for name in PARSERS))
+        for filepath in sessions:
+            size_mb = filepath.stat().st_size / 1e6
+            results = [
+                best_time(parse, filepath, args.repeat) for parse in PARSERS.values()
+            ]
+            n_rows = results[0][1]
+            assert all(rows == n_rows for _, rows in results), "row count mismatch"
+            print(f"{filepath.name[:40]:<40} {size_mb:>7.1f} {n_rows:>9}", end="")
+            print(
+                "".join(
+                    f" {seconds:>8.3f}s {size_mb / seconds:>6.1f}MB/s"
+                    for seconds, _ in results
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!python3
+"""
+Benchmarks how slow clients affect the other requests, per gunicorn worker type.
+
+gunicorn is started with ``gunicorn.conf.py`` and a throwaway SQLite database,
+first with ``sync`` workers and then with ``gthread`` ones. Some clients start
+uploading session files very slowly, as mobiles on a poor connection do, and
+meanwhile ``/api/v1/up`` and ``/api/v1/login`` are requested by a fast client.
+With ``sync`` workers, as many slow clients as workers leave no worker for the
+rest; with ``gthread`` ones, they only hold a thread each.
+
+Run from the project root:
+
+    python other/benchmark_slow_clients.py [--slow-clients 6] [--duration 10]
+        [--workers 3] [--threads 8]
+"""
+
+from pathlib import Path
+import argparse
+import base64
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from flaskr.common_user import hash_password, salt_and_hash_password  # noqa: E402
+
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+BENCH_EMAIL = "slow_clients_benchmark@email.com"
+BENCH_PASSWORD = "slow_clients_benchmark"
+BOUNDARY = "slowclientboundary"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(api_base: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{api_base}/up", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:  # not listening, or still starting
+            time.sleep(0.2)
+    raise TimeoutError("Server did not start")
+
+
+def register_and_login(api_base: str) -> tuple[str, str]:
+    salt, passhash = salt_and_hash_password(BENCH_PASSWORD)
+    requests.post(
+        f"{api_base}/register",
+        json={
+            "email": BENCH_EMAIL,
+            "username": "slow_clients",
+            "passHash": passhash,
+            "passSalt": salt,
+        },
+    )
+    salt = requests.get(f"{api_base}/salt", headers={"email": BENCH_EMAIL}).json()
+    passhash = hash_password(BENCH_PASSWORD, salt=base64.b64decode(salt["passSalt"]))
+    response = requests.post(
+        f"{api_base}/login",
+        json={"email": BENCH_EMAIL, "passHash": passhash, "app_build_number": 1},
+    )
+    response.raise_for_status()
+    return passhash, response.json()["access_token"]
+
+
+def slow_upload(port: int, access_token: str, stop: threading.Event):
+    """
+    Upload a session file a few bytes at a time, until stopped.
+    """
+    body_start = (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="slow.txt"\r\n'
+        "Content-Type: text/plain\r\n\r\n"
+    ).encode()
+    headers = (
+        "POST /api/v1/session/upload HTTP/1.1\r\n"
+        f"Host: 127.0.0.1:{port}\r\n"
+        f"Authorization: Bearer {access_token}\r\n"
+        f"Content-Type: multipart/form-data; boundary={BOUNDARY}\r\n"
+        f"Content-Length: {10_000_000}\r\n\r\n"
+    ).encode()
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        s.sendall(headers + body_start)
+        while not stop.wait(0.5):
+            s.sendall(b"0" * 16)
+
+
+def timed_request(method, url: str, **kwargs) -> float | None:
+    """
+    Seconds taken by a request, ``None`` if it timed out.
+    """
+    start = time.perf_counter()
+    try:
+        method(url, timeout=5, **kwargs).raise_for_status()
+    except requests.Timeout:
+        return None
+    return time.perf_counter() - start
+
+
+def report(name: str, latencies: list[float | None]):
+    done = sorted(latency for latency in latencies if latency is not None)
+    timeouts = len(latencies) - len(done)
+    if not done:
+        print(f"  {name:<6} all {timeouts} requests timed out")
+        return
+    p50 = done[len(done) // 2]
+    print(
+        f"  {name:<6} p50 {p50 * 1000:7.1f} ms  max {done[-1] * 1000:7.1f} ms  "
+        f"timeouts (5 s) {timeouts}/{len(latencies)}"
+    )
+
+
+def benchmark(worker_class: str, args, tmp_dir: Path):
+    port = free_port()
+    api_base = f"http://127.0.0.1:{port}/api/v1"
+    env = dict(
+        os.environ,
+        DATABASE_URI=f"sqlite:///{tmp_dir / f'{worker_class}.db'}",
+        JOB_WORKERS="0",
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_WORKER_CLASS=worker_class,
+        GUNICORN_WORKERS=str(args.workers),
+        # more threads turn sync workers into gthread ones
+        GUNICORN_THREADS=str(args.threads if worker_class == "gthread" else 1),
+    )
+    server = subprocess.Popen(
+        ["gunicorn", "flaskr:create_app()"],
+        cwd=PROJECT_ROOT,
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    stop = threading.Event()
+    slow_clients = []
+    try:
+        wait_until_up(api_base)
+        passhash, access_token = register_and_login(api_base)
+        login_data = {
+            "email": BENCH_EMAIL,
+            "passHash": passhash,
+            "app_build_number": 1,
+        }
+
+        for _ in range(args.slow_clients):
+            client = threading.Thread(
+                target=slow_upload, args=(port, access_token, stop), daemon=True
+            )
+            client.start()
+            slow_clients.append(client)
+        time.sleep(1)  # let the slow clients take their workers or threads
+
+        up, login = [], []
+        deadline = time.monotonic() + args.duration
+        while time.monotonic() < deadline:
+            up.append(timed_request(requests.get, f"{api_base}/up"))
+            login.append(
+                timed_request(requests.post, f"{api_base}/login", json=login_data)
+            )
+        print(f"\n{worker_class}: {args.slow_clients} slow clients")
+        report("up", up)
+        report("login", login)
+    finally:
+        stop.set()
+        for client in slow_clients:
+            client.join()
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--slow-clients", type=int, default=6)
+    parser.add_argument(
+        "--duration", type=float, default=10, help="seconds of measurements"
+    )
+    parser.add_argument("--workers", type=int, default=3, help="gunicorn workers")
+    parser.add_argument(
+        "--threads", type=int, default=8, help="threads per gthread worker"
+    )
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers, {args.threads} threads per gthread worker")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for worker_class in ("sync", "gthread"):
+            benchmark(worker_class, args, Path(tmp_dir))
+
+
+if __name__ == "__main__":
+    main()
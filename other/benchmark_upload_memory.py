@@ -0,0 +1,154 @@
+#!python3
+"""
+Benchmarks the memory usage and throughput of ``/api/v1/session/upload``.
+
+A single gunicorn sync worker is started with a throwaway SQLite database, and
+session files from 1 MB to 100 MB are uploaded to it. After each upload, the
+peak resident memory (``VmHWM``) of the worker is read from ``/proc``, so the
+sizes are uploaded in increasing order: any growth of the peak is due to the
+last upload. With a streaming upload path, the peak must stay flat.
+
+Linux only. Run from the project root:
+
+    python other/benchmark_upload_memory.py [--sizes 1 10 50 100]
+"""
+
+from pathlib import Path
+import argparse
+import base64
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from flaskr.common_user import hash_password, salt_and_hash_password  # noqa: E402
+from synthetic_sessions import write_synthetic_session  # noqa: E402
+
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+BENCH_EMAIL = "upload_benchmark@email.com"
+BENCH_PASSWORD = "upload_benchmark_password"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def worker_pid(master_pid: int) -> int:
+    children = Path(f"/proc/{master_pid}/task/{master_pid}/children").read_text()
+    return int(children.split()[0])
+
+
+def peak_rss_mb(pid: int) -> float:
+    for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+        if line.startswith("VmHWM:"):
+            return int(line.split()[1]) / 1024
+    raise RuntimeError("VmHWM not found")
+
+
+def wait_until_up(api_base: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{api_base}/up", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:  # not listening, or still starting
+            time.sleep(0.2)
+    raise TimeoutError("Server did not start")
+
+
+def login(api_base: str) -> str:
+    salt, passhash = salt_and_hash_password(BENCH_PASSWORD)
+    requests.post(
+        f"{api_base}/register",
+        json={
+            "email": BENCH_EMAIL,
+            "username": "upload_benchmark",
+            "passHash": passhash,
+            "passSalt": salt,
+        },
+    )
+    salt = requests.get(f"{api_base}/salt", headers={"email": BENCH_EMAIL}).json()
+    passhash = hash_password(
+        BENCH_PASSWORD, salt=base64.b64decode(salt["passSalt"])
+    )
+    response = requests.post(
+        f"{api_base}/login",
+        json={"email": BENCH_EMAIL, "passHash": passhash, "app_build_number": 1},
+    )
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1, 5, 10, 25, 50, 100],
+        help="File sizes to upload, in MB",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        port = free_port()
+        api_base = f"http://127.0.0.1:{port}/api/v1"
+        env = dict(
+            os.environ,
+            DATABASE_URI=f"sqlite:///{tmp_dir / 'bench.db'}",
+            # no processing, that would write next to the blobs meanwhile
+            JOB_WORKERS="0",
+        )
+        server = subprocess.Popen(
+            ["gunicorn", "-w", "1", "-b", f"127.0.0.1:{port}", "flaskr:create_app()"],
+            cwd=PROJECT_ROOT,
+            env=env,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_until_up(api_base)
+            pid = worker_pid(server.pid)
+            headers = {"Authorization": f"Bearer {login(api_base)}"}
+            print(f"worker peak RSS before uploads: {peak_rss_mb(pid):.1f} MB")
+            print(f"{'size':>8} {'time':>8} {'throughput':>12} {'peak RSS':>10}")
+            for size_mb in sorted(args.sizes):
+                session_file = write_synthetic_session(
+                    tmp_dir / f"bench_{size_mb}MB.txt", size_mb * 1_000_000
+                )
+                with session_file.open("rb") as f:
+                    start = time.perf_counter()
+                    response = requests.post(
+                        f"{api_base}/session/upload",
+                        headers=headers,
+                        files={"file": (session_file.name, f)},
+                    )
+                    elapsed = time.perf_counter() - start
+                response.raise_for_status()
+                # remove its blob from the instance folder
+                requests.delete(
+                    f"{api_base}/session/{response.json()['file_id']}",
+                    headers=headers,
+                ).raise_for_status()
+                print(
+                    f"{size_mb:>5} MB {elapsed:>7.2f}s "
+                    f"{size_mb / elapsed:>8.1f} MB/s {peak_rss_mb(pid):>7.1f} MB"
+                )
+                session_file.unlink()
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Generates synthetic session files, with the same layout as the ones uploaded by
+the surCO client, for benchmarking purposes.
+"""
+
+from pathlib import Path
+import json
+import random
+
+
+HEADER = {
+    "version_scheme": 4,
+    "app_version": "3",
+    "timezone": "Europe/Madrid",
+    "start_localized_instant": "2025-06-06T06:42:37.544229Z",
+    "finish_localized_instant": "2025-06-06T15:06:31.891352Z",
+    "device_info": {
+        "manufacturer": "samsung",
+        "model": "SM-A137F",
+        "device": "a13ve",
+        "android_version": "14",
+        "sdk_int": 34,
+    },
+}
+CSV_COLUMNS = "beacon_id,localized_timestamp,data,latitude,longitude,azimuth"
+
+
+def write_synthetic_session(
+    filepath: Path, size_bytes: int, n_beacons: int = 5, seed: int = 0
+) -> Path:
+    """
+    Write a session file of approximately ``size_bytes`` bytes.
+
+    Rows are generated at 10 Hz per beacon, over a random walk around Madrid,
+    with some ``NaN`` coordinates as when the GPS fix is lost.
+    """
+    rng = random.Random(seed)
+    beacon_ids = [f"0x{rng.getrandbits(48):012x}" for _ in range(n_beacons)]
+    header = dict(
+        HEADER,
+        beacons=[
+            {
+                "id": beacon_id,
+                "tilt": 10.0,
+                "orientation": 52.0,
+                "position": "",
+                "description": "",
+            }
+            for beacon_id in beacon_ids
+        ],
+    )
+
+    lat, lon = 40.4168, -3.7038
+    ms_of_day = (8 * 3600 + 42 * 60 + 37) * 1000
+    written = 0
+    with filepath.open("w", encoding="utf-8", newline="\n") as f:
+        written += f.write(json.dumps(header, separators=(",", ":")) + "\n\n")
+        written += f.write(CSV_COLUMNS + "\n")
+        while written < size_bytes:
+            ms_of_day = (ms_of_day + 100) % 86_400_000
+            lat += rng.uniform(-1e-4, 1e-4)
+            lon += rng.uniform(-1e-4, 1e-4)
+            has_fix = rng.random() > 0.05
+            seconds, ms = divmod(ms_of_day, 1000)
+            minutes, seconds = divmod(seconds, 60)
+            hours, minutes = divmod(minutes, 60)
+            timestamp = f"{hours:02d}:{minutes:02d}:{seconds:02d}.{ms:03d}"
+            for beacon_id in beacon_ids:
+                written += f.write(
+                    f"{beacon_id},{timestamp},{rng.randint(300, 2048)},"
+                    + (f"{lat:.7f},{lon:.7f}," if has_fix else "NaN,NaN,")
+                    + f"{rng.uniform(-180, 180):.6f}\n"
+                )
+    return filepath
@@ -1,8 +1,19 @@
 import pytest
 from flaskr import create_app
-from flaskr.db_tables import UserCredentials
+from flaskr.db_tables import (
+    UserCredentials,
+    SessionBlobs,
+    SessionFiles,
+    SessionSummaries,
+    ProcessingJobs,
+)
+from flaskr.common_files import get_session_filepath_for_user
+from flaskr.common_user import get_user_by_email
 from flaskr.common_user.user_login_signin import register_user
+from flask_jwt_extended import create_access_token
 
+import json
+import math
 import os
 import sys
 
@@ -38,14 +49,54 @@ def unregistered_user() -> dict[str, str]:
     }
 
 
+@pytest.fixture(scope="session")
+def session_content() -> bytes:
+    """
+    Fixture to provide the content of a valid session file, with two beacons
+    and some samples without GPS fix at the start.
+    """
+    header = {
+        "version_scheme": 4,
+        "app_version": "3",
+        "timezone": "Europe/Madrid",
+        "start_localized_instant": "2025-06-06T06:42:37.544229Z",
+        "finish_localized_instant": "2025-06-06T06:59:17.544229Z",
+        "device_info": {"manufacturer": "samsung", "model": "SM-A137F"},
+        "beacons": [{"id": "0xe3237b8fd355"}, {"id": "0xd782cb99c626"}],
+    }
+    rows = []
+    for i in range(1000):
+        seconds = 37 + i
+        timestamp = f"08:{42 + seconds // 60:02d}:{seconds % 60:02d}.765"
+        for beacon_id in ("0xe3237b8fd355", "0xd782cb99c626"):
+            # a winding route, heading north
+            position = (
+                "NaN,NaN"
+                if i < 10
+                else f"{40.45 + i * 1e-4:.7f},{-3.65 + 1e-3 * math.sin(i / 50):.7f}"
+            )
+            rows.append(f"{beacon_id},{timestamp},{1000 + i % 500},{position},12.5")
+    return (
+        json.dumps(header)
+        + "\n\nbeacon_id,localized_timestamp,data,latitude,longitude,azimuth\n"
+        + "\n".join(rows)
+        + "\n"
+    ).encode("utf-8")
+
+
 @pytest.fixture()
-def app(registered_user, unregistered_user):
-    app = create_app()
-    app.config.update(
+def app(registered_user, unregistered_user, tmp_path):
+    app = create_app(
         {
             "TESTING": True,
+            # run the background jobs explicitly, with run_pending_jobs
+            "JOB_WORKERS": 0,
+            # hash the passwords in the test threads, without worker processes
+            "HASH_WORKERS": 0,
         }
     )
+    # keep uploaded session files out of the real instance folder
+    app.instance_path = str(tmp_path)
 
     # other setup can go here
     with app.app_context():
@@ -75,6 +126,20 @@ def app(registered_user, unregistered_user):
                     .first()
                 )
                 if user:
+                    file_ids = sql_db.query(SessionFiles.id).filter_by(user_id=user.id)
+                    for table in (SessionSummaries, ProcessingJobs):
+                        sql_db.query(table).filter(
+                            table.file_id.in_(file_ids.scalar_subquery())
+                        ).delete(synchronize_session=False)
+                    blob_ids = [
+                        blob_id
+                        for (blob_id,) in file_ids.with_entities(SessionFiles.blob_id)
+                    ]
+                    sql_db.query(SessionFiles).filter_by(user_id=user.id).delete()
+                    # the blobs are stored in the instance folder of the test
+                    sql_db.query(SessionBlobs).filter(
+                        SessionBlobs.id.in_(blob_ids)
+                    ).delete(synchronize_session=False)
                     sql_db.delete(user)
                     sql_db.commit()
 
@@ -84,6 +149,30 @@ def client(app):
     return app.test_client()
 
 
+@pytest.fixture()
+def auth_headers(app, registered_user) -> dict[str, str]:
+    """
+    Fixture to provide the authorization headers of the registered user.
+    """
+    with app.app_context():
+        access_token = create_access_token(identity=registered_user["email"])
+    return {"Authorization": f"Bearer {access_token}"}
+
+
 @pytest.fixture()
 def runner(app):
     return app.test_cli_runner()
+
+
+@pytest.fixture()
+def stored_filepath(app, registered_user):
+    """
+    Fixture to provide a function getting the stored path of a session file
+    of the registered user, by its name; ``None`` if the user has no such file.
+    """
+    def get_stored_filepath(filename):
+        with app.app_context():
+            user = get_user_by_email(registered_user["email"])
+            return get_session_filepath_for_user(user, filename)
+
+    return get_stored_filepath
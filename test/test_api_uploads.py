@@ -0,0 +1,223 @@
+import hashlib
+import io
+import os
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from flaskr.common_files import ResumableUpload, sweep_uploads
+from flaskr.common_files.resumable_uploads import MAX_OPEN_UPLOADS, MAX_UPLOAD_SIZE
+from flaskr.db_tables import SessionFiles
+
+
+@pytest.fixture(scope="module")
+def uploads_base():
+    """
+    Fixture to provide the base URL for the resumable uploads API.
+    """
+    return "/api/v1/session/uploads"
+
+
+@pytest.fixture(scope="module")
+def session_content():
+    """
+    Fixture to provide the content of a session file, split in three chunks.
+    """
+    return b'{"version_scheme":4}\n\nbeacon_id,data\n' + b"0xe3237b8fd355,1122\n" * 100
+
+
+def put_chunk(client, url, headers, index, offset, chunk, sha256=None):
+    return client.put(
+        f"{url}/chunks/{index}",
+        headers={
+            **headers,
+            "Upload-Offset": str(offset),
+            "Chunk-SHA256": sha256 or hashlib.sha256(chunk).hexdigest(),
+        },
+        data=chunk,
+    )
+
+
+def test_resumable_upload(
+    app, client, uploads_base, auth_headers, session_content, stored_filepath
+):
+    """
+    Test a complete resumable upload, with retries and a dropped connection.
+    """
+    response = client.post(
+        uploads_base,
+        headers=auth_headers,
+        json={
+            "filename": "session.txt",
+            "size": len(session_content),
+            "sha256": hashlib.sha256(session_content).hexdigest(),
+        },
+    )
+    assert response.status_code == 201
+    upload_url = f"{uploads_base}/{response.json['upload_id']}"
+    assert response.json["offset"] == 0
+
+    chunks = [session_content[:1000], session_content[1000:2000]]
+    chunks.append(session_content[2000:])
+
+    response = put_chunk(client, upload_url, auth_headers, 0, 0, chunks[0])
+    assert response.status_code == 200
+    assert response.json["offset"] == 1000
+    assert response.json["next_index"] == 1
+
+    # retrying an acknowledged chunk is harmless
+    response = put_chunk(client, upload_url, auth_headers, 0, 0, chunks[0])
+    assert response.status_code == 200
+    assert response.json["offset"] == 1000
+
+    # a corrupted chunk is rejected and not stored
+    response = put_chunk(
+        client, upload_url, auth_headers, 1, 1000, chunks[1], sha256="0" * 64
+    )
+    assert response.status_code == 400
+    assert response.json["offset"] == 1000
+
+    # skipping a chunk is rejected, and the client learns where to resume
+    response = put_chunk(client, upload_url, auth_headers, 2, 2000, chunks[2])
+    assert response.status_code == 409
+    assert response.json["next_index"] == 1
+
+    # the session is not registered until committed
+    response = client.post(f"{upload_url}/commit", headers=auth_headers)
+    assert response.status_code == 400
+
+    response = client.get(upload_url, headers=auth_headers)
+    assert response.status_code == 200
+    offset = response.json["offset"]
+    for index, chunk in enumerate(chunks[1:], start=1):
+        response = put_chunk(client, upload_url, auth_headers, index, offset, chunk)
+        assert response.status_code == 200
+        offset = response.json["offset"]
+
+    response = client.post(f"{upload_url}/commit", headers=auth_headers)
+    assert response.status_code == 201
+    with app.app_context():
+        with app.Session() as sql_db:
+            file = sql_db.get(SessionFiles, response.json["file_id"])
+            assert file.sha256 == hashlib.sha256(session_content).hexdigest()
+            assert file.size_bytes == len(session_content)
+            assert file.version_scheme == 4
+
+    file_id = response.json["file_id"]
+    sessions_dir = Path(app.instance_path, "sessions")
+    assert stored_filepath("session.txt").read_bytes() == session_content
+    assert list((sessions_dir / ".uploads").glob("*/*/data.part")) == []
+
+    # retrying the commit gets the stored file
+    response = client.post(f"{upload_url}/commit", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json["file_id"] == file_id
+
+    # the same contents are not uploaded again, under any name
+    response = client.post(
+        uploads_base,
+        headers=auth_headers,
+        json={
+            "filename": "copy.txt",
+            "size": len(session_content),
+            "sha256": hashlib.sha256(session_content).hexdigest(),
+        },
+    )
+    assert response.status_code == 200
+    assert response.json["file_id"] == file_id
+
+
+def test_resumable_upload_checksum_mismatch(
+    client, uploads_base, auth_headers, session_content
+):
+    """
+    Test a resumable upload is not committed if the whole file checksum differs.
+    """
+    response = client.post(
+        uploads_base,
+        headers=auth_headers,
+        json={
+            "filename": "session.txt",
+            "size": len(session_content),
+            "sha256": "0" * 64,
+        },
+    )
+    upload_url = f"{uploads_base}/{response.json['upload_id']}"
+    response = put_chunk(client, upload_url, auth_headers, 0, 0, session_content)
+    assert response.status_code == 200
+
+    response = client.post(f"{upload_url}/commit", headers=auth_headers)
+    assert response.status_code == 400
+
+    response = client.delete(upload_url, headers=auth_headers)
+    assert response.status_code == 204
+
+
+def test_resumable_upload_limits(client, uploads_base, auth_headers):
+    """
+    Test the size of the uploads and the number open per user are limited.
+    """
+    for size in (True, MAX_UPLOAD_SIZE + 1):
+        response = client.post(
+            uploads_base,
+            headers=auth_headers,
+            json={"filename": "session.txt", "size": size},
+        )
+        assert response.status_code in (400, 413)
+
+    upload_urls = []
+    for _ in range(MAX_OPEN_UPLOADS):
+        response = client.post(
+            uploads_base,
+            headers=auth_headers,
+            json={"filename": "session.txt", "size": MAX_UPLOAD_SIZE},
+        )
+        assert response.status_code == 201
+        upload_urls.append(f"{uploads_base}/{response.json['upload_id']}")
+    response = client.post(
+        uploads_base,
+        headers=auth_headers,
+        json={"filename": "session.txt", "size": 10},
+    )
+    assert response.status_code == 429
+
+    response = client.delete(upload_urls[0], headers=auth_headers)
+    assert response.status_code == 204
+    response = client.delete(upload_urls[0], headers=auth_headers)
+    assert response.status_code == 404
+    response = client.post(
+        uploads_base,
+        headers=auth_headers,
+        json={"filename": "session.txt", "size": 10},
+    )
+    assert response.status_code == 201
+
+
+def test_resumable_upload_discarded(app, session_content):
+    """
+    Test an upload discarded by another request is not found, not an error,
+    and that the expired uploads are swept.
+    """
+    user = SimpleNamespace(id=1)
+    with app.app_context():
+        upload = ResumableUpload.create(user, "session.txt", len(session_content))
+        ResumableUpload.load(user, upload.upload_id).discard()
+        with pytest.raises(FileNotFoundError):
+            upload.write_chunk(
+                0,
+                0,
+                io.BytesIO(session_content),
+                hashlib.sha256(session_content).hexdigest(),
+            )
+        with pytest.raises(FileNotFoundError):
+            upload.discard()
+
+        expired = ResumableUpload.create(user, "a.txt", 10)
+        recent = ResumableUpload.create(user, "b.txt", 10)
+        old = time.time() - 2 * 86400
+        os.utime(expired.directory / "state.json", (old, old))
+        assert sweep_uploads() == 1
+        assert ResumableUpload.load(user, expired.upload_id) is None
+        assert ResumableUpload.load(user, recent.upload_id) is not None
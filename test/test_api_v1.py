@@ -1,8 +1,33 @@
 import base64
+import gzip
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
 
 import pytest
+import zstandard
 
-from flaskr.common_user import salt_and_hash_password, hash_password
+from flaskr.common_files import get_file_for_user_by_id
+from flaskr.common_user import (
+    get_user_by_email,
+    register_user,
+    salt_and_hash_password,
+    hash_password,
+)
+from flaskr.db_tables import SessionBlobs, SessionFiles
+from flaskr.jobs import run_pending_jobs
+from flask_jwt_extended import create_access_token
+
+
+def compress(content: bytes, encoding: str) -> bytes:
+    """
+    Compress some content as the mobile client would.
+    """
+    if encoding == "gzip":
+        return gzip.compress(content)
+    return zstandard.ZstdCompressor().compress(content)
 
 
 @pytest.fixture(scope="module")
@@ -47,13 +72,22 @@ def test_salt_bad_request(client, api_base):
 
 def test_salt_non_existent_email(client, api_base, email_non_existent):
     """
-    Test the /salt endpoint with a non-existent email.
+    Test the /salt endpoint with a non-existent email returns a decoy salt,
+    the same on every request and indistinguishable from a real one.
     """
     response = client.get(api_base + "/salt", headers={"email": email_non_existent})
-    assert response.status_code == 404
-    json = response.json
-    assert "message" in json
-    assert json["message"] == "User not found"
+    assert response.status_code == 200
+    salt = response.json["passSalt"]
+    assert len(base64.b64decode(salt)) == 16
+
+    response = client.get(
+        api_base + "/salt", headers={"email": email_non_existent.upper()}
+    )
+    assert response.json["passSalt"] == salt
+    response = client.get(
+        api_base + "/salt", headers={"email": "other_" + email_non_existent}
+    )
+    assert response.json["passSalt"] != salt
 
 
 def test_salt_existing_email(client, api_base, registered_user):
@@ -287,3 +321,293 @@ def test_login_obsolete_client_build(client, api_base, registered_user):
     json = response.json
     assert "message" in json
     assert "Client version too old" in json["message"]
+
+
+def test_upload_session_file(
+    app, client, api_base, auth_headers, session_content, stored_filepath
+):
+    """
+    Test the /session/upload endpoint streams the file to the blob store,
+    and enqueues the job building its columnar sidecar.
+    """
+    content = session_content
+    response = client.post(
+        api_base + "/session/upload",
+        headers=auth_headers,
+        data={"file": (io.BytesIO(content), "session.txt")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 201
+    file_id = response.json["file_id"]
+    status_url = response.json["status_url"]
+    assert status_url == f"{api_base}/session/{file_id}/status"
+
+    sha256 = hashlib.sha256(content).hexdigest()
+    filepath = stored_filepath("session.txt")
+    assert filepath.name == sha256
+    assert sorted(p.name for p in filepath.parent.iterdir()) == [sha256]
+    response = client.get(status_url, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json["filename"] == "session.txt"
+    assert response.json["status"] == "queued"
+
+    with app.app_context():
+        assert run_pending_jobs() == 1
+    response = client.get(status_url, headers=auth_headers)
+    assert response.json["status"] == "done"
+    assert response.json["jobs"] == [
+        {"kind": "session_artifacts", "status": "done", "attempts": 1, "error": None}
+    ]
+    assert sorted(p.name for p in filepath.parent.iterdir()) == [
+        sha256,
+        sha256 + ".columns",
+    ]
+    assert filepath.read_bytes() == content
+
+    # uploading the same file again, e.g. a retry, stores nothing new
+    response = client.post(
+        api_base + "/session/upload",
+        headers=auth_headers,
+        data={"file": (io.BytesIO(content), "session.txt")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 200
+    assert response.json["file_id"] == file_id
+
+    # uploading other contents with the same filename is rejected
+    response = client.post(
+        api_base + "/session/upload",
+        headers=auth_headers,
+        data={"file": (io.BytesIO(content + b"\n"), "session.txt")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 409
+
+
+def test_upload_session_file_deduplicated(
+    app,
+    client,
+    api_base,
+    auth_headers,
+    unregistered_user,
+    session_content,
+    stored_filepath,
+):
+    """
+    Test the same contents are stored once, shared by the files of all the
+    users, and removed with the last of them.
+    """
+    def upload(headers, filename):
+        return client.post(
+            api_base + "/session/upload",
+            headers=headers,
+            data={"file": (io.BytesIO(session_content), filename)},
+            content_type="multipart/form-data",
+        )
+
+    response = upload(auth_headers, "session.txt")
+    assert response.status_code == 201
+    file_id = response.json["file_id"]
+    # the same session under another name is answered with the stored one
+    response = upload(auth_headers, "copy.txt")
+    assert response.status_code == 200
+    assert response.json["file_id"] == file_id
+    assert stored_filepath("copy.txt") is None
+
+    # another user uploading it gets a file of their own, sharing the blob
+    with app.app_context():
+        register_user(
+            usermail=unregistered_user["email"],
+            username=unregistered_user["username"],
+            password=unregistered_user["password"],
+        )
+        other_headers = {
+            "Authorization": "Bearer "
+            + create_access_token(identity=unregistered_user["email"])
+        }
+    response = upload(other_headers, "other.txt")
+    assert response.status_code == 201
+    other_file_id = response.json["file_id"]
+    assert other_file_id != file_id
+
+    blobs_dir = Path(app.instance_path, "sessions", ".blobs")
+    stored = [p for p in blobs_dir.rglob("*") if p.is_file()]
+    assert stored == [stored_filepath("session.txt")]
+    with app.app_context():
+        with app.Session() as sql_db:
+            (blob,) = sql_db.query(SessionBlobs).filter_by(
+                sha256=hashlib.sha256(session_content).hexdigest()
+            )
+            assert blob.refcount == 2
+
+    response = client.delete(
+        f"{api_base}/session/{other_file_id}", headers=other_headers
+    )
+    assert response.status_code == 200
+    assert stored[0].exists()
+
+    response = client.delete(f"{api_base}/session/{file_id}", headers=auth_headers)
+    assert response.status_code == 200
+    assert not stored[0].exists()
+    with app.app_context():
+        with app.Session() as sql_db:
+            assert sql_db.get(SessionBlobs, blob.id) is None
+    response = client.delete(f"{api_base}/session/{file_id}", headers=auth_headers)
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("encoding", [None, "gzip"])
+def test_upload_session_file_metadata(
+    app, client, api_base, auth_headers, registered_user, session_content, encoding
+):
+    """
+    Test the metadata of uploaded session files is stored with them, read from
+    the decompressed contents and the header line.
+    """
+    app.config["SESSION_FILES_COMPRESSION"] = encoding
+    response = client.post(
+        api_base + "/session/upload",
+        headers=auth_headers,
+        data={"file": (io.BytesIO(session_content), "session.txt")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 201
+
+    with app.app_context():
+        user = get_user_by_email(registered_user["email"])
+        file = get_file_for_user_by_id(user, response.json["file_id"])
+    assert file.size_bytes == len(session_content)
+    assert file.sha256 == hashlib.sha256(session_content).hexdigest()
+    assert file.uploaded_at is not None
+    assert file.version_scheme == 4
+    assert file.app_version == "3"
+    assert file.timezone == "Europe/Madrid"
+    assert file.start_instant == datetime(2025, 6, 6, 6, 42, 37, 544229)
+    assert file.finish_instant == datetime(2025, 6, 6, 6, 59, 17, 544229)
+    assert file.device_model == "SM-A137F"
+    assert file.n_beacons == 2
+
+
+def test_upload_session_file_not_text(app, client, api_base, auth_headers):
+    """
+    Test the /session/upload endpoint rejects binary files, leaving no trace.
+    """
+    response = client.post(
+        api_base + "/session/upload",
+        headers=auth_headers,
+        data={"file": (io.BytesIO(b"\xff\xfe\x00binary"), "session.txt")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 400
+
+    sessions_dir = Path(app.instance_path, "sessions")
+    assert [p for p in sessions_dir.rglob("*") if p.is_file()] == []
+
+
+@pytest.mark.parametrize("encoding, suffix", [("gzip", ".gz"), ("zstd", ".zst")])
+def test_upload_precompressed_session_file(
+    client, api_base, auth_headers, stored_filepath, encoding, suffix
+):
+    """
+    Test the /session/upload endpoint stores pre-compressed files as sent,
+    both as a form part and as a raw body with Content-Encoding.
+    """
+    header = b'{"version_scheme":4}\n\nbeacon_id,data\n'
+    form_compressed = compress(header + b"0x1,1122\n" * 1000, encoding)
+    raw_compressed = compress(header + b"0x2,1122\n" * 1000, encoding)
+
+    response = client.post(
+        api_base + "/session/upload",
+        headers=auth_headers,
+        data={"file": (io.BytesIO(form_compressed), "form.txt" + suffix)},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 201
+
+    response = client.post(
+        api_base + "/session/upload?filename=raw.txt",
+        headers={**auth_headers, "Content-Encoding": encoding},
+        data=raw_compressed,
+        content_type="application/octet-stream",
+    )
+    assert response.status_code == 201
+
+    form_filepath = stored_filepath("form.txt")
+    assert form_filepath.name.endswith(suffix)
+    assert form_filepath.read_bytes() == form_compressed
+    assert stored_filepath("raw.txt").read_bytes() == raw_compressed
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        pytest.param(b"beacon_id,data\n0x1,1122\n", id="no_header"),
+        pytest.param(b'{"version_scheme":4}', id="header_only_no_newline"),
+        pytest.param(b'{"version_scheme":4}\n\n\xff\xfe\n', id="not_text"),
+    ],
+)
+def test_upload_precompressed_invalid_session_file(
+    app, client, api_base, auth_headers, content
+):
+    """
+    Test the /session/upload endpoint rejects invalid pre-compressed files.
+    """
+    for data in (compress(content, "gzip"), compress(content, "gzip")[:-4]):
+        response = client.post(
+            api_base + "/session/upload?filename=raw.txt",
+            headers={**auth_headers, "Content-Encoding": "gzip"},
+            data=data,
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 400
+
+    response = client.post(
+        api_base + "/session/upload?filename=raw.txt",
+        headers={**auth_headers, "Content-Encoding": "br"},
+        data=content,
+        content_type="application/octet-stream",
+    )
+    assert response.status_code == 415
+
+    sessions_dir = Path(app.instance_path, "sessions")
+    assert [p for p in sessions_dir.rglob("*") if p.is_file()] == []
+
+
+def test_upload_session_file_concurrent(
+    app, api_base, auth_headers, registered_user, session_content, stored_filepath
+):
+    """
+    Test of many concurrent uploads of a filename, with different contents,
+    exactly one is stored, and the others leave no file nor entry behind.
+    """
+    contents = [session_content + b"\n" * i for i in range(200)]
+
+    def upload(content):
+        return app.test_client().post(
+            api_base + "/session/upload",
+            headers=auth_headers,
+            data={"file": (io.BytesIO(content), "session.txt")},
+            content_type="multipart/form-data",
+        ).status_code
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        statuses = list(executor.map(upload, contents))
+
+    assert statuses.count(201) == 1
+    assert statuses.count(409) == len(contents) - 1
+    stored = stored_filepath("session.txt")
+    assert stored.read_bytes() == contents[statuses.index(201)]
+
+    # only the stored file, without partial or staged ones
+    sessions_dir = Path(app.instance_path, "sessions")
+    assert [p for p in sessions_dir.rglob("*") if p.is_file()] == [stored]
+    with app.app_context():
+        user = get_user_by_email(registered_user["email"])
+        with app.Session() as sql_db:
+            assert sql_db.query(SessionFiles).filter_by(user_id=user.id).count() == 1
+            (blob,) = sql_db.query(SessionBlobs).filter(
+                SessionBlobs.sha256.in_(
+                    [hashlib.sha256(content).hexdigest() for content in contents]
+                )
+            )
+            assert blob.refcount == 1
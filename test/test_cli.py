@@ -0,0 +1,121 @@
+import gzip
+import hashlib
+import io
+from datetime import datetime
+from pathlib import Path
+
+from flaskr.common_files.session_columns import get_columns_dir
+from flaskr.common_user import get_user_by_email
+from flaskr.db_tables import SessionBlobs, SessionFiles
+
+
+def test_compress_sessions(app, runner):
+    """
+    Test the compress-sessions command compresses the files in place.
+    """
+    user_dir = Path(app.instance_path, "sessions", "user@email.com")
+    user_dir.mkdir(parents=True)
+    content = b"beacon_id,data\n" + b"0xe3237b8fd355,1122\n" * 1000
+    (user_dir / "session.txt").write_bytes(content)
+    (user_dir / "binary.txt").write_bytes(b"\xff\xfe")
+
+    result = runner.invoke(args=["compress-sessions", "--encoding", "gzip"])
+    assert result.exit_code == 0, result.output
+    assert "Compressed 1 files with gzip" in result.output
+
+    assert not (user_dir / "session.txt").exists()
+    assert gzip.decompress((user_dir / "session.txt.gz").read_bytes()) == content
+    assert (user_dir / "binary.txt").exists()
+
+
+def test_run_jobs_once(
+    client, runner, auth_headers, session_content, stored_filepath
+):
+    """
+    Test the run-jobs command runs the queued jobs and exits.
+    """
+    response = client.post(
+        "/api/v1/session/upload",
+        headers=auth_headers,
+        data={"file": (io.BytesIO(session_content), "session.txt")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 201
+
+    result = runner.invoke(args=["run-jobs", "--once"])
+    assert result.exit_code == 0, result.output
+    assert "Ran 1 jobs." in result.output
+    assert get_columns_dir(stored_filepath("session.txt")).is_dir()
+
+
+def test_backfill_session_metadata(
+    app, client, runner, auth_headers, registered_user, session_content
+):
+    """
+    Test the backfill-session-metadata command fills in the files stored
+    without metadata.
+    """
+    response = client.post(
+        "/api/v1/session/upload",
+        headers=auth_headers,
+        data={"file": (io.BytesIO(session_content), "session.txt")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 201
+    with app.app_context():
+        with app.Session() as sql_db:
+            file = sql_db.get(SessionFiles, response.json["file_id"])
+            file.sha256 = file.size_bytes = file.start_instant = None
+            sql_db.commit()
+
+    result = runner.invoke(args=["backfill-session-metadata"])
+    assert result.exit_code == 0, result.output
+    assert "Filled in the metadata of 1 files, 0 missing." in result.output
+    with app.app_context():
+        with app.Session() as sql_db:
+            file = sql_db.get(SessionFiles, response.json["file_id"])
+            assert file.sha256 == hashlib.sha256(session_content).hexdigest()
+            assert file.size_bytes == len(session_content)
+            assert file.start_instant == datetime(2025, 6, 6, 6, 42, 37, 544229)
+
+
+def test_migrate_sessions(
+    app, runner, registered_user, session_content, stored_filepath
+):
+    """
+    Test the migrate-sessions command moves the files in the directories of
+    the users to the blob store, with their artifacts, storing duplicates once.
+    """
+    user_dir = Path(app.instance_path, "sessions", registered_user["email"])
+    user_dir.mkdir(parents=True)
+    compressed = gzip.compress(session_content)
+    (user_dir / "legacy.txt.gz").write_bytes(compressed)
+    (user_dir / "legacy.txt.columns").mkdir()
+    (user_dir / "legacy.txt.columns" / "meta.json").write_text("{}")
+    (user_dir / "copy.txt").write_bytes(session_content)
+    with app.app_context():
+        user = get_user_by_email(registered_user["email"])
+        with app.Session() as sql_db:
+            for filename in ("legacy.txt", "copy.txt", "missing.txt"):
+                sql_db.add(SessionFiles(user.id, filename))
+            sql_db.commit()
+
+    result = runner.invoke(args=["migrate-sessions"])
+    assert result.exit_code == 0, result.output
+    assert (
+        "Moved 2 files to the blob store, 1 of them already stored; 1 missing."
+        in result.output
+    )
+    assert not user_dir.exists()
+    blob_path = stored_filepath("legacy.txt")
+    assert blob_path.parent.parent.parent.name == ".blobs"
+    assert stored_filepath("copy.txt") == blob_path
+    assert blob_path.read_bytes() == compressed
+    assert (get_columns_dir(blob_path) / "meta.json").exists()
+    with app.app_context():
+        with app.Session() as sql_db:
+            (blob,) = sql_db.query(SessionBlobs).all()
+            assert blob.refcount == 2
+
+    result = runner.invoke(args=["migrate-sessions"])
+    assert "Moved 0 files to the blob store" in result.output
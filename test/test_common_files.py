@@ -0,0 +1,428 @@
+import functools
+import gzip
+import io
+import json
+import os
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from flaskr.common_files import (
+    build_session_artifacts,
+    build_session_columns,
+    compute_session_summaries,
+    ensure_dir,
+    iter_session_chunks,
+    iter_sessions_zip,
+    load_session_columns,
+    LocalStorage,
+    ParsedSession,
+    parse_session,
+    query_viewport,
+)
+from flaskr.common_files import session_columns, trace_pyramid
+from flaskr.common_files.session_columns import get_columns_dir
+from flaskr.common_files.session_summary import route_distance
+from flaskr.common_files.trace_pyramid import douglas_peucker_significance
+
+
+SESSION_HEADER = {
+    "version_scheme": 4,
+    "app_version": "3",
+    "timezone": "Europe/Madrid",
+    "start_localized_instant": "2025-06-06T21:59:58.000000Z",
+    "finish_localized_instant": "2025-06-06T22:00:03.000000Z",
+    "beacons": [{"id": "0xe3237b8fd355"}, {"id": "0xd782cb99c626"}],
+}
+SESSION_ROWS = [
+    "0xe3237b8fd355,23:59:58.500,1122,NaN,NaN,-13.248203",
+    "0xd782cb99c626,23:59:59.250,1131,40.45293,-3.6585453,-156.01598",
+    "0xe3237b8fd355,00:00:01.000,1151,40.45296,-3.6585872,-158.3877",
+    "0xd782cb99c626,00:00:02.750,1189,40.452988,-3.6586552,-155.97867",
+]
+
+
+@pytest.fixture(params=["txt", "txt.gz"])
+def session_file(tmp_path, request):
+    """
+    Fixture to provide a small session file crossing local midnight,
+    stored uncompressed and gzip-compressed.
+    """
+    content = (
+        json.dumps(SESSION_HEADER)
+        + "\n\nbeacon_id,localized_timestamp,data,latitude,longitude,azimuth\n"
+        + "\n".join(SESSION_ROWS)
+        + "\n"
+    ).encode("utf-8")
+    filepath = tmp_path / f"session.{request.param}"
+    if request.param.endswith(".gz"):
+        content = gzip.compress(content)
+    filepath.write_bytes(content)
+    return filepath
+
+
+def test_parse_session(session_file):
+    """
+    Test a session file is parsed into typed columns.
+    """
+    parsed = parse_session(session_file)
+
+    assert parsed.header == SESSION_HEADER
+    assert parsed.beacon_ids == ["0xe3237b8fd355", "0xd782cb99c626"]
+    assert len(parsed) == 4
+    np.testing.assert_array_equal(parsed.columns["beacon"], [0, 1, 0, 1])
+    np.testing.assert_array_equal(parsed.columns["data"], [1122, 1131, 1151, 1189])
+    assert np.isnan(parsed.columns["latitude"][0])
+    assert parsed.columns["longitude"][1] == -3.6585453
+    # local times (UTC+2) after midnight belong to the next day
+    np.testing.assert_array_equal(
+        parsed.columns["timestamp"],
+        np.array(
+            [
+                "2025-06-06T21:59:58.500",
+                "2025-06-06T21:59:59.250",
+                "2025-06-06T22:00:01.000",
+                "2025-06-06T22:00:02.750",
+            ],
+            dtype="datetime64[ms]",
+        ),
+    )
+
+
+def test_parse_session_invalid(tmp_path):
+    """
+    Test parsing a file that is not a session raises ValueError.
+    """
+    filepath = tmp_path / "session.txt"
+    filepath.write_text('{"version_scheme":4}\n\nbeacon_id,data\n0x1,2\n')
+    with pytest.raises(ValueError):
+        parse_session(filepath)
+
+
+def test_parse_session_chunks(session_file):
+    """
+    Test the chunked mode yields the same columns, with consistent beacon codes.
+    """
+    chunks = list(iter_session_chunks(session_file, chunk_size=1))
+    assert [len(chunk) for chunk in chunks] == [1, 1, 1, 1]
+    assert chunks[0].beacon_ids == ["0xe3237b8fd355"]
+    assert chunks[-1].beacon_ids == ["0xe3237b8fd355", "0xd782cb99c626"]
+
+    parsed = parse_session(session_file)
+    for name, values in parsed.columns.items():
+        np.testing.assert_array_equal(
+            np.concatenate([chunk.columns[name] for chunk in chunks]), values
+        )
+    assert parse_session(session_file, chunk_size=100).beacon_ids == parsed.beacon_ids
+
+
+@pytest.mark.parametrize("chunk_size", [1, 1024])
+def test_parse_session_daylight_saving(tmp_path, chunk_size):
+    """
+    Test the rows of a session spanning a daylight saving change get their
+    own UTC offset, whether in the same chunk or not.
+    """
+    filepath = tmp_path / "session.txt"
+    filepath.write_text(
+        json.dumps(
+            {**SESSION_HEADER, "start_localized_instant": "2025-03-30T00:59:58Z"}
+        )
+        + "\n\nbeacon_id,localized_timestamp,data,latitude,longitude,azimuth\n"
+        # clocks go from 02:00 (UTC+1) to 03:00 (UTC+2)
+        + "0xe3237b8fd355,01:59:59.000,1122,NaN,NaN,0\n"
+        + "0xe3237b8fd355,03:00:01.000,1131,NaN,NaN,0\n"
+    )
+    parsed = parse_session(filepath, chunk_size=chunk_size)
+
+    np.testing.assert_array_equal(
+        parsed.columns["timestamp"],
+        np.array(
+            ["2025-03-30T00:59:59.000", "2025-03-30T01:00:01.000"],
+            dtype="datetime64[ms]",
+        ),
+    )
+
+
+def test_parse_session_irregular_rows(tmp_path):
+    """
+    Test empty numeric fields and times of day without milliseconds are parsed.
+    """
+    filepath = tmp_path / "session.txt"
+    filepath.write_text(
+        json.dumps(SESSION_HEADER)
+        + "\n\nbeacon_id,localized_timestamp,data,latitude,longitude,azimuth\n"
+        + "0xe3237b8fd355,23:59:58,1122,,,-13.248203\n"
+        + "0xe3237b8fd355,23:59:59.5,1131,40.45293,-3.6585453,\n"
+    )
+    parsed = parse_session(filepath)
+
+    assert np.isnan(parsed.columns["latitude"][0])
+    assert np.isnan(parsed.columns["azimuth"][1])
+    np.testing.assert_array_equal(
+        parsed.columns["timestamp"],
+        np.array(
+            ["2025-06-06T21:59:58.000", "2025-06-06T21:59:59.500"],
+            dtype="datetime64[ms]",
+        ),
+    )
+
+
+def test_parse_session_empty(tmp_path):
+    """
+    Test a session without rows is parsed into empty columns.
+    """
+    filepath = tmp_path / "session.txt"
+    filepath.write_text(
+        json.dumps(SESSION_HEADER)
+        + "\n\nbeacon_id,localized_timestamp,data,latitude,longitude,azimuth\n"
+    )
+    parsed = parse_session(filepath)
+
+    assert parsed.header == SESSION_HEADER
+    assert len(parsed) == 0
+    assert parsed.columns["timestamp"].dtype == np.dtype("datetime64[ms]")
+
+
+def test_session_columns_sidecar(session_file):
+    """
+    Test the columnar sidecar is written next to the file and memory-mapped.
+    """
+    parsed = build_session_columns(session_file)
+    columns_dir = get_columns_dir(session_file)
+    assert columns_dir == session_file.parent / "session.txt.columns"
+    assert (columns_dir / "meta.json").exists()
+
+    loaded = load_session_columns(session_file)
+    assert loaded.beacon_ids == parsed.beacon_ids
+    assert loaded.header == parsed.header
+    for name, values in parsed.columns.items():
+        assert isinstance(loaded.columns[name], np.memmap)
+        np.testing.assert_array_equal(loaded.columns[name], values)
+
+
+def test_session_columns_chunked(session_file, monkeypatch):
+    """
+    Test the sidecar is written chunk by chunk, with the columns of the whole
+    session.
+    """
+    parsed = parse_session(session_file)
+    monkeypatch.setattr(
+        session_columns,
+        "iter_session_chunks",
+        functools.partial(iter_session_chunks, chunk_size=1),
+    )
+    built = build_session_columns(session_file)
+
+    assert len(built) == 4
+    assert built.beacon_ids == parsed.beacon_ids
+    for name, values in parsed.columns.items():
+        assert built.columns[name].dtype == values.dtype
+        np.testing.assert_array_equal(built.columns[name], values)
+
+
+def test_session_artifacts_current(session_file):
+    """
+    Test the sidecar and trace pyramid are not built again while current,
+    e.g. for a re-upload of the same contents.
+    """
+    build_session_artifacts(session_file)
+    columns_dir = get_columns_dir(session_file)
+    names = (*ParsedSession.COLUMN_DTYPES, *trace_pyramid.LOD_ARRAYS)
+    assert sorted(path.name for path in columns_dir.iterdir()) == sorted(
+        [f"{name}.npy" for name in names] + ["meta.json"]
+    )
+
+    # files written again get new inodes, being renamed into place
+    inodes = {path.name: path.stat().st_ino for path in columns_dir.iterdir()}
+    parsed = build_session_artifacts(session_file)
+    assert len(parsed) == 4
+    assert inodes == {path.name: path.stat().st_ino for path in columns_dir.iterdir()}
+
+
+def test_compute_session_summaries(session_file):
+    """
+    Test the summary statistics of a session and of each beacon.
+    """
+    summaries = compute_session_summaries(parse_session(session_file))
+
+    assert list(summaries) == [None, "0xe3237b8fd355", "0xd782cb99c626"]
+    whole = summaries[None]
+    assert whole["n_samples"] == 4
+    assert whole["duration_s"] == 4.25
+    # median of the rates of the beacons, not all the samples over the session
+    assert whole["sampling_rate_hz"] == pytest.approx((2 / 2.5 + 2 / 3.5) / 2)
+    # the first sample has no GPS fix
+    assert whole["min_latitude"] == pytest.approx(40.45293)
+    assert whole["max_longitude"] == pytest.approx(-3.6585453)
+    assert whole["data_mean"] == pytest.approx(1148.25)
+    assert summaries["0xe3237b8fd355"]["distance_m"] == 0.0
+    assert summaries["0xd782cb99c626"]["distance_m"] > 0.0
+
+
+def test_route_distance():
+    """
+    Test the haversine route length, skipping points without GPS fix.
+    """
+    latitude = np.array([0.0, np.nan, 1.0, 1.0])
+    longitude = np.array([0.0, np.nan, 0.0, 1.0])
+    # one degree of latitude, then one of longitude at 1 degree north
+    assert route_distance(latitude, longitude) == pytest.approx(
+        111_195 + 111_178, rel=1e-3
+    )
+    assert route_distance(latitude[:1], longitude[:1]) == 0.0
+
+
+def test_douglas_peucker_significance():
+    """
+    Test the significance of the points of a polyline is nested by tolerance.
+    """
+    x = np.arange(7, dtype=np.float64)
+    y = np.array([0, 0, 4, 0, 0, 0.5, 0], dtype=np.float64)
+    significance = douglas_peucker_significance(x, y, min_tolerance=0.1)
+
+    assert np.isinf(significance[[0, -1]]).all()
+    assert significance[2] == 4  # the spike is kept first
+    assert (significance[[1, 3, 4, 5]] < 4).all()
+    # levels are nested: coarser levels are subsets of finer ones
+    assert set(np.flatnonzero(significance >= 1)) <= set(
+        np.flatnonzero(significance >= 0.1)
+    )
+
+    # collinear points are never kept
+    significance = douglas_peucker_significance(x, np.zeros(7), min_tolerance=0.1)
+    assert (significance[1:-1] == 0).all()
+
+
+def test_query_viewport(tmp_path, session_content):
+    """
+    Test viewport queries return fewer points when zoomed out or filtered.
+    """
+    filepath = tmp_path / "session.txt"
+    filepath.write_bytes(session_content)
+    # built by the processing job, not by the queries
+    with pytest.raises(FileNotFoundError):
+        query_viewport(filepath, zoom=20)
+    build_session_artifacts(filepath)
+
+    full = query_viewport(filepath, zoom=20)
+    assert full["properties"]["bounds"] is not None
+    feature = full["features"][0]
+    assert feature["properties"]["n_points_total"] == 990
+    n_full = sum(len(line) for line in feature["geometry"]["coordinates"])
+    assert n_full > 100
+    # the test route winds slightly, so zoomed out it simplifies to its ends
+    coarse = query_viewport(filepath, zoom=2)["features"][0]
+    assert sum(len(line) for line in coarse["geometry"]["coordinates"]) == 2
+    assert coarse["properties"]["data_min"][0][0] == 1000
+    assert coarse["properties"]["data_max"][0][0] == 1499
+
+    min_lon, min_lat, max_lon, max_lat = full["properties"]["bounds"]
+    half = (min_lon, min_lat, (min_lon + max_lon) / 2, max_lat)
+    visible = query_viewport(filepath, zoom=20, bbox=half)["features"][0]
+    n_visible = sum(len(line) for line in visible["geometry"]["coordinates"])
+    assert 0 < n_visible < n_full
+
+
+def test_query_viewport_decimated(tmp_path, session_content):
+    """
+    Test traces with more visible points than the maximum are decimated in
+    lines, not in isolated points, keeping the data range of the samples.
+    """
+    filepath = tmp_path / "session.txt"
+    filepath.write_bytes(session_content)
+    build_session_artifacts(filepath)
+    full = query_viewport(filepath, zoom=20)
+    (full_line,) = full["features"][0]["geometry"]["coordinates"]
+    (data,) = full["features"][0]["properties"]["data"]
+    min_lon, min_lat, max_lon, max_lat = full["properties"]["bounds"]
+
+    for bbox in (None, (min_lon, min_lat, max_lon, (min_lat + max_lat) / 2)):
+        feature = query_viewport(filepath, zoom=20, bbox=bbox, max_points=50)[
+            "features"
+        ][0]
+        lines = feature["geometry"]["coordinates"]
+        assert len(lines) == 1
+        assert 2 < len(lines[0]) <= 50 < len(full_line)
+        assert feature["properties"]["data"][0][0] == data[0]
+
+    # the whole trace, decimated, still spans the whole data range
+    properties = query_viewport(filepath, zoom=20, max_points=50)[
+        "features"
+    ][0]["properties"]
+    assert min(properties["data_min"][0]) == min(data)
+    assert max(properties["data_max"][0]) == max(data)
+
+
+def test_select_viewport_runs():
+    """
+    Test the visible runs of a trace are lines crossing the viewport, of two
+    points at least, and hold at most the maximum of points in total.
+    """
+    select_runs = trace_pyramid._select_runs
+    # a segment crossing the viewport, with both ends outside
+    ((run, selected),) = select_runs(
+        np.array([0.0, 10.0]), np.zeros(2), (4, -1, 6, 1), 100
+    )
+    assert run.tolist() == [0, 1] and selected.tolist() == [0, 1]
+    # a single point is no line
+    assert select_runs(np.array([5.0]), np.array([5.0]), (4, 4, 6, 6), 100) == []
+    assert select_runs(np.array([5.0]), np.array([5.0]), None, 100) == []
+
+    # in and out of the viewport: many short runs
+    lon = np.tile([0.0, 100.0, 100.0, 100.0], 20)
+    lat = np.tile([0.0, 100.0, 100.0, 100.0], 20)
+    runs = select_runs(lon, lat, (-1, -1, 1, 1), 100)
+    assert len(runs) == 20
+    assert all(len(run) >= 2 for run, _ in runs)
+    for max_points in (10, 11, 45):
+        runs = select_runs(lon, lat, (-1, -1, 1, 1), max_points)
+        assert 0 < sum(len(selected) for _, selected in runs) <= max_points
+        for run, selected in runs:
+            assert selected[0] == 0 and selected[-1] == len(run) - 1
+
+
+def test_iter_sessions_zip(tmp_path, session_content):
+    """
+    Test the streamed archive stores compressed files as they are, deflates the
+    others, and is built in parts of bounded size.
+    """
+    compressed = tmp_path / "a.txt.gz"
+    compressed.write_bytes(gzip.compress(session_content))
+    plain = tmp_path / "b.txt"
+    plain.write_bytes(session_content)
+    large = tmp_path / "c.txt"
+    large.write_bytes(os.urandom(3 * 1024 * 1024))
+
+    chunk_size = 64 * 1024
+    storage = LocalStorage(tmp_path)
+    entries = [
+        (filepath.name, storage, filepath.name)
+        for filepath in (compressed, plain, large)
+    ]
+    parts = list(iter_sessions_zip(entries, chunk_size))
+    assert max(len(part) for part in parts) < 2 * chunk_size
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(parts))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ["a.txt.gz", "b.txt", "c.txt"]
+        assert archive.getinfo("a.txt.gz").compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo("b.txt").compress_type == zipfile.ZIP_DEFLATED
+        assert archive.read("a.txt.gz") == compressed.read_bytes()
+        assert archive.read("b.txt") == session_content
+        assert archive.read("c.txt") == large.read_bytes()
+
+
+def test_ensure_dir_cached(tmp_path, monkeypatch):
+    """
+    Test the directories of the blob store are created once per process.
+    """
+    directory = tmp_path / "ab" / "cd"
+    assert ensure_dir(directory) == directory
+    assert directory.is_dir()
+
+    calls = []
+    monkeypatch.setattr(Path, "mkdir", lambda *args, **kwargs: calls.append(args))
+    ensure_dir(directory)
+    assert calls == []
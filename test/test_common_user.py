@@ -0,0 +1,292 @@
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import threading
+
+import pytest
+import sqlalchemy
+from flask_jwt_extended import create_access_token
+from werkzeug.security import generate_password_hash
+
+from flaskr.common_user import (
+    HashingBusyError,
+    get_cached_user_by_email,
+    get_hashing_executor,
+    get_user_by_email,
+    hash_password,
+    passhash_scheme,
+    register_user,
+    valid_login,
+)
+from flaskr import create_app
+from flaskr.common_user import user_cache
+from flaskr.common_user.password_hashing import HashingExecutor
+from flaskr.db_tables import UserCredentials
+
+
+def test_register_user_existing(app, registered_user):
+    """
+    Test registering an existing email, in any case, raises ValueError.
+    """
+    with app.app_context():
+        with pytest.raises(ValueError, match="User already exists"):
+            register_user(
+                usermail=registered_user["email"].upper(),
+                username="other_uname",
+                passHash="cGFzc2hhc2g=",
+                salt="c2FsdA==",
+            )
+
+
+def test_register_user_concurrent(app, unregistered_user):
+    """
+    Test parallel signups with the same email register exactly one user.
+    """
+    n_signups = 8
+    barrier = threading.Barrier(n_signups)
+    # admit all the signups at once in the password hashing
+    app.extensions["hashing_executor"] = HashingExecutor(
+        workers=0, queue_limit=n_signups
+    )
+
+    def signup(i: int) -> bool:
+        with app.app_context():
+            barrier.wait()
+            try:
+                register_user(
+                    usermail=unregistered_user["email"],
+                    username=f"{unregistered_user['username']}{i}",
+                    passHash="cGFzc2hhc2g=",
+                    salt="c2FsdA==",
+                )
+            except ValueError:
+                return False
+            return True
+
+    with ThreadPoolExecutor(max_workers=n_signups) as executor:
+        registered = list(executor.map(signup, range(n_signups)))
+
+    assert registered.count(True) == 1
+    with app.Session() as sql_db:
+        assert (
+            sql_db.query(UserCredentials)
+            .filter_by(email=unregistered_user["email"])
+            .count()
+            == 1
+        )
+
+
+@pytest.fixture()
+def count_queries(app):
+    """
+    Fixture to count the SQL statements run by the app, as a list.
+    """
+    engine = app.Session.kw["bind"]
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    sqlalchemy.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    sqlalchemy.event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def test_user_loaded_once_per_request(client, auth_headers, count_queries):
+    """
+    Test an authenticated request runs at most one query, once the user is cached.
+    """
+    response = client.get("/profile", headers=auth_headers)
+    assert response.status_code == 200
+    assert len(count_queries) == 2  # the user, then the files
+
+    count_queries.clear()
+    response = client.get("/profile", headers=auth_headers)
+    assert response.status_code == 200
+    assert len(count_queries) == 1  # only the files
+
+
+def test_user_cache_invalidation(app, registered_user):
+    """
+    Test the cached user is dropped when it changes through the ORM.
+    """
+    with app.app_context():
+        user = get_cached_user_by_email(registered_user["email"])
+        assert get_cached_user_by_email(registered_user["email"]) is user
+
+        with app.Session() as sql_db:
+            db_user = sql_db.get(UserCredentials, user.id)
+            db_user.username = "new_uname"
+            sql_db.commit()
+
+        cached = get_cached_user_by_email(registered_user["email"])
+        assert cached is not user
+        assert cached.username == "new_uname"
+
+
+def test_deleted_user_token(app, client, unregistered_user):
+    """
+    Test a valid token of a user that does not exist is rejected.
+    """
+    with app.app_context():
+        access_token = create_access_token(identity=unregistered_user["email"])
+    response = client.get(
+        "/api/v1/session/1/status",
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert response.status_code == 401
+    assert response.json["message"] == "User not found"
+
+
+def test_user_cache_bounds(monkeypatch):
+    """
+    Test the cache drops the least recently used users and expired ones.
+    """
+    now = [0.0]
+    monkeypatch.setattr(user_cache.time, "monotonic", lambda: now[0])
+    cache = user_cache.UserCache(maxsize=2, ttl=10)
+    users = [
+        UserCredentials("uname", f"{i}@email.com", "hash", "c2FsdA==")
+        for i in range(3)
+    ]
+    for i, user in enumerate(users):
+        user.id = i
+        cache.put(user.email, user)
+    assert len(cache) == 2
+    assert cache.get(users[0].email) is None
+    assert cache.get(users[2].email) is users[2]
+
+    now[0] = 11.0
+    assert cache.get(users[2].email) is None
+
+
+def test_hashing_executor_bound():
+    """
+    Test the hashing executor rejects calls beyond its limit, until one ends.
+    """
+    executor = HashingExecutor(workers=0, queue_limit=1)
+    started = threading.Barrier(3)
+    finish = threading.Event()
+
+    def slow_hash() -> str:
+        started.wait()
+        finish.wait()
+        return "hash"
+
+    with ThreadPoolExecutor(max_workers=2) as threads:
+        results = [threads.submit(executor.run, slow_hash) for _ in range(2)]
+        started.wait()
+        with pytest.raises(HashingBusyError):
+            executor.run(slow_hash)
+        finish.set()
+        assert [result.result() for result in results] == ["hash", "hash"]
+    assert executor.run(str, 1) == "1"
+
+
+def test_hashing_executor_processes():
+    """
+    Test the worker processes hash as the request threads would.
+    """
+    executor = HashingExecutor(workers=1, queue_limit=0)
+    try:
+        salt = b"0123456789abcdef"
+        assert executor.run(hash_password, "password", salt) == hash_password(
+            "password", salt=salt
+        )
+    finally:
+        executor.shutdown()
+
+
+def test_login_hashing_busy(app, client, registered_user):
+    """
+    Test logins that hash the password get 503 while the password hashing is
+    saturated, and API logins, which only check the client hash, do not.
+    """
+    with app.app_context():
+        executor = get_hashing_executor()
+        for _ in range(executor.max_pending):
+            executor._slots.acquire()
+        with pytest.raises(HashingBusyError):
+            valid_login(registered_user["email"], password=registered_user["password"])
+
+    response = client.post(
+        "/api/v1/login",
+        json={
+            "email": registered_user["email"],
+            "passHash": "some_hash",
+            "app_build_number": 1000000,
+        },
+    )
+    assert response.status_code == 401
+
+    response = client.post(
+        "/login",
+        data={
+            "email": registered_user["email"],
+            "password": registered_user["password"],
+        },
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+    for _ in range(executor.max_pending):
+        executor._slots.release()
+    with app.app_context():
+        user = valid_login(
+            registered_user["email"], password=registered_user["password"]
+        )
+        assert user.email == registered_user["email"]
+
+
+def test_passhash_rehash_on_login(app, registered_user):
+    """
+    Test stored hashes of another scheme are verified, and replaced by one of
+    the configured scheme on login.
+    """
+    with app.app_context():
+        user = get_user_by_email(registered_user["email"])
+        assert passhash_scheme(user.passhash) == "hmac-sha256"
+        pass_hash = hash_password(
+            registered_user["password"], salt=base64.b64decode(user.salt)
+        )
+
+        # a hash stored by the first versions of the server
+        with app.Session() as sql_db:
+            db_user = sql_db.get(UserCredentials, user.id)
+            db_user.passhash = generate_password_hash(pass_hash)
+            sql_db.commit()
+        with pytest.raises(ValueError):
+            valid_login(registered_user["email"], passHash="wrong_hash")
+        assert passhash_scheme(get_user_by_email(user.email).passhash) == "werkzeug"
+
+        valid_login(registered_user["email"], passHash=pass_hash)
+        assert passhash_scheme(get_user_by_email(user.email).passhash) == "hmac-sha256"
+        valid_login(registered_user["email"], passHash=pass_hash)
+        with pytest.raises(ValueError):
+            valid_login(registered_user["email"], passHash="wrong_hash")
+
+        app.config["PASSHASH_SCHEME"] = "werkzeug"
+        valid_login(registered_user["email"], passHash=pass_hash)
+        assert passhash_scheme(get_user_by_email(user.email).passhash) == "werkzeug"
+        valid_login(registered_user["email"], password=registered_user["password"])
+
+
+def test_passhash_pepper_required():
+    """
+    Test the hmac-sha256 scheme requires its own pepper out of development,
+    never taken from another secret.
+    """
+    production = {
+        "SECRET_KEY": "production-secret",
+        "PASSHASH_PEPPER": None,
+        "JOB_WORKERS": 0,
+    }
+    with pytest.raises(ValueError):
+        create_app({**production, "PASSHASH_SCHEME": "hmac-sha256"})
+
+    app = create_app({**production, "PASSHASH_SCHEME": "werkzeug"})
+    assert app.config["PASSHASH_PEPPER"] is None
+    app = create_app({**production, "PASSHASH_PEPPER": "pepper"})
+    assert app.config["PASSHASH_PEPPER"] == "pepper"
+    # development
+    app = create_app({"SECRET_KEY": "dev", "PASSHASH_PEPPER": None, "JOB_WORKERS": 0})
+    assert app.config["PASSHASH_PEPPER"] == "dev"
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+import sqlalchemy
+
+from flaskr.db_engine import (
+    InstrumentedQueuePool,
+    create_db_engine,
+    engine_options,
+)
+
+
+def db_config(uri: str, **settings) -> dict:
+    return {
+        "SQLALCHEMY_DATABASE_URI": uri,
+        "DB_POOL_SIZE": 3,
+        "DB_MAX_OVERFLOW": 2,
+        "DB_POOL_TIMEOUT": 10.0,
+        "DB_POOL_RECYCLE": 1800,
+        "DB_POOL_PRE_PING": True,
+        "DB_STATEMENT_TIMEOUT_MS": 0,
+        "DB_EXECUTEMANY_MODE": "values_plus_batch",
+        **settings,
+    }
+
+
+def test_engine_options_postgresql():
+    """
+    Test the pool and PostgreSQL options are passed to the engine.
+    """
+    options = engine_options(
+        db_config(
+            "postgresql+psycopg2://user:pass@db/vipv", DB_STATEMENT_TIMEOUT_MS=5000
+        )
+    )
+    assert options["poolclass"] is InstrumentedQueuePool
+    assert options["pool_size"] == 3
+    assert options["max_overflow"] == 2
+    assert options["pool_pre_ping"] is True
+    assert options["connect_args"] == {"options": "-c statement_timeout=5000"}
+    assert options["executemany_mode"] == "values_plus_batch"
+
+    # psycopg 3 batches executemany on its own
+    options = engine_options(db_config("postgresql+psycopg://user:pass@db/vipv"))
+    assert "executemany_mode" not in options
+    assert "connect_args" not in options
+
+
+def test_engine_options_sqlite():
+    """
+    Test only the options SQLite supports are passed to the engine.
+    """
+    options = engine_options(db_config("sqlite:///instance/flaskr.db"))
+    assert options["poolclass"] is InstrumentedQueuePool
+    assert "connect_args" not in options
+    assert "executemany_mode" not in options
+
+    options = engine_options(db_config("sqlite://"))
+    assert "poolclass" not in options
+
+
+def test_db_pool_metrics(app, client):
+    """
+    Test the pool metrics are only served when enabled.
+    """
+    response = client.get("/api/v1/metrics/db_pool")
+    assert response.status_code == 404
+
+    app.config["DB_POOL_METRICS"] = True
+    with app.Session() as sql_db:
+        sql_db.execute(sqlalchemy.text("SELECT 1"))
+    response = client.get("/api/v1/metrics/db_pool")
+    assert response.status_code == 200
+    assert response.json["pid"] == os.getpid()
+    assert response.json["pool_class"] == "InstrumentedQueuePool"
+    assert response.json["checkouts"] >= 1
+    assert response.json["checked_out"] == 0
+    assert response.json["checkout_wait_s_max"] >= 0.0
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_engine_disposed_after_fork(tmp_path):
+    """
+    Test a forked child does not reuse the pooled connections of its parent.
+    """
+    engine = create_db_engine(db_config(f"sqlite:///{tmp_path / 'fork.db'}"))
+    with engine.connect() as connection:
+        connection.execute(sqlalchemy.text("SELECT 1"))
+    assert engine.pool.checkedin() == 1
+
+    pid = os.fork()
+    if pid == 0:  # child
+        os._exit(0 if engine.pool.checkedin() == 0 else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert engine.pool.checkedin() == 1
+    engine.dispose()
@@ -0,0 +1,122 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy
+
+from flaskr import db_migrations
+from flaskr.db_tables import Base
+from flaskr.db_migrations import upgrade_schema
+
+
+# tables as created by the first versions of the server, without indexes
+OLD_SCHEMA = [
+    'CREATE TABLE "UserCredentials" (id INTEGER PRIMARY KEY, '
+    "username VARCHAR(21) NOT NULL, email VARCHAR(80) NOT NULL, "
+    "passhash VARCHAR(180) NOT NULL, salt VARCHAR(50) NOT NULL)",
+    'CREATE TABLE "SessionFiles" (id INTEGER PRIMARY KEY, user_id INTEGER, '
+    "filename VARCHAR(100) NOT NULL)",
+    # a table missing a nullable column
+    'CREATE TABLE "ProcessingJobs" (id INTEGER PRIMARY KEY, '
+    "file_id INTEGER NOT NULL, kind VARCHAR(30) NOT NULL, "
+    "status VARCHAR(10) NOT NULL, attempts INTEGER NOT NULL, "
+    "created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL, "
+    "run_after DATETIME NOT NULL)",
+]
+
+
+def old_database(tmp_path, rows=()):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        for statement in (*OLD_SCHEMA, *rows):
+            connection.execute(sqlalchemy.text(statement))
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def index_names(engine, table_name):
+    return {i["name"] for i in sqlalchemy.inspect(engine).get_indexes(table_name)}
+
+
+def test_upgrade_schema(tmp_path):
+    """
+    Test the missing indexes and nullable columns are added, only once.
+    """
+    engine = old_database(tmp_path)
+
+    changes = upgrade_schema(engine)
+    assert "created index ix_UserCredentials_email" in changes
+    assert "created index ix_SessionFiles_user_id_filename" in changes
+    assert "added column ProcessingJobs.last_error" in changes
+    for column in (
+        "version_scheme", "app_version", "timezone", "device_model", "n_beacons"
+    ):
+        assert f"created index ix_SessionFiles_{column}" in changes
+
+    (index,) = sqlalchemy.inspect(engine).get_indexes("UserCredentials")
+    assert index["name"] == "ix_UserCredentials_email"
+    assert index["column_names"] == ["email"]
+    assert index["unique"]
+    columns = sqlalchemy.inspect(engine).get_columns("ProcessingJobs")
+    assert "last_error" in {c["name"] for c in columns}
+
+    assert upgrade_schema(engine) == []
+
+
+def test_upgrade_schema_duplicates(tmp_path):
+    """
+    Test a unique index is skipped while the table has duplicated rows.
+    """
+    engine = old_database(
+        tmp_path,
+        rows=[
+            'INSERT INTO "SessionFiles" (user_id, filename) VALUES (1, "a.txt")',
+            'INSERT INTO "SessionFiles" (user_id, filename) VALUES (1, "a.txt")',
+        ],
+    )
+
+    changes = upgrade_schema(engine)
+    assert "created index ix_SessionFiles_user_id_filename" not in changes
+    assert "ix_UserCredentials_email" in index_names(engine, "UserCredentials")
+    assert "ix_SessionFiles_user_id_filename" not in index_names(
+        engine, "SessionFiles"
+    )
+
+
+def test_upgrade_schema_concurrent(tmp_path, monkeypatch):
+    """
+    Test several processes upgrading the schema at once all succeed, each
+    change applied by one of them.
+    """
+    engine = old_database(tmp_path)
+    n_processes = 3
+    # all of them inspect the old tables before any adds a column or an index
+    barrier = threading.Barrier(n_processes)
+    waited = threading.local()
+    add_column = db_migrations._add_column
+    create_index = sqlalchemy.Index.create
+
+    def wait_others(step):
+        if not getattr(waited, step, False):
+            setattr(waited, step, True)
+            barrier.wait(timeout=10)
+
+    def add_column_together(*args):
+        wait_others("column")
+        add_column(*args)
+
+    def create_index_together(*args, **kwargs):
+        wait_others("index")
+        create_index(*args, **kwargs)
+
+    monkeypatch.setattr(db_migrations, "_add_column", add_column_together)
+    monkeypatch.setattr(sqlalchemy.Index, "create", create_index_together)
+    with ThreadPoolExecutor(max_workers=n_processes) as executor:
+        results = [
+            executor.submit(upgrade_schema, engine) for _ in range(n_processes)
+        ]
+        results = [result.result() for result in results]
+
+    changes = [change for result in results for change in result]
+    assert changes.count("added column ProcessingJobs.last_error") == 1
+    assert changes.count("created index ix_UserCredentials_email") == 1
+    assert upgrade_schema(engine) == []
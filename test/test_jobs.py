@@ -0,0 +1,212 @@
+import io
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+
+from flaskr import create_app, jobs
+from flaskr.db_tables import ProcessingJobs, SessionFiles
+from flaskr.jobs import (
+    claim_next_job,
+    get_jobs_for_file,
+    job_worker_loop,
+    overall_status,
+    run_pending_jobs,
+)
+
+
+@pytest.fixture()
+def session_file(app, client, auth_headers, session_content) -> SessionFiles:
+    """
+    Fixture to upload a session file, leaving its jobs queued.
+    Returns its database entry.
+    """
+    response = client.post(
+        "/api/v1/session/upload",
+        headers=auth_headers,
+        data={"file": (io.BytesIO(session_content), "session.txt")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 201
+    with app.Session() as sql_db:
+        return sql_db.get(SessionFiles, response.json["file_id"])
+
+
+def test_claim_next_job(app, session_file):
+    """
+    Test a claimed job is marked as running and cannot be claimed again.
+    """
+    with app.app_context():
+        job = claim_next_job()
+        assert job.file_id == session_file.id
+        assert job.status == "running"
+        assert job.attempts == 1
+        assert claim_next_job() is None
+        assert overall_status(get_jobs_for_file(session_file)) == "running"
+
+
+def test_jobs_enqueued_with_file(
+    app, client, auth_headers, session_content, monkeypatch
+):
+    """
+    Test the jobs of a file are enqueued in the transaction storing it: a
+    failure to enqueue them leaves no file without jobs.
+    """
+    def failing_job(self, *args):
+        raise OSError("database hiccup")
+
+    monkeypatch.setattr(ProcessingJobs, "__init__", failing_job)
+    with pytest.raises(OSError):
+        client.post(
+            "/api/v1/session/upload",
+            headers=auth_headers,
+            data={"file": (io.BytesIO(session_content), "session.txt")},
+            content_type="multipart/form-data",
+        )
+    with app.Session() as sql_db:
+        assert sql_db.query(SessionFiles).count() == 0
+
+
+def test_job_heartbeat(app, session_file, monkeypatch):
+    """
+    Test a job running longer than JOB_TIMEOUT is not reclaimed while its
+    worker is alive.
+    """
+    ran = []
+
+    def slow_handler(session_file):
+        ran.append(session_file.id)
+        time.sleep(1.0)
+
+    monkeypatch.setitem(jobs.JOB_HANDLERS, "session_artifacts", slow_handler)
+    monkeypatch.setattr(jobs, "HEARTBEAT_INTERVAL_S", 0.05)
+    monkeypatch.setattr(jobs, "JOB_TIMEOUT", timedelta(seconds=0.3))
+    def run_jobs():
+        with app.app_context():
+            run_pending_jobs()
+
+    with app.app_context():
+        worker = threading.Thread(target=run_jobs)
+        worker.start()
+        deadline = time.monotonic() + 30
+        while not ran:
+            assert time.monotonic() < deadline, "job not run by the worker"
+            time.sleep(0.01)
+        deadline = time.monotonic() + 1.0
+        while worker.is_alive() and time.monotonic() < deadline:
+            assert claim_next_job() is None
+            time.sleep(0.05)
+        worker.join(timeout=30)
+        assert ran == [session_file.id]
+        assert overall_status(get_jobs_for_file(session_file)) == "done"
+
+
+def test_jobs_run_on_startup(app, session_file, monkeypatch):
+    """
+    Test the jobs queued before a server process starts are run by its
+    workers, without waiting for another upload.
+    """
+    ran = []
+    stop = threading.Event()
+    worker_loop = jobs.job_worker_loop
+    monkeypatch.setitem(
+        jobs.JOB_HANDLERS, "session_artifacts", lambda f: ran.append(f.id)
+    )
+    monkeypatch.setattr(
+        jobs, "job_worker_loop", lambda app: worker_loop(app, stop)
+    )
+
+    started = create_app({"TESTING": True, "JOB_WORKERS": 1, "HASH_WORKERS": 0})
+    try:
+        deadline = time.monotonic() + 30
+        while session_file.id not in ran:
+            assert time.monotonic() < deadline, "queued job not run on startup"
+            time.sleep(0.01)
+    finally:
+        stop.set()
+        jobs._job_enqueued.set()
+        for thread in started.extensions["job_workers"][1]:
+            thread.join(timeout=30)
+    with app.app_context():
+        assert overall_status(get_jobs_for_file(session_file)) == "done"
+
+
+def test_job_retry(app, session_file, monkeypatch):
+    """
+    Test unexpected errors are retried after a delay, up to JOB_MAX_ATTEMPTS.
+    """
+    def flaky_handler(session_file):
+        raise OSError("disk hiccup")
+
+    monkeypatch.setitem(jobs.JOB_HANDLERS, "session_artifacts", flaky_handler)
+    monkeypatch.setattr(jobs, "RETRY_BACKOFF_S", 0.0)
+    app.config["JOB_MAX_ATTEMPTS"] = 2
+    with app.app_context():
+        assert run_pending_jobs() == 2
+        (job,) = get_jobs_for_file(session_file)
+        assert job.status == "failed"
+        assert job.attempts == 2
+        assert job.last_error == "OSError: disk hiccup"
+
+
+def test_job_retry_delayed(app, session_file, monkeypatch):
+    """
+    Test a job to retry is not run again before its backoff delay.
+    """
+    def flaky_handler(session_file):
+        raise OSError("disk hiccup")
+
+    monkeypatch.setitem(jobs.JOB_HANDLERS, "session_artifacts", flaky_handler)
+    with app.app_context():
+        assert run_pending_jobs() == 1
+        (job,) = get_jobs_for_file(session_file)
+        assert job.status == "queued"
+        assert job.run_after > job.updated_at
+
+
+def test_job_invalid_file_not_retried(app, client, auth_headers):
+    """
+    Test a job failing on an invalid session file is not retried.
+    """
+    response = client.post(
+        "/api/v1/session/upload",
+        headers=auth_headers,
+        data={"file": (io.BytesIO(b"not a session\n"), "session.txt")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 201
+    with app.app_context():
+        assert run_pending_jobs() == 1
+    response = client.get(response.json["status_url"], headers=auth_headers)
+    assert response.json["status"] == "failed"
+    assert response.json["jobs"][0]["attempts"] == 1
+    assert response.json["jobs"][0]["error"].startswith("JSONDecodeError")
+
+
+def test_session_status_not_found(client, auth_headers):
+    """
+    Test the status of a file of no user is not found.
+    """
+    response = client.get("/api/v1/session/999999/status", headers=auth_headers)
+    assert response.status_code == 404
+
+
+def test_job_worker_loop(app, session_file):
+    """
+    Test a worker thread runs the queued jobs until stopped.
+    """
+    stop = threading.Event()
+    worker = threading.Thread(target=job_worker_loop, args=(app, stop))
+    worker.start()
+    try:
+        with app.app_context():
+            deadline = time.monotonic() + 30
+            while overall_status(get_jobs_for_file(session_file)) != "done":
+                assert time.monotonic() < deadline, "job not run by the worker"
+                time.sleep(0.1)
+    finally:
+        stop.set()
+        jobs._job_enqueued.set()
+        worker.join(timeout=30)
+    assert not worker.is_alive()
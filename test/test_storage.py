@@ -0,0 +1,219 @@
+import io
+import os
+import shutil
+import zipfile
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from flaskr.common_files import LocalStorage, S3Storage, ensure_dir, get_storage
+from flaskr.jobs import run_pending_jobs
+
+
+BUCKET = "vipv-sessions"
+
+
+@pytest.fixture()
+def s3_app(app, monkeypatch):
+    """
+    Fixture to provide the app storing the session files in an S3 bucket,
+    served by moto.
+    """
+    moto = pytest.importorskip("moto")
+    for variable, value in (
+        ("AWS_ACCESS_KEY_ID", "testing"),
+        ("AWS_SECRET_ACCESS_KEY", "testing"),
+        ("AWS_DEFAULT_REGION", "us-east-1"),
+    ):
+        monkeypatch.setenv(variable, value)
+    app.config.update(
+        {
+            "SESSION_STORAGE": "s3",
+            "SESSION_STORAGE_S3_BUCKET": BUCKET,
+            "SESSION_STORAGE_S3_PREFIX": "sessions/",
+        }
+    )
+    with moto.mock_aws():
+        with app.app_context():
+            get_storage().client.create_bucket(Bucket=BUCKET)
+        yield app
+
+
+@pytest.fixture(params=["local", "s3"])
+def storage(request, app, tmp_path):
+    """
+    Fixture to provide each storage backend, with a local directory.
+    """
+    if request.param == "local":
+        yield LocalStorage(tmp_path / "store")
+        return
+    s3_app = request.getfixturevalue("s3_app")
+    with s3_app.app_context():
+        yield get_storage()
+
+
+def test_storage_backend(storage, tmp_path):
+    """
+    Test the storage backends store, stream, move and delete files.
+    """
+    key = "ab/cd/abcd.gz"
+    source = tmp_path / "upload.gz"
+    source.write_bytes(b"0123456789")
+    assert storage.info(key) is None
+    assert storage.local_path(key) is None
+
+    storage.store_file(key, source)
+    assert not source.exists()
+    assert storage.info(key).size == 10
+    with storage.open(key) as f:
+        assert f.read() == b"0123456789"
+    assert storage.read_range(key, 3, 4) == b"3456"
+    assert storage.read_range(key, 8, 4) == b"89"
+    assert storage.read_range(key, 20, 4) == b""
+    assert storage.local_path(key).read_bytes() == b"0123456789"
+
+    storage.move(key, ".trash/abcd.gz")
+    assert not storage.exists(key)
+    with pytest.raises(FileNotFoundError):
+        storage.open(key)
+    with pytest.raises(FileNotFoundError):
+        storage.move(key, ".trash/abcd.gz")
+    storage.delete(".trash/abcd.gz")
+    assert not storage.exists(".trash/abcd.gz")
+    storage.delete(".trash/abcd.gz")  # already deleted
+
+
+def test_storage_dir_shared(s3_app, tmp_path):
+    """
+    Test a directory stored by a node is copied whole by the other ones.
+    """
+    key = "ab/cd/abcd.columns"
+    with s3_app.app_context():
+        storage = get_storage()
+    other = S3Storage(tmp_path / "other", storage.client, BUCKET, "sessions/")
+    directory = ensure_dir(storage.cache_path(key))
+    (directory / "meta.json").write_text("{}")
+    (directory / ".meta.json.partial").write_text("")
+    assert other.fetch_dir(key) is None
+
+    storage.store_dir(key)
+    fetched = other.fetch_dir(key)
+    assert fetched == other.cache_path(key)
+    assert [path.name for path in fetched.iterdir()] == ["meta.json"]
+    assert (fetched / "meta.json").read_text() == "{}"
+
+    other.delete_dir(key)
+    assert fetched.exists()  # the local copy is left
+    shutil.rmtree(fetched)
+    assert other.fetch_dir(key) is None
+
+
+def test_storage_prune_cache(storage, tmp_path):
+    """
+    Test object stores remove their least recently used local copies beyond
+    the maximum size, and local storages remove nothing.
+    """
+    for name in ("old", "used", "new"):
+        source = tmp_path / name
+        source.write_bytes(b"0" * 100)
+        storage.store_file(f"ab/cd/{name}.gz", source)
+        os.utime(storage.cache_path(f"ab/cd/{name}.gz"), (1000, 1000))
+    os.utime(storage.cache_path("ab/cd/new.gz"), (2000, 2000))
+    storage.local_path("ab/cd/used.gz")  # used now
+    # being downloaded
+    (storage.cache_path("ab/cd") / ".download-1").write_bytes(b"0" * 100)
+
+    n_removed = storage.prune_cache(max_bytes=250)
+    cached = {path.name for path in storage.cache_path("ab/cd").iterdir()}
+    if isinstance(storage, LocalStorage):
+        assert n_removed == 0
+        assert cached == {"old.gz", "used.gz", "new.gz", ".download-1"}
+        return
+    assert n_removed == 1
+    assert cached == {"used.gz", "new.gz", ".download-1"}
+    assert storage.prune_cache(max_bytes=0) == 2
+    # copied again when needed
+    assert storage.local_path("ab/cd/old.gz").read_bytes() == b"0" * 100
+
+
+def test_storage_download_url(storage):
+    """
+    Test object stores link to their files, and local storages send them.
+    """
+    url = storage.download_url("ab/cd/abcd.gz", "session.txt", "gzip")
+    if isinstance(storage, LocalStorage):
+        assert url is None
+        return
+    query = parse_qs(urlsplit(url).query)
+    assert query["response-content-disposition"] == [
+        "attachment; filename=session.txt"
+    ]
+    assert query["response-content-encoding"] == ["gzip"]
+
+
+def test_session_files_s3(s3_app, session_content, registered_user):
+    """
+    Test the session files are uploaded to the object store, processed from
+    a local copy, downloaded straight from the store and deleted from it.
+    """
+    client = s3_app.test_client()
+    s3_app.config["SESSION_FILES_COMPRESSION"] = "gzip"
+    with s3_app.app_context():
+        headers = {
+            "Authorization": "Bearer "
+            + create_access_token(identity=registered_user["email"])
+        }
+        storage = get_storage()
+
+    response = client.post(
+        "/api/v1/session/upload",
+        headers=headers,
+        data={"file": (io.BytesIO(session_content), "session.txt")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 201
+    file_id = response.json["file_id"]
+    (stored,) = storage.client.list_objects_v2(Bucket=BUCKET)["Contents"]
+    assert stored["Key"].startswith("sessions/") and stored["Key"].endswith(".gz")
+    key = stored["Key"].removeprefix("sessions/")
+
+    # processed from the local copy, kept from the upload or downloaded
+    storage.cache_path(key).unlink()
+    with s3_app.app_context():
+        assert run_pending_jobs() == 1
+    assert storage.cache_path(key).exists()
+    # on another node, the artifacts are copied from the store, not the file
+    columns_key = key.removesuffix(".gz") + ".columns"
+    storage.cache_path(key).unlink()
+    shutil.rmtree(storage.cache_path(columns_key))
+    response = client.get(
+        "/profile/session_trace/viewport?filename=session.txt&zoom=10", headers=headers
+    )
+    assert response.status_code == 200
+    assert storage.cache_path(columns_key).exists()
+    assert not storage.cache_path(key).exists()
+
+    response = client.get(
+        "/profile/download_session?filename=session.txt",
+        headers={**headers, "Accept-Encoding": "gzip"},
+    )
+    assert response.status_code == 302
+    assert urlsplit(response.location).path.endswith(f"/sessions/{key}")
+    assert "private" in response.headers["Cache-Control"]
+    # without gzip support, decompressed by the server
+    response = client.get(
+        "/profile/download_session?filename=session.txt", headers=headers
+    )
+    assert response.status_code == 200
+    assert response.get_data() == session_content
+
+    response = client.get("/profile/download_sessions", headers=headers)
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+        assert archive.namelist() == ["session.txt.gz"]
+
+    response = client.delete(f"/api/v1/session/{file_id}", headers=headers)
+    assert response.status_code == 200
+    assert "Contents" not in storage.client.list_objects_v2(Bucket=BUCKET)
+    assert not storage.cache_path(key).exists()
+    assert not storage.cache_path(key.removesuffix(".gz") + ".columns").exists()
@@ -0,0 +1,267 @@
+import gzip
+import io
+import shutil
+import zipfile
+from pathlib import Path
+from urllib.parse import quote
+
+import pytest
+
+from flaskr.db_tables import SessionFiles
+from flaskr.common_files import get_session_summaries
+from flaskr.common_files.session_columns import get_columns_dir
+from flaskr.jobs import run_pending_jobs
+
+
+@pytest.fixture()
+def uploaded_session(app, client, auth_headers, session_content, stored_filepath):
+    """
+    Fixture to upload a session file with gzip compression at rest, and run
+    its processing jobs. Returns the stored path.
+    """
+    app.config["SESSION_FILES_COMPRESSION"] = "gzip"
+    response = client.post(
+        "/api/v1/session/upload",
+        headers=auth_headers,
+        data={"file": (io.BytesIO(session_content), "session.txt")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 201
+    with app.app_context():
+        run_pending_jobs()
+    return stored_filepath("session.txt")
+
+
+def test_upload_compressed_at_rest(uploaded_session, session_content):
+    """
+    Test the session file is stored compressed when configured.
+    """
+    assert uploaded_session.exists()
+    assert uploaded_session.stat().st_size < len(session_content)
+    assert gzip.decompress(uploaded_session.read_bytes()) == session_content
+
+
+def test_session_summaries(app, client, auth_headers, uploaded_session):
+    """
+    Test the summary statistics are stored on upload and shown in the profile.
+    """
+    with app.app_context():
+        with app.Session() as sql_db:
+            session_file = sql_db.query(SessionFiles).filter_by(
+                filename="session.txt"
+            ).one()
+        summaries = get_session_summaries(session_file)
+
+    assert [summary.beacon_id for summary in summaries] == [
+        None,
+        "0xe3237b8fd355",
+        "0xd782cb99c626",
+    ]
+    whole = summaries[0]
+    assert whole.n_samples == 2000
+    assert whole.duration_s == 999.0
+    # 1000 samples of each beacon
+    assert whole.sampling_rate_hz == pytest.approx(1000 / 999)
+    assert whole.min_latitude == pytest.approx(40.451)
+    assert whole.max_latitude == pytest.approx(40.5499)
+    # ~11 km north, with both beacons at the same positions
+    assert 10_900 < summaries[1].distance_m < 11_100
+    assert whole.data_min == 1000 and whole.data_max == 1499
+    assert whole.data_p50 == pytest.approx(1249.5)
+
+    response = client.get("/profile", headers=auth_headers)
+    assert response.status_code == 200
+    assert "2000 muestras" in response.get_data(as_text=True)
+
+
+def test_download_session_compressed(
+    client, auth_headers, uploaded_session, session_content
+):
+    """
+    Test a compressed session is served as is to clients accepting gzip.
+    """
+    response = client.get(
+        "/profile/download_session?filename=session.txt",
+        headers={**auth_headers, "Accept-Encoding": "gzip, deflate"},
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "session.txt" in response.headers["Content-Disposition"]
+    assert response.get_data() == uploaded_session.read_bytes()
+
+
+def test_download_session_decompressed(
+    client, auth_headers, uploaded_session, session_content
+):
+    """
+    Test a compressed session is decompressed for clients not accepting gzip.
+    """
+    response = client.get(
+        "/profile/download_session?filename=session.txt",
+        headers={**auth_headers, "Accept-Encoding": "identity"},
+    )
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
+    assert "session.txt" in response.headers["Content-Disposition"]
+    assert response.get_data() == session_content
+
+
+def test_download_session_conditional(client, auth_headers, uploaded_session):
+    """
+    Test repeated downloads get 304, and ranges of the stored bytes get 206.
+    """
+    url = "/profile/download_session?filename=session.txt"
+    headers = {**auth_headers, "Accept-Encoding": "gzip"}
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert "Last-Modified" in response.headers
+    assert "private" in response.headers["Cache-Control"]
+    etag = response.headers["ETag"]
+
+    response = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.get_data() == b""
+
+    response = client.get(url, headers={**headers, "Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.get_data() == uploaded_session.read_bytes()[10:20]
+
+
+def test_download_session_accel_redirect(app, client, auth_headers, uploaded_session):
+    """
+    Test downloads are handed to nginx with X-Accel-Redirect when configured.
+    """
+    app.config["SESSION_FILES_ACCEL_REDIRECT"] = "/_sessions/"
+    response = client.get(
+        "/profile/download_session?filename=session.txt",
+        headers={**auth_headers, "Accept-Encoding": "gzip"},
+    )
+    assert response.status_code == 200
+    assert response.get_data() == b""
+    relative = uploaded_session.relative_to(Path(app.instance_path, "sessions"))
+    assert relative.parts[0] == ".blobs"
+    assert response.headers["X-Accel-Redirect"] == (
+        f"/_sessions/gzip/{quote(relative.as_posix())}"
+    )
+    assert "session.txt" in response.headers["Content-Disposition"]
+
+    # clients not accepting the encoding get it decompressed by the server
+    response = client.get(
+        "/profile/download_session?filename=session.txt",
+        headers={**auth_headers, "Accept-Encoding": "identity"},
+    )
+    assert "X-Accel-Redirect" not in response.headers
+    assert len(response.get_data()) > 0
+
+
+def test_download_sessions_zip(
+    app, client, auth_headers, uploaded_session, session_content
+):
+    """
+    Test all the sessions of the user are downloaded in a zip archive,
+    optionally filtered by the dates of the sessions.
+    """
+    app.config["SESSION_FILES_COMPRESSION"] = None
+    content2 = session_content.replace(b'"app_version": "3"', b'"app_version": "4"')
+    response = client.post(
+        "/api/v1/session/upload",
+        headers=auth_headers,
+        data={"file": (io.BytesIO(content2), "session2.txt")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 201
+
+    response = client.get("/profile/download_sessions", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.mimetype == "application/zip"
+    assert ".zip" in response.headers["Content-Disposition"]
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+        assert archive.namelist() == ["session.txt.gz", "session2.txt"]
+        assert archive.read("session.txt.gz") == uploaded_session.read_bytes()
+        assert archive.read("session2.txt") == content2
+
+    # both sessions were recorded on 2025-06-06, from 06:42:37 to 06:59:17 UTC,
+    # by their headers
+    both = ["session.txt.gz", "session2.txt"]
+    for query, names in (
+        ("from=2025-06-06&to=2025-06-06", both),
+        ("to=2025-06-05", []),
+        ("from=2025-06-07", []),
+        # instants are not extended to the end of their day
+        ("to=2025-06-06T06:30:00", []),
+        ("to=2025-06-06T06:50:00Z", both),
+        # instants with an offset are converted to UTC
+        ("from=2025-06-06T09:00:00%2B02:00", []),
+        ("from=2025-06-06T08:50:00%2B02:00", both),
+    ):
+        response = client.get(
+            f"/profile/download_sessions?{query}", headers=auth_headers
+        )
+        with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+            assert archive.namelist() == names, query
+
+    response = client.get(
+        "/profile/download_sessions?from=yesterday", headers=auth_headers
+    )
+    assert response.status_code == 400
+
+
+def test_session_trace_viewport(client, auth_headers, uploaded_session):
+    """
+    Test the viewport query of the traces of a session.
+    """
+    url = "/profile/session_trace/viewport?filename=session.txt"
+    response = client.get(url + "&zoom=18", headers=auth_headers)
+    assert response.status_code == 200
+    bounds = response.json["properties"]["bounds"]
+    assert len(response.json["features"]) == 2
+
+    bbox = ",".join(str(value) for value in bounds)
+    response = client.get(url + f"&zoom=18&bbox={bbox}", headers=auth_headers)
+    assert response.status_code == 200
+
+    response = client.get(url + "&zoom=18&bbox=1,2,3", headers=auth_headers)
+    assert response.status_code == 400
+    response = client.get(url, headers=auth_headers)
+    assert response.status_code == 400
+
+
+def test_session_trace_viewport_processing(
+    app, client, auth_headers, session_content, stored_filepath
+):
+    """
+    Test the trace of a session is not built within the viewport request:
+    until its processing job builds it, the request gets 503, and the jobs of
+    a session whose artifacts are missing are enqueued again.
+    """
+    response = client.post(
+        "/api/v1/session/upload",
+        headers=auth_headers,
+        data={"file": (io.BytesIO(session_content), "session.txt")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 201
+    url = "/profile/session_trace/viewport?filename=session.txt&zoom=18"
+    response = client.get(url, headers=auth_headers)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "2"
+    columns_dir = get_columns_dir(stored_filepath("session.txt"))
+    assert not columns_dir.exists()
+
+    with app.app_context():
+        assert run_pending_jobs() == 1
+    assert client.get(url, headers=auth_headers).status_code == 200
+
+    # e.g. stored before the processing jobs
+    shutil.rmtree(columns_dir)
+    assert client.get(url, headers=auth_headers).status_code == 503
+    with app.app_context():
+        assert run_pending_jobs() == 1
+    assert client.get(url, headers=auth_headers).status_code == 200
+    response = client.get(
+        "/profile/session_trace/viewport?filename=other.txt&zoom=18",
+        headers=auth_headers,
+    )
+    assert response.status_code == 404
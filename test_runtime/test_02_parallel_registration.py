@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+import uuid
+
+import requests
+import pytest
+
+
+@pytest.mark.parametrize("n_signups", [16, 64])
+def test_parallel_registration_same_email(api_base, n_signups):
+    """
+    Test parallel signups with the same email: exactly one is registered and the
+    others get 409, never a server error.
+    """
+    usermail = f"parallel_{uuid.uuid4().hex[:12]}@email.com"
+    register_data = {
+        "email": usermail,
+        "username": "parallel",
+        "passHash": "cGFzc2hhc2g=",
+        "passSalt": "c2FsdA==",
+    }
+
+    def signup(_):
+        return requests.post(f"{api_base}/register", json=register_data).status_code
+
+    with ThreadPoolExecutor(max_workers=n_signups) as executor:
+        status_codes = list(executor.map(signup, range(n_signups)))
+
+    assert status_codes.count(201) == 1, status_codes
+    assert status_codes.count(409) == n_signups - 1, status_codes
+
+
+def test_parallel_registration_distinct_emails(api_base):
+    """
+    Test parallel signups with distinct emails are all registered.
+    """
+    prefix = f"parallel_{uuid.uuid4().hex[:8]}"
+
+    def signup(i):
+        register_data = {
+            "email": f"{prefix}_{i}@email.com",
+            "username": "parallel",
+            "passHash": "cGFzc2hhc2g=",
+            "passSalt": "c2FsdA==",
+        }
+        return requests.post(f"{api_base}/register", json=register_data).status_code
+
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        status_codes = list(executor.map(signup, range(64)))
+
+    assert status_codes == [201] * 64
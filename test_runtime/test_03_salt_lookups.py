@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+import statistics
+import time
+import uuid
+
+import requests
+
+
+def test_salt_lookups_mixed_load(api_base, registered_user):
+    """
+    Test many parallel salt lookups, of registered and unregistered emails:
+    all are answered quickly with a salt, and both kinds take the same time.
+    """
+    n_lookups = 256
+    emails = [
+        registered_user["email"] if i % 2 else f"unknown_{uuid.uuid4().hex}@email.com"
+        for i in range(n_lookups)
+    ]
+
+    def lookup(email):
+        start = time.perf_counter()
+        response = requests.get(f"{api_base}/salt", headers={"email": email})
+        return response.status_code, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        results = list(executor.map(lookup, emails))
+    elapsed = time.perf_counter() - start
+
+    assert [status for status, _ in results] == [200] * n_lookups
+    registered = [latency for _, latency in results[1::2]]
+    unregistered = [latency for _, latency in results[::2]]
+    # with a 1.5 s delay per unknown email, it took over a minute on 3 workers
+    assert elapsed < 30, elapsed
+    assert max(unregistered) < 5, max(unregistered)
+    assert (
+        abs(statistics.median(registered) - statistics.median(unregistered)) < 0.05
+    ), (statistics.median(registered), statistics.median(unregistered))
+
+
+def test_salt_unregistered_email_stable(api_base):
+    """
+    Test an unregistered email always gets the same salt.
+    """
+    email = f"unknown_{uuid.uuid4().hex}@email.com"
+    salts = {
+        requests.get(f"{api_base}/salt", headers={"email": email}).json()["passSalt"]
+        for _ in range(3)
+    }
+    assert len(salts) == 1